@@ -0,0 +1,306 @@
+# Структурированный журнал действий (JSONL) с разреженным индексом
+
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# Записей в одном блоке индекса (и в одном gzip-блоке архива)
+ACTION_BLOCK_RECORDS = 256
+# Сколько дней хранить архивы журнала
+ACTION_RETENTION_DAYS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_action_path(day: str) -> str:
+    """Путь к журналу действий за день YYYY-MM-DD"""
+    return f"logs/actions_{day}.jsonl"
+
+
+def _index_path(path: str) -> str:
+    return path[:-len('.jsonl')] + '.idx.json'
+
+
+def _plain(value):
+    """'10⭐' / '+5⭐' -> 10 / 5, остальное без изменений"""
+    if isinstance(value, str) and value.endswith('⭐'):
+        try:
+            return int(value[:-1])
+        except ValueError:
+            return value
+    return value
+
+
+def _empty_index() -> Dict:
+    # blocks: [{'offset', 'ts', 'count'}] - разреженный индекс время -> смещение
+    # users: {user_id: [номера блоков]}
+    return {'blocks': [], 'users': {}, 'size': 0}
+
+
+def _add_to_index(index: Dict, offset: int, ts: float, user_id):
+    blocks = index['blocks']
+    if not blocks or blocks[-1]['count'] >= ACTION_BLOCK_RECORDS:
+        blocks.append({'offset': offset, 'ts': ts, 'count': 0})
+    blocks[-1]['count'] += 1
+    if user_id is not None:
+        user_blocks = index['users'].setdefault(str(user_id), [])
+        if not user_blocks or user_blocks[-1] != len(blocks) - 1:
+            user_blocks.append(len(blocks) - 1)
+
+
+def build_index(path: str) -> Dict:
+    """Построить индекс одним проходом по файлу журнала"""
+    index = _empty_index()
+    offset = 0
+    with open(path, 'rb') as f:
+        for raw in f:
+            try:
+                rec = json.loads(raw)
+                _add_to_index(index, offset, rec['ts'], rec.get('user_id'))
+            except (ValueError, KeyError):
+                pass
+            offset += len(raw)
+    index['size'] = offset
+    return index
+
+
+def _save_index(path: str, index: Dict):
+    tmp = _index_path(path) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp, _index_path(path))
+
+
+def _load_index(path: str) -> Optional[Dict]:
+    try:
+        with open(_index_path(path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class ActionLogHandler(logging.Handler):
+    """
+    Пишет действия в logs/actions_<день>.jsonl и ведет индекс блоков.
+    Работает в фоновом потоке логирования; индекс сохраняется при закрытии блока и смене дня
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.day = None
+        self.path = None
+        self.stream = None
+        self.index = _empty_index()
+        self.flushed_size = 0
+        self._saved_blocks = 0
+        self._lock = threading.Lock()
+
+    def _open_day(self, day: str):
+        self.day = day
+        self.path = get_action_path(day)
+        index = _load_index(self.path)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if index is None or index.get('size') != size:
+            # Индекс отсутствует или отстал (падение) - перестраиваем по файлу
+            index = build_index(self.path) if size else _empty_index()
+        self.stream = open(self.path, 'ab')
+        with self._lock:
+            self.index = index
+            self.flushed_size = size
+        self._saved_blocks = len(index['blocks'])
+
+    def _close_day(self):
+        if self.stream is None:
+            return
+        self.flush()
+        self.stream.close()
+        self.stream = None
+        _save_index(self.path, self.index)
+
+    def rotate(self, day: str):
+        """Закрыть текущий день и открыть новый (архивирует archive_action_logs)"""
+        self._close_day()
+        self._open_day(day)
+
+    def emit(self, record):
+        action = getattr(record, 'action', None)
+        if action is None:
+            return
+        try:
+            day = time.strftime('%Y-%m-%d', time.localtime(record.created))
+            if day != self.day:
+                self._close_day()
+                self._open_day(day)
+
+            user_id = getattr(record, 'user_id', None)
+            entry = {'ts': round(record.created, 3), 'action': action, 'user_id': user_id}
+            username = getattr(record, 'username', None)
+            if username:
+                entry['username'] = username
+            for k, v in (getattr(record, 'action_fields', None) or {}).items():
+                entry[k] = _plain(v)
+
+            line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+            offset = self.index['size']
+            self.stream.write(line)
+            with self._lock:
+                _add_to_index(self.index, offset, entry['ts'], user_id)
+                self.index['size'] = offset + len(line)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.stream is None:
+            return
+        self.stream.flush()
+        with self._lock:
+            self.flushed_size = self.index['size']
+        # Индекс на диске обновляется при закрытии блока
+        if len(self.index['blocks']) != self._saved_blocks:
+            _save_index(self.path, self.index)
+            self._saved_blocks = len(self.index['blocks'])
+
+    def close(self):
+        self._close_day()
+        super().close()
+
+    def snapshot(self):
+        """Путь, копия индекса и записанный на диск размер активного файла (для запросов)"""
+        with self._lock:
+            if self.path is None:
+                return None, None, 0
+            index = {
+                'blocks': [dict(b) for b in self.index['blocks']],
+                'users': {k: list(v) for k, v in self.index['users'].items()}
+            }
+            return self.path, index, self.flushed_size
+
+
+action_handler = ActionLogHandler()
+
+
+def archive_action_logs(active_day: str):
+    """
+    Сжать закрытые дни поблочно: каждый блок - отдельный gzip-член, его смещение
+    записывается в индекс, поэтому из архива читаются только нужные блоки
+
+    Args:
+        active_day: Текущий день (его файл еще пишется)
+    """
+    active = {os.path.abspath(get_action_path(active_day))}
+    if action_handler.path:
+        active.add(os.path.abspath(action_handler.path))
+    for path in glob.glob('logs/actions_*.jsonl'):
+        if os.path.abspath(path) in active:
+            continue
+        try:
+            index = _load_index(path)
+            if index is None or index.get('size') != os.path.getsize(path):
+                index = build_index(path)
+            blocks = index['blocks']
+            with open(path, 'rb') as src, open(path + '.gz.tmp', 'wb') as dst:
+                for i, block in enumerate(blocks):
+                    end = blocks[i + 1]['offset'] if i + 1 < len(blocks) else index['size']
+                    src.seek(block['offset'])
+                    data = gzip.compress(src.read(end - block['offset']))
+                    block['gz_offset'] = dst.tell()
+                    block['gz_size'] = len(data)
+                    dst.write(data)
+            os.replace(path + '.gz.tmp', path + '.gz')
+            # Индекс переключается на архив только когда архив уже на месте
+            index['archived'] = True
+            _save_index(path, index)
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"Ошибка архивации журнала {path}: {e}")
+
+    cutoff = (datetime.now() - timedelta(days=ACTION_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    for path in glob.glob('logs/actions_*.jsonl.gz'):
+        day = os.path.basename(path)[len('actions_'):-len('.jsonl.gz')]
+        if day < cutoff:
+            for stale in (path, _index_path(path[:-len('.gz')])):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+def _read_blocks(path: str, index: Dict, block_ids: List[int], limit_size: int):
+    """Прочитать записи выбранных блоков из .jsonl или поблочного .jsonl.gz"""
+    blocks = index['blocks']
+    archived = index.get('archived')
+    file_path = path + '.gz' if archived else path
+    with open(file_path, 'rb') as f:
+        for i in block_ids:
+            block = blocks[i]
+            if archived:
+                f.seek(block['gz_offset'])
+                data = gzip.decompress(f.read(block['gz_size']))
+            else:
+                end = blocks[i + 1]['offset'] if i + 1 < len(blocks) else limit_size
+                end = min(end, limit_size)
+                if end <= block['offset']:
+                    continue
+                f.seek(block['offset'])
+                data = f.read(end - block['offset'])
+            for raw in data.splitlines():
+                try:
+                    yield json.loads(raw)
+                except ValueError:
+                    continue
+
+
+def query_user_actions(user_id: int, date_from: str = None, date_to: str = None,
+                       limit: int = 50) -> List[Dict]:
+    """
+    Действия пользователя за период (YYYY-MM-DD включительно), самые новые - последние.
+    Читаются только блоки индекса, где встречается пользователь и которые попадают в период
+
+    Args:
+        user_id: ID пользователя
+        date_from: Начало периода (по умолчанию - ACTION_RETENTION_DAYS назад)
+        date_to: Конец периода (по умолчанию - сегодня)
+        limit: Сколько последних записей вернуть
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    date_to = date_to or today
+    date_from = date_from or (datetime.now() - timedelta(days=ACTION_RETENTION_DAYS)).strftime('%Y-%m-%d')
+    ts_from = time.mktime(time.strptime(date_from, '%Y-%m-%d'))
+    ts_to = time.mktime(time.strptime(date_to, '%Y-%m-%d')) + 86400
+
+    active_path, active_index, active_size = action_handler.snapshot()
+    results = []
+    day = datetime.strptime(date_from, '%Y-%m-%d')
+    last = datetime.strptime(date_to, '%Y-%m-%d')
+    while day <= last:
+        path = get_action_path(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+
+        if path == active_path:
+            index, size = active_index, active_size
+        else:
+            index = _load_index(path)
+            if index is None:
+                if not os.path.exists(path):
+                    continue
+                index = build_index(path)
+            size = index.get('size', 0)
+
+        blocks = index['blocks']
+        block_ids = [
+            i for i in index['users'].get(str(user_id), [])
+            if blocks[i]['ts'] < ts_to and (i + 1 >= len(blocks) or blocks[i + 1]['ts'] >= ts_from)
+        ]
+        if not block_ids:
+            continue
+        for rec in _read_blocks(path, index, block_ids, size):
+            if rec.get('user_id') == user_id and ts_from <= rec['ts'] < ts_to:
+                results.append(rec)
+
+    return results[-limit:]
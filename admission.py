@@ -0,0 +1,75 @@
+# Допуск новых игр: ограничение одновременных игр и сброс нагрузки при перегрузке
+
+from collections import Counter
+from typing import Optional
+
+from config import GAME_MAX_IN_FLIGHT, GAME_MAX_PER_USER, GAME_MAX_LOOP_LAG, GAME_MAX_LOG_QUEUE
+from logger import log_queue
+from loop_monitor import loop_monitor
+from metrics import registry
+
+games_rejected_total = registry.counter('bot_games_rejected_total', 'Игры, не допущенные из-за нагрузки')
+
+# Тексты отказа по причинам
+BUSY_MESSAGES = {
+    'user': "⏳ Твоя игра еще идет, дождись результата",
+    'global': "⏳ Сейчас идет много игр, попробуй через пару секунд",
+    'overload': "⏳ Бот перегружен, попробуй через пару секунд"
+}
+
+
+class GameAdmission:
+    """
+    Счетчики игр в процессе (бросок, ожидание анимации, расчет, сохранение).
+    Новая игра не допускается, если превышен общий или личный лимит, либо
+    если loop отстает / очередь логов переполнена. Оплаченные игры допускаются всегда
+    """
+
+    def __init__(self, max_global: int = GAME_MAX_IN_FLIGHT, max_per_user: int = GAME_MAX_PER_USER,
+                 max_lag: float = GAME_MAX_LOOP_LAG, max_log_queue: int = GAME_MAX_LOG_QUEUE):
+        self.max_global = max_global
+        self.max_per_user = max_per_user
+        self.max_lag = max_lag
+        self.max_log_queue = max_log_queue
+        self.in_flight = 0
+        self.per_user = Counter()
+
+    def overloaded(self) -> bool:
+        """Процесс не успевает: loop отстает или фоновая запись логов не справляется"""
+        return loop_monitor.recent_lag() > self.max_lag or log_queue.qsize() > self.max_log_queue
+
+    def acquire(self, user_id: int, force: bool = False) -> Optional[str]:
+        """
+        Занять слот игры
+
+        Args:
+            force: Допустить без проверок (игра уже оплачена)
+
+        Returns:
+            str: Причина отказа ('user', 'global', 'overload') или None, если слот занят
+        """
+        if not force:
+            reason = None
+            if self.per_user[user_id] >= self.max_per_user:
+                reason = 'user'
+            elif self.in_flight >= self.max_global:
+                reason = 'global'
+            elif self.overloaded():
+                reason = 'overload'
+            if reason:
+                games_rejected_total.inc(reason=reason)
+                return reason
+        self.in_flight += 1
+        self.per_user[user_id] += 1
+        return None
+
+    def release(self, user_id: int):
+        """Освободить слот после расчета игры"""
+        self.in_flight -= 1
+        self.per_user[user_id] -= 1
+        if self.per_user[user_id] <= 0:
+            del self.per_user[user_id]
+
+
+game_admission = GameAdmission()
+registry.gauge('bot_games_in_flight', 'Игры в процессе', lambda: game_admission.in_flight)
@@ -0,0 +1,239 @@
+# Анализ коэффициентов: RTP, преимущество казино, дисперсия и риск разорения
+
+import argparse
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+from config import COEFFICIENTS, DICE_FACES, GAME_NAMES, BET_TYPE_NAMES
+from game_logic import determine_game_result, get_rules_text
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен, без него симуляция идет на чистом Python
+    np = None
+
+
+def get_payout_table(game: str, bet_type: str, amount: Optional[int] = None) -> List[float]:
+    """
+    Выплата на единицу ставки для каждого значения кубика (1..DICE_FACES[game])
+
+    Args:
+        game: Эмодзи игры
+        bet_type: Тип ставки
+        amount: Сумма ставки; если передана, учитывается округление int(amount * coefficient)
+
+    Returns:
+        list: Выплата (с учетом возврата ставки) на 1 ⭐ для каждого значения
+    """
+    table = []
+    for dv in range(1, DICE_FACES[game] + 1):
+        res = determine_game_result(game, bet_type, dv)
+        if not res['win']:
+            table.append(0.0)
+        elif amount:
+            table.append(int(amount * res['coefficient']) / amount)
+        else:
+            table.append(float(res['coefficient']))
+    return table
+
+
+def risk_of_ruin(edge: float, variance: float, bankroll_units: float) -> float:
+    """
+    Вероятность того, что банк админа когда-либо уйдет в минус
+    (диффузионное приближение exp(-2 * edge * B / variance))
+
+    Args:
+        edge: Преимущество казино на единицу ставки
+        variance: Дисперсия результата на единицу ставки
+        bankroll_units: Банк админа в единицах ставки
+    """
+    if edge <= 0:
+        return 1.0
+    if variance <= 0:
+        return 0.0
+    return min(1.0, math.exp(-2 * edge * bankroll_units / variance))
+
+
+def analyze_bet(game: str, bet_type: str, amount: Optional[int] = None,
+                bankroll_units: float = 100) -> Dict:
+    """Точные RTP, преимущество казино, дисперсия и риск разорения для одной ставки"""
+    table = get_payout_table(game, bet_type, amount)
+    p = 1 / len(table)
+    rtp = sum(table) * p
+    # Дисперсия результата игрока на 1 ⭐ (ставка - константа и на дисперсию не влияет)
+    variance = sum((x - rtp) ** 2 for x in table) * p
+    edge = 1 - rtp
+    return {
+        'game': game,
+        'bet_type': bet_type,
+        'coefficient': COEFFICIENTS[game][bet_type],
+        'win_probability': sum(1 for x in table if x > 0) * p,
+        'rtp': rtp,
+        'house_edge': edge,
+        'variance': variance,
+        'std': math.sqrt(variance),
+        'risk_of_ruin': risk_of_ruin(edge, variance, bankroll_units)
+    }
+
+
+def analyze_all(amount: Optional[int] = None, bankroll_units: float = 100) -> List[Dict]:
+    """Анализ всех игр и типов ставок из COEFFICIENTS"""
+    return [
+        analyze_bet(game, bet_type, amount, bankroll_units)
+        for game, bets in COEFFICIENTS.items()
+        for bet_type in bets
+    ]
+
+
+def _payout_matrix(bets: List[Tuple[str, str]], amount: int) -> Tuple[list, list]:
+    """Таблица выплат в ⭐ (bet_index x значение) и число значений для каждой ставки"""
+    width = max(DICE_FACES.values())
+    payouts, faces = [], []
+    for game, bet_type in bets:
+        row = [int(amount * x) for x in get_payout_table(game, bet_type)]
+        payouts.append(row + [0] * (width - len(row)))
+        faces.append(DICE_FACES[game])
+    return payouts, faces
+
+
+def _simulate_numpy(payouts, faces, amount, rounds, sims, bankroll, seed, chunk_rounds):
+    """Векторизованная симуляция: прибыль админа по каждой серии"""
+    rng = np.random.default_rng(seed)
+    payouts = np.asarray(payouts, dtype=np.int64)
+    faces = np.asarray(faces, dtype=np.int64)
+    profit = np.zeros(sims, dtype=np.int64)
+    low = np.zeros(sims, dtype=np.int64)
+    done = 0
+    while done < rounds:
+        n = min(chunk_rounds, rounds - done)
+        bet_idx = rng.integers(0, len(faces), size=(sims, n))
+        values = (rng.random((sims, n)) * faces[bet_idx]).astype(np.int64)
+        path = profit[:, None] + np.cumsum(amount - payouts[bet_idx, values], axis=1)
+        low = np.minimum(low, path.min(axis=1))
+        profit = path[:, -1]
+        done += n
+    return profit.tolist(), (low < -bankroll).tolist()
+
+
+def _simulate_python(payouts, faces, amount, rounds, sims, bankroll, seed):
+    """Симуляция без NumPy (медленнее, тот же результат по распределению)"""
+    rng = random.Random(seed)
+    n_bets = len(faces)
+    profits, ruined = [], []
+    for _ in range(sims):
+        profit = low = 0
+        for _ in range(rounds):
+            b = rng.randrange(n_bets)
+            profit += amount - payouts[b][rng.randrange(faces[b])]
+            if profit < low:
+                low = profit
+        profits.append(profit)
+        ruined.append(low < -bankroll)
+    return profits, ruined
+
+
+def simulate_bankroll(bets: Optional[List[Tuple[str, str]]] = None, amount: int = 10,
+                      rounds: int = 10000, sims: int = 1000, bankroll: int = 1000,
+                      seed: Optional[int] = None, chunk_rounds: int = 1000) -> Dict:
+    """
+    Монте-Карло симуляция прибыли админа
+
+    Args:
+        bets: Список (игра, тип ставки); каждая партия выбирает ставку равновероятно.
+              По умолчанию - все ставки из COEFFICIENTS
+        amount: Сумма одной ставки
+        rounds: Количество партий в одной серии
+        sims: Количество серий
+        bankroll: Стартовый банк админа в ⭐
+        seed: Зерно генератора
+        chunk_rounds: Сколько партий обрабатывать за раз (ограничивает память)
+
+    Returns:
+        dict: Средняя прибыль, перцентили, доля серий с разорением
+    """
+    if bets is None:
+        bets = [(game, bet_type) for game, bt in COEFFICIENTS.items() for bet_type in bt]
+    payouts, faces = _payout_matrix(bets, amount)
+
+    if np is not None:
+        profits, ruined = _simulate_numpy(payouts, faces, amount, rounds, sims, bankroll, seed, chunk_rounds)
+    else:
+        profits, ruined = _simulate_python(payouts, faces, amount, rounds, sims, bankroll, seed)
+
+    profits.sort()
+
+    def percentile(q: float) -> int:
+        return profits[min(len(profits) - 1, int(q * len(profits)))]
+
+    return {
+        'rounds': rounds,
+        'sims': sims,
+        'amount': amount,
+        'bankroll': bankroll,
+        'mean_profit': sum(profits) / len(profits),
+        'p5': percentile(0.05),
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'loss_probability': sum(1 for x in profits if x < 0) / len(profits),
+        'ruin_probability': sum(ruined) / len(ruined),
+        'vectorized': np is not None
+    }
+
+
+def format_analysis(rows: List[Dict]) -> str:
+    """Текстовая таблица анализа для админа"""
+    lines = ["📐 RTP / преимущество казино\n"]
+    for r in rows:
+        flag = " ⚠️" if r['house_edge'] <= 0 else ""
+        lines.append(
+            f"{r['game']} {BET_TYPE_NAMES.get(r['bet_type'], r['bet_type'])} x{r['coefficient']}: "
+            f"RTP {r['rtp'] * 100:.1f}% | edge {r['house_edge'] * 100:+.1f}% | "
+            f"σ {r['std']:.2f} | RoR {r['risk_of_ruin'] * 100:.1f}%{flag}"
+        )
+    return "\n".join(lines)
+
+
+def format_simulation(sim: Dict) -> str:
+    """Текстовый отчет симуляции"""
+    return (
+        f"🎲 Симуляция: {sim['sims']} серий × {sim['rounds']} партий по {sim['amount']} ⭐\n"
+        f"📈 Средняя прибыль: {sim['mean_profit']:.0f} ⭐\n"
+        f"📊 P5 / P50 / P95: {sim['p5']} / {sim['p50']} / {sim['p95']} ⭐\n"
+        f"📉 Вероятность убытка: {sim['loss_probability'] * 100:.1f}%\n"
+        f"💥 Разорение при банке {sim['bankroll']} ⭐: {sim['ruin_probability'] * 100:.1f}%"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ коэффициентов COEFFICIENTS")
+    parser.add_argument('--amount', type=int, default=None, help="сумма ставки (учитывает округление выплат)")
+    parser.add_argument('--bankroll-units', type=float, default=100, help="банк админа в ставках для RoR")
+    parser.add_argument('--game', help="эмодзи игры для симуляции (по умолчанию все)")
+    parser.add_argument('--bet', help="тип ставки для симуляции")
+    parser.add_argument('--rounds', type=int, default=10000)
+    parser.add_argument('--sims', type=int, default=1000)
+    parser.add_argument('--bankroll', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--rules', action='store_true', help="вывести сгенерированные правила")
+    args = parser.parse_args()
+
+    if args.rules:
+        print(get_rules_text())
+        return
+
+    print(format_analysis(analyze_all(args.amount, args.bankroll_units)))
+
+    bets = None
+    if args.game:
+        bet_types = [args.bet] if args.bet else list(COEFFICIENTS[args.game])
+        bets = [(args.game, bt) for bt in bet_types]
+        print(f"\n{args.game} {GAME_NAMES[args.game]}")
+    print()
+    print(format_simulation(simulate_bankroll(
+        bets, args.amount or 10, args.rounds, args.sims, args.bankroll, args.seed
+    )))
+
+
+if __name__ == '__main__':
+    main()
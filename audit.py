@@ -0,0 +1,219 @@
+# Сверка балансов с журналом: пополнения - выводы - ставки с баланса + выигрыши + корректировки
+#
+# python audit.py [users_database.json] --top 20
+# В боте: /audit - по снимку users_db, в отдельном процессе (spawn)
+
+import argparse
+import json
+import re
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, Tuple
+
+from config import DB_FILE
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен, без него суммирование идет на чистом Python
+    np = None
+
+# Виды записей журнала (столбцы итоговой таблицы)
+KINDS = ('deposits', 'withdrawals', 'stakes', 'payouts', 'adjustments')
+DEPOSIT, WITHDRAW, STAKE, PAYOUT, ADJUST = range(len(KINDS))
+# Источники ставок, списываемых с баланса (остальные оплачены счетом)
+BALANCE_SOURCES = ('balance', 'table')
+
+_SKIP = re.compile(r'[\s,]*')
+_COLON = re.compile(r'\s*:\s*')
+
+
+def iter_users(db_file: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, Dict]]:
+    """
+    Пользователи из файла БД по одному, без загрузки всего JSON в память:
+    файл читается кусками, каждая запись разбирается json.JSONDecoder.raw_decode
+    """
+    decoder = json.JSONDecoder()
+    with open(db_file, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        pos = buf.index('{') + 1
+        eof = False
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            try:
+                if buf[pos] == '}':
+                    return
+                key, pos_value = decoder.raw_decode(buf, pos)
+                value, end = decoder.raw_decode(buf, _COLON.match(buf, pos_value).end())
+            except (ValueError, IndexError, AttributeError):
+                # Запись оборвалась на границе куска - дочитываем
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield key, value
+            pos = end
+
+
+def flatten(users: Iterable[Tuple[str, Dict]]) -> Dict:
+    """
+    Развернуть платежи, историю и корректировки всех пользователей в столбцы
+
+    Args:
+        users: Пары (user_id, данные) - users_db.items() или iter_users()
+
+    Returns:
+        dict: user_ids и balances (по пользователю), keys (индекс пользователя * len(KINDS) + вид)
+              и values (сумма со знаком) - по записи журнала
+    """
+    width = len(KINDS)
+    user_ids, balances = array('q'), array('q')
+    keys, values = array('q'), array('q')
+    add_key, add_value = keys.append, values.append
+    for i, (uid, ud) in enumerate(users):
+        user_ids.append(int(uid))
+        balances.append(ud.get('balance', 0))
+        base = i * width
+        for p in ud.get('payments', ()):
+            add_key(base + DEPOSIT)
+            add_value(p['amount'])
+            if p.get('refunded'):
+                # Вывод через возврат платежа списывает запрошенную сумму
+                add_key(base + WITHDRAW)
+                add_value(-p.get('refund_amount', p['amount']))
+        for g in ud.get('history', ()):
+            if g.get('payment_id', 'balance') in BALANCE_SOURCES:
+                add_key(base + STAKE)
+                add_value(-g['amount'])
+            # /refund оплаченной игры забирает выигрыш обратно
+            if g['win'] and not g.get('refunded'):
+                add_key(base + PAYOUT)
+                add_value(g['winnings'])
+        for a in ud.get('adjustments', ()):
+            add_key(base + ADJUST)
+            add_value(a['delta'])
+    return {'user_ids': user_ids, 'balances': balances, 'keys': keys, 'values': values}
+
+
+def _totals_numpy(cols: Dict):
+    n, width = len(cols['user_ids']), len(KINDS)
+    keys = np.frombuffer(cols['keys'], dtype=np.int64)
+    values = np.frombuffer(cols['values'], dtype=np.int64)
+    # bincount с весами считает в float64 - суммы в ⭐ далеко от потери точности
+    totals = np.bincount(keys, weights=values, minlength=n * width).round().astype(np.int64).reshape(n, width)
+    balances = np.frombuffer(cols['balances'], dtype=np.int64)
+    diff = balances - totals.sum(axis=1)
+    bad = np.flatnonzero(diff)
+    order = bad[np.argsort(-np.abs(diff[bad]), kind='stable')]
+    return lambda i: totals[i].tolist(), diff, order.tolist(), int(diff.sum()), int(np.abs(diff).sum())
+
+
+def _totals_python(cols: Dict):
+    n, width = len(cols['user_ids']), len(KINDS)
+    flat = array('q', bytes(8 * n * width))
+    for k, v in zip(cols['keys'], cols['values']):
+        flat[k] += v
+    diff = array('q', (b - sum(flat[i * width:(i + 1) * width]) for i, b in enumerate(cols['balances'])))
+    order = sorted((i for i, d in enumerate(diff) if d), key=lambda i: -abs(diff[i]))
+    return lambda i: flat[i * width:(i + 1) * width].tolist(), diff, order, sum(diff), sum(abs(d) for d in diff)
+
+
+def reconcile(cols: Dict, top: int = 10) -> Dict:
+    """
+    Ожидаемый баланс каждого пользователя по журналу и расхождения с фактическим
+
+    Returns:
+        dict: Количество пользователей и записей, число расхождений, их сумма и худшие пользователи
+    """
+    if np is not None:
+        row, diff, order, total, total_abs = _totals_numpy(cols)
+    else:
+        row, diff, order, total, total_abs = _totals_python(cols)
+    offenders = []
+    for i in order[:top]:
+        item = {
+            'user_id': cols['user_ids'][i],
+            'balance': cols['balances'][i],
+            'expected': cols['balances'][i] - int(diff[i]),
+            'diff': int(diff[i])
+        }
+        item.update(zip(KINDS, row(i)))
+        offenders.append(item)
+    return {
+        'users': len(cols['user_ids']),
+        'records': len(cols['keys']),
+        'mismatched': len(order),
+        'diff_total': total,
+        'diff_abs': total_abs,
+        'top': offenders,
+        'vectorized': np is not None
+    }
+
+
+def _timed_audit(users: Iterable[Tuple[str, Dict]], top: int) -> Dict:
+    start = time.perf_counter()
+    cols = flatten(users)
+    flattened = time.perf_counter()
+    result = reconcile(cols, top)
+    result['seconds'] = {
+        'collect': round(flattened - start, 2),
+        'reconcile': round(time.perf_counter() - flattened, 2)
+    }
+    return result
+
+
+def audit_file(db_file: str = DB_FILE, top: int = 10) -> Dict:
+    """Сверка по файлу БД (офлайн): время уходит в основном на разбор JSON"""
+    return _timed_audit(iter_users(db_file), top)
+
+
+def write_snapshot(users: Dict, path: str):
+    """
+    Снимок users_db в файл для сверки в отдельном процессе. Вызывается на цикле событий
+    без await: обработчики не успевают поменять данные посреди записи, и ставка
+    (баланс + история) попадает в снимок целиком или не попадает вовсе
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(users, f, ensure_ascii=False)
+
+
+def format_audit(result: Dict) -> str:
+    """Текстовый отчет сверки для админа"""
+    s = result['seconds']
+    lines = [
+        f"🧾 Сверка балансов: {result['users']} пользователей, {result['records']} записей\n",
+        f"⏱ Сбор {s['collect']} с | расчет {s['reconcile']} с"
+        f"{'' if result['vectorized'] else ' (без NumPy)'}\n"
+    ]
+    if not result['mismatched']:
+        lines.append("✅ Расхождений нет")
+        return "\n".join(lines)
+    lines.append(
+        f"⚠️ Расхождений: {result['mismatched']}\n"
+        f"📊 Сумма: {result['diff_total']:+d} ⭐ (по модулю {result['diff_abs']} ⭐)\n"
+    )
+    for t in result['top']:
+        lines.append(
+            f"👤 {t['user_id']}: баланс {t['balance']}, ожидалось {t['expected']} ({t['diff']:+d})\n"
+            f"   +{t['deposits']} пополн. | {t['withdrawals']} выводы | {t['stakes']} ставки | "
+            f"+{t['payouts']} выигр. | {t['adjustments']:+d} корр."
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка балансов пользователей с журналом операций")
+    parser.add_argument('db_file', nargs='?', default=DB_FILE)
+    parser.add_argument('--top', type=int, default=10, help="сколько худших расхождений показать")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    result = audit_file(args.db_file, args.top)
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_audit(result))
+    if result['mismatched']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
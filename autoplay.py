@@ -0,0 +1,108 @@
+# Автоигра: серия одинаковых ставок с конвейером бросков и пакетным сохранением
+
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+from config import AUTOPLAY_PIPELINE
+from database import get_user_data, save_database
+from game_logic import settle_bet
+from logger import log_game_start, log_win, log_loss
+from throttling import RateLimiter, global_limiter
+
+logger = logging.getLogger(__name__)
+
+# Пользователи с запущенной автоигрой (слот занимает и освобождает вызывающий)
+active_autoplays = set()
+
+
+async def _roll(bot: Bot, chat_limiter: RateLimiter, chat_id: int, game: str):
+    """Один бросок под лимитами чата и бота"""
+    async with chat_limiter, global_limiter:
+        return await bot.send_dice(chat_id=chat_id, emoji=game)
+
+
+async def run_autoplay(bot: Bot, user_id: int, username: Optional[str], game: str, bet_type: str,
+                       amount: int, rounds: int, stop_below: int, stop_on_win: bool,
+                       db_file: str) -> Dict:
+    """
+    Сыграть серию раундов. Броски отправляются конвейером (до AUTOPLAY_PIPELINE
+    одновременно), раунды рассчитываются по мере прихода значений, БД сохраняется один раз
+
+    Args:
+        rounds: Максимум раундов
+        stop_below: Не начинать раунд, если баланс ниже этого значения
+        stop_on_win: Остановиться после первого выигрыша
+
+    Returns:
+        dict: Итоги серии (played, wins, profit, balance, reason)
+    """
+    ud = get_user_data(user_id)
+    # Бросок в личке не чаще раза в секунду, небольшой всплеск для старта
+    chat_limiter = RateLimiter(rate=1, burst=AUTOPLAY_PIPELINE)
+    pending = deque()
+    started = played = wins = profit = 0
+    reason = "rounds"
+
+    def can_start() -> bool:
+        nonlocal reason
+        if reason != "rounds":
+            return False
+        if started >= rounds:
+            return False
+        if ud['balance'] < amount:
+            reason = "balance"
+            return False
+        if ud['balance'] < stop_below:
+            reason = "stop_below"
+            return False
+        return True
+
+    try:
+        while True:
+            while len(pending) < AUTOPLAY_PIPELINE and can_start():
+                # Ставка списывается при отправке броска
+                ud['balance'] -= amount
+                started += 1
+                log_game_start(user_id, game, bet_type, amount, username)
+                pending.append(asyncio.create_task(_roll(bot, chat_limiter, user_id, game)))
+
+            if not pending:
+                break
+
+            try:
+                dm = await pending.popleft()
+            except Exception as e:
+                logger.error(f"Ошибка броска автоигры {user_id}: {e}")
+                ud['balance'] += amount
+                reason = "error"
+                continue
+
+            res, w = settle_bet(ud, game, bet_type, amount, dm.dice.value)
+            played += 1
+            if res['win']:
+                wins += 1
+                profit += w - amount
+                log_win(user_id, game, bet_type, amount, w, username)
+                if stop_on_win and reason == "rounds":
+                    reason = "win"
+            else:
+                profit -= amount
+                log_loss(user_id, game, bet_type, amount, username)
+    finally:
+        # Незавершенные броски (ошибка выше) - возвращаем ставки
+        for task in pending:
+            task.cancel()
+            ud['balance'] += amount
+        save_database(db_file)
+
+    return {
+        'played': played,
+        'wins': wins,
+        'profit': profit,
+        'balance': ud['balance'],
+        'reason': reason
+    }
@@ -0,0 +1 @@
+# Инструменты нагрузочного тестирования и бенчмарков (не используются ботом в работе)
@@ -0,0 +1,209 @@
+# Локальная замена Telegram Bot API для нагрузочных тестов
+#
+# Запуск: python -m bench.fake_bot_api --port 8081 --seed 1
+# Бот: TELEGRAM_API_URL=http://127.0.0.1:8081 python bot.py
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from config import DICE_FACES
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+# Поля запроса, которые aiogram передает JSON-строкой
+JSON_FIELDS = ('reply_markup', 'prices', 'entities', 'caption_entities', 'link_preview_options')
+
+# Методы, отвечающие сообщением
+MESSAGE_METHODS = {
+    'sendMessage', 'sendDice', 'sendInvoice', 'sendDocument', 'sendPhoto',
+    'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'
+}
+# Методы, отвечающие True
+TRUE_METHODS = {
+    'deleteMessage', 'answerPreCheckoutQuery', 'answerCallbackQuery', 'refundStarPayment',
+    'setWebhook', 'deleteWebhook', 'setMyCommands', 'sendChatAction'
+}
+
+
+class FakeBotAPI:
+    """
+    Состояние стенда: счетчики сообщений по чатам, журнал вызовов и значения кубиков.
+    Кубики берутся из очереди чата (POST /control/dice), иначе - фиксированные
+    по эмодзи (--dice) или случайные от seed
+    """
+
+    def __init__(self, seed: Optional[int] = None, fixed_dice: Dict[str, int] = None,
+                 latency: float = 0.0, max_calls: int = 100000):
+        self.rng = random.Random(seed)
+        self.fixed_dice = fixed_dice or {}
+        self.latency = latency
+        self.calls = deque(maxlen=max_calls)
+        self.counts = Counter()
+        self.dice_queues = defaultdict(deque)
+        self._message_ids = Counter()
+        self._seq = 0
+        self.refunded = set()
+
+    def reset(self):
+        self.calls.clear()
+        self.counts.clear()
+        self.dice_queues.clear()
+        self._message_ids.clear()
+        self.refunded.clear()
+
+    def roll(self, chat_id: int, emoji: str) -> int:
+        queue = self.dice_queues.get(chat_id)
+        if queue:
+            return queue.popleft()
+        if emoji in self.fixed_dice:
+            return self.fixed_dice[emoji]
+        return self.rng.randint(1, DICE_FACES.get(emoji, 6))
+
+    def _message(self, chat_id: int, message_id: int = None) -> Dict:
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+            'from': BOT_USER
+        }
+
+    def call(self, method: str, params: Dict):
+        """Выполнить метод API; возвращает (ok, result или описание ошибки)"""
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        result = True
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        elif method in MESSAGE_METHODS:
+            if chat_id is None:
+                return False, "Bad Request: chat_id is empty"
+            edit_id = int(params['message_id']) if method.startswith('edit') and 'message_id' in params else None
+            result = self._message(chat_id, edit_id)
+            if 'text' in params:
+                result['text'] = params['text']
+            if method == 'sendDice':
+                emoji = params.get('emoji', '🎲')
+                result['dice'] = {'emoji': emoji, 'value': self.roll(chat_id, emoji)}
+            elif method == 'sendInvoice':
+                prices = params.get('prices') or []
+                result['invoice'] = {
+                    'title': params.get('title', ''),
+                    'description': params.get('description', ''),
+                    'start_parameter': '',
+                    'currency': params.get('currency', 'XTR'),
+                    'total_amount': sum(p['amount'] for p in prices)
+                }
+            elif method == 'sendDocument':
+                result['document'] = {'file_id': f'doc{result["message_id"]}', 'file_unique_id': 'doc'}
+        elif method == 'refundStarPayment':
+            # Как Telegram: повторный возврат того же платежа отклоняется
+            charge_id = params.get('telegram_payment_charge_id')
+            if charge_id in self.refunded:
+                return False, "Bad Request: CHARGE_ALREADY_REFUNDED"
+            self.refunded.add(charge_id)
+        elif method not in TRUE_METHODS:
+            return False, "Not Found: method not found"
+
+        self._seq += 1
+        self.counts[method] += 1
+        self.calls.append({
+            'seq': self._seq,
+            'method': method,
+            'chat_id': chat_id,
+            'params': {k: v for k, v in params.items() if isinstance(v, (str, int, float, bool, list, dict))},
+            'result': result
+        })
+        return True, result
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = {}
+            for k, v in (await request.post()).items():
+                if isinstance(v, str) and k in JSON_FIELDS:
+                    try:
+                        v = json.loads(v)
+                    except ValueError:
+                        pass
+                params[k] = v
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        ok, result = self.call(method, params)
+        if ok:
+            return web.json_response({'ok': True, 'result': result})
+        code = 404 if result.startswith('Not Found') else 400
+        return web.json_response({'ok': False, 'error_code': code, 'description': result}, status=code)
+
+    async def handle_dice(self, request: web.Request) -> web.Response:
+        """Очередь значений кубика для чата: {"chat_id": 1, "values": [3, 6]}"""
+        data = await request.json()
+        self.dice_queues[int(data['chat_id'])].extend(int(v) for v in data['values'])
+        return web.json_response({'ok': True})
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        """Журнал вызовов: ?chat_id=&method=&since=<seq>"""
+        chat_id = request.query.get('chat_id')
+        method = request.query.get('method')
+        since = int(request.query.get('since', 0))
+        calls = [
+            c for c in self.calls
+            if c['seq'] > since
+            and (chat_id is None or c['chat_id'] == int(chat_id))
+            and (method is None or c['method'] == method)
+        ]
+        return web.json_response(calls)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'seq': self._seq, 'total': sum(self.counts.values()), 'methods': dict(self.counts)})
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'ok': True})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/control/dice', self.handle_dice)
+        app.router.add_get('/control/calls', self.handle_calls)
+        app.router.add_get('/control/stats', self.handle_stats)
+        app.router.add_post('/control/reset', self.handle_reset)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        return app
+
+
+def parse_dice(spec: str) -> Dict[str, int]:
+    """'🎲=6,🏀=5' -> {'🎲': 6, '🏀': 5}"""
+    fixed = {}
+    for part in filter(None, (spec or '').split(',')):
+        emoji, value = part.split('=')
+        fixed[emoji.strip()] = int(value)
+    return fixed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seed', type=int, default=None, help="seed случайных значений кубика")
+    parser.add_argument('--dice', default='', help="фиксированные значения, например '🎲=6,🏀=5'")
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа на каждый вызов")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.seed, parse_dice(args.dice), args.latency_ms / 1000)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# Нагрузочный сценарий: пользователи проходят reply-клавиатуры и оплату через webhook бота
+#
+# 1. python -m bench.fake_bot_api --port 8081 --seed 1
+# 2. RENDER_EXTERNAL_URL=http://127.0.0.1:8080 TELEGRAM_API_URL=http://127.0.0.1:8081 \
+#    DICE_ANIMATION_DELAY=0 FLOOD_RATE=0 DB_FILE=bench_db.json python bot.py
+# 3. python -m bench.load_generator --users 200 --games 10 --db bench_db.json
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import aiohttp
+
+from config import TOKEN, COEFFICIENTS
+from game_logic import determine_game_result
+
+# Кнопки игр и типов ставок reply-клавиатуры
+GAME_BUTTONS = {
+    '🏀': '🏀 Баскетбол', '🎲': '🎲 Кости', '⚽': '⚽ Футбол', '🎯': '🎯 Дартс', '🎳': '🎳 Боулинг'
+}
+BET_BUTTONS = {
+    '🏀': {'гол': '🎯 Гол', 'застрял': '🔄 Застрял', 'мимо': '❌ Мимо'},
+    '🎲': {'четное': '2️⃣4️⃣6️⃣ Четное', 'нечетное': '1️⃣3️⃣5️⃣ Нечетное',
+          'больше_3': '4️⃣5️⃣6️⃣ Больше 3', 'меньше_4': '1️⃣2️⃣3️⃣ Меньше 4'},
+    '⚽': {'гол': '⚽ Гол', 'мимо': '❌ Мимо'},
+    '🎯': {'центр': '🎯 Центр', 'красное': '🔴 Красное', 'белое': '⚪ Белое', 'мимо': '❌ Мимо'},
+    '🎳': {'страйк': '💥 Страйк', 'мимо': '❌ Мимо'}
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class UpdateFactory:
+    """Сборка JSON обновлений Telegram от имени пользователя"""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(uid: int) -> Dict:
+        return {'id': uid, 'is_bot': False, 'first_name': f'Load{uid}', 'username': f'load{uid}'}
+
+    def message(self, uid: int, **fields) -> Dict:
+        msg = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': uid, 'type': 'private'},
+            'from': self.user(uid)
+        }
+        msg.update(fields)
+        return {'update_id': next(self._update_ids), 'message': msg}
+
+    def text(self, uid: int, text: str) -> Dict:
+        fields = {'text': text}
+        if text.startswith('/'):
+            fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self.message(uid, **fields)
+
+    def pre_checkout(self, uid: int, amount: int, payload: str) -> Dict:
+        return {
+            'update_id': next(self._update_ids),
+            'pre_checkout_query': {
+                'id': f'pcq{uid}_{next(self._message_ids)}', 'from': self.user(uid),
+                'currency': 'XTR', 'total_amount': amount, 'invoice_payload': payload
+            }
+        }
+
+    def payment(self, uid: int, amount: int, payload: str, charge_id: str) -> Dict:
+        return self.message(uid, successful_payment={
+            'currency': 'XTR', 'total_amount': amount, 'invoice_payload': payload,
+            'telegram_payment_charge_id': charge_id, 'provider_payment_charge_id': ''
+        })
+
+
+class LoadRunner:
+    """Отправляет обновления в webhook, снимает задержки и ведет ожидаемые балансы"""
+
+    def __init__(self, session: aiohttp.ClientSession, webhook: str, api: str):
+        self.session = session
+        self.webhook = webhook
+        self.api = api
+        self.updates = UpdateFactory()
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.expected = {}
+        self.games = defaultdict(int)
+
+    async def send(self, step: str, update: Dict):
+        """Webhook отвечает после завершения хендлера - это и есть задержка обновления"""
+        start = time.perf_counter()
+        try:
+            async with self.session.post(self.webhook, json=update) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    self.errors[step] += 1
+        except aiohttp.ClientError:
+            self.errors[step] += 1
+        self.latency[step].append(time.perf_counter() - start)
+
+    async def api_calls(self, uid: int, method: str, since: int) -> List[Dict]:
+        params = {'chat_id': uid, 'method': method, 'since': since}
+        async with self.session.get(f"{self.api}/control/calls", params=params) as resp:
+            return await resp.json()
+
+    async def api_seq(self) -> int:
+        """Номер последнего вызова API на стенде"""
+        async with self.session.get(f"{self.api}/control/stats") as resp:
+            return (await resp.json())['seq']
+
+    async def deposit(self, uid: int, amount: int, seq: int):
+        await self.send('deposit_menu', self.updates.text(uid, '💰 Пополнить'))
+        await self.send('deposit_amount', self.updates.text(uid, f'⭐ {amount}'))
+        invoices = await self.api_calls(uid, 'sendInvoice', seq)
+        if not invoices:
+            self.errors['invoice_missing'] += 1
+            return
+        payload = invoices[-1]['params']['payload']
+        await self.send('pre_checkout', self.updates.pre_checkout(uid, amount, payload))
+        await self.send('payment', self.updates.payment(uid, amount, payload, f'charge_{uid}_{seq}'))
+        self.expected[uid] += amount
+
+    async def play(self, uid: int, rng: random.Random, amount: int, seq: int):
+        game = rng.choice(list(GAME_BUTTONS))
+        bet_type = rng.choice(list(COEFFICIENTS[game]))
+        await self.send('game_menu', self.updates.text(uid, GAME_BUTTONS[game]))
+        await self.send('bet_type', self.updates.text(uid, BET_BUTTONS[game][bet_type]))
+        await self.send('bet_amount', self.updates.text(uid, f'⭐ {amount}'))
+        dice = await self.api_calls(uid, 'sendDice', seq)
+        if not dice:
+            self.errors['dice_missing'] += 1
+            return
+        res = determine_game_result(game, bet_type, dice[-1]['result']['dice']['value'])
+        self.expected[uid] += int(amount * res['coefficient']) - amount
+        self.games[uid] += 1
+
+    async def run_user(self, uid: int, games: int, seed: int):
+        rng = random.Random(seed)
+        self.expected[uid] = 0
+        await self.send('start', self.updates.text(uid, '/start'))
+        await self.deposit(uid, 100, await self.api_seq())
+        for _ in range(games):
+            # Номер последнего вызова API - чтобы найти именно наш счет/бросок
+            seq = await self.api_seq()
+            balance = self.expected[uid]
+            if balance < 10:
+                await self.deposit(uid, 100, seq)
+                continue
+            await self.play(uid, rng, 10, seq)
+            if rng.random() < 0.2:
+                await self.send('profile', self.updates.text(uid, '👤 Профиль'))
+
+
+def check_invariants(db_file: str, runner: LoadRunner) -> List[str]:
+    """Сверка итоговой БД бота с ожидаемыми балансами и внутренняя согласованность"""
+    with open(db_file, 'r', encoding='utf-8') as f:
+        db = {int(k): v for k, v in json.load(f).items()}
+    problems = []
+    for uid, expected in runner.expected.items():
+        ud = db.get(uid)
+        if ud is None:
+            problems.append(f"{uid}: нет в БД")
+            continue
+        if ud['balance'] != expected:
+            problems.append(f"{uid}: баланс {ud['balance']}, ожидалось {expected}")
+        if ud['games_played'] != runner.games[uid]:
+            problems.append(f"{uid}: игр {ud['games_played']}, ожидалось {runner.games[uid]}")
+        # Баланс = пополнения - ставки с баланса + выплаты
+        deposits = sum(p['amount'] for p in ud.get('payments', []) if not p.get('refunded'))
+        flow = sum((g['winnings'] if g['win'] else 0) - g['amount'] for g in ud['history'])
+        if deposits + flow != ud['balance']:
+            problems.append(f"{uid}: пополнения {deposits} + игры {flow} != баланс {ud['balance']}")
+    return problems
+
+
+def format_report(runner: LoadRunner, elapsed: float, problems: List[str]) -> Dict:
+    all_latency = [v for values in runner.latency.values() for v in values]
+    return {
+        'updates': len(all_latency),
+        'seconds': round(elapsed, 2),
+        'updates_per_sec': round(len(all_latency) / elapsed, 1) if elapsed else 0,
+        'latency_ms': {
+            'p50': round(percentile(all_latency, 0.5) * 1000, 1),
+            'p95': round(percentile(all_latency, 0.95) * 1000, 1),
+            'p99': round(percentile(all_latency, 0.99) * 1000, 1)
+        },
+        'steps': {
+            step: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.5) * 1000, 1),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 1)
+            }
+            for step, values in sorted(runner.latency.items())
+        },
+        'errors': dict(runner.errors),
+        'invariants_ok': not problems,
+        'problems': problems[:20]
+    }
+
+
+async def run(args) -> Dict:
+    webhook = args.webhook or f"http://127.0.0.1:8080/webhook/{TOKEN}"
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        runner = LoadRunner(session, webhook, args.api)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def user_task(i: int):
+            async with semaphore:
+                await runner.run_user(args.user_base + i, args.games, args.seed + i)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user_task(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    problems = check_invariants(args.db, runner) if args.db else []
+    return format_report(runner, elapsed, problems)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный сценарий через webhook бота")
+    parser.add_argument('--webhook', default=None, help="URL webhook (по умолчанию локальный с TOKEN)")
+    parser.add_argument('--api', default='http://127.0.0.1:8081', help="адрес bench.fake_bot_api")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--games', type=int, default=10, help="игр на пользователя")
+    parser.add_argument('--concurrency', type=int, default=20, help="одновременно активных пользователей")
+    parser.add_argument('--user-base', type=int, default=10_000_000, help="первый user_id")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', default=None, help="файл БД бота для проверки балансов")
+    parser.add_argument('--json', action='store_true', help="вывести отчет одной строкой JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=None if args.json else 2))
+
+
+if __name__ == '__main__':
+    main()
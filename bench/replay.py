@@ -0,0 +1,358 @@
+# Детерминированное воспроизведение записанной активности через хендлеры бота
+#
+# python -m bench.replay --db users_database.json --logs logs --speedup 0
+#
+# События восстанавливаются из БД (пополнения, ставки со значениями кубика, возвраты,
+# выводы) и логов (запуски /start), затем подаются в Dispatcher как обновления Telegram.
+# Бот работает с локальным bench.fake_bot_api в этом же процессе, кубики отдаются
+# из записанных dice_value. В конце итоговые балансы сверяются с записанной БД.
+
+import argparse
+import asyncio
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+# Корень репозитория - в sys.path до смены рабочей папки
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Кнопки сумм ставки reply-клавиатуры; другие суммы идут через /autoplay на 1 раунд
+AMOUNT_BUTTONS = {1, 5, 10, 25, 50, 100, 250, 500, 1000}
+# Порядок событий внутри одной минуты: пополнения и корректировки раньше ставок, возвраты и выводы - позже
+KIND_ORDER = {'start': 0, 'deposit': 1, 'adjust': 1, 'bet': 2, 'refund': 3, 'withdraw': 3}
+
+
+def _minute(date: str) -> str:
+    """'2025-01-02T10:11:12.5' / '2025-01-02 10:11' -> '2025-01-02 10:11'"""
+    return (date or '')[:16].replace('T', ' ')
+
+
+def _timestamp(minute: str) -> float:
+    try:
+        return datetime.strptime(minute, '%Y-%m-%d %H:%M').timestamp()
+    except ValueError:
+        return 0.0
+
+
+def load_recorded(db_file: str) -> Dict[int, Dict]:
+    with open(db_file, 'r', encoding='utf-8') as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def log_starts(logs_dir: str, users: Dict[int, Dict]) -> List[Dict]:
+    """Запуски /start из logs/users_*.log(.gz) для пользователей записанной БД"""
+    events = []
+    for path in sorted(glob.glob(os.path.join(logs_dir, 'users_*.log*'))):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                parts = line.split(' | ')
+                if len(parts) < 3 or parts[1].strip() not in ('START', 'REGISTER'):
+                    continue
+                try:
+                    uid = int(parts[2].split()[0][len('ID:'):])
+                except (ValueError, IndexError):
+                    continue
+                if uid in users:
+                    events.append({'kind': 'start', 'uid': uid, 'minute': _minute(parts[0])})
+    return events
+
+
+def build_events(users: Dict[int, Dict], logs_dir: str = None) -> List[Dict]:
+    """
+    Поток событий, упорядоченный по времени (с точностью до минуты, как в истории)
+
+    Returns:
+        list: События {'kind', 'uid', 'minute', ...}
+    """
+    events = []
+    for uid, ud in users.items():
+        for p in ud.get('payments', []):
+            events.append({'kind': 'deposit', 'uid': uid, 'minute': _minute(p['date']),
+                           'amount': p['amount'], 'charge_id': p['telegram_payment_charge_id']})
+            if p.get('refunded'):
+                events.append({'kind': 'withdraw', 'uid': uid,
+                               'minute': _minute(p.get('refund_date') or p['date']),
+                               'amount': p.get('refund_amount', p['amount'])})
+        for g in ud.get('history', []):
+            events.append({'kind': 'bet', 'uid': uid, 'minute': _minute(g['date']), 'game': g['game'],
+                           'bet_type': g['bet_type'], 'amount': g['amount'],
+                           'dice_value': g['dice_value'], 'payment_id': g.get('payment_id', 'balance')})
+            if g.get('refunded'):
+                events.append({'kind': 'refund', 'uid': uid,
+                               'minute': _minute(g.get('refund_date') or g['date']),
+                               'payment_id': g['payment_id']})
+        for a in ud.get('adjustments', []):
+            events.append({'kind': 'adjust', 'uid': uid, 'minute': _minute(a['date']), 'delta': a['delta']})
+
+    if logs_dir:
+        events.extend(log_starts(logs_dir, users))
+
+    # Каждый пользователь начинает с /start (регистрация)
+    first = {}
+    for e in events:
+        if e['uid'] not in first or e['minute'] < first[e['uid']]:
+            first[e['uid']] = e['minute']
+    for uid in users:
+        events.append({'kind': 'start', 'uid': uid, 'minute': first.get(uid, '')})
+
+    # sorted устойчив: внутри пользователя сохраняется исходный порядок истории
+    events.sort(key=lambda e: (e['minute'], KIND_ORDER[e['kind']]))
+    return events
+
+
+class Replayer:
+    """Подача событий в Dispatcher бота, подмена кубиков и учет расхождений"""
+
+    def __init__(self, dp, bot, api, users: Dict[int, Dict], admin_id: int, get_balance):
+        self.dp = dp
+        self.bot = bot
+        self.api = api
+        self.users = users
+        self.admin_id = admin_id
+        self.get_balance = get_balance
+        self._ids = itertools.count(1)
+        self.latency = []
+        self.counts = Counter()
+        self.errors = Counter()
+        self.topups = defaultdict(int)
+
+    def _user(self, uid: int) -> Dict:
+        ud = self.users.get(uid, {})
+        return {'id': uid, 'is_bot': False, 'first_name': ud.get('first_name') or f'User{uid}',
+                'last_name': ud.get('last_name'), 'username': ud.get('username')}
+
+    def _message(self, uid: int, chat_id: int = None, **fields) -> Dict:
+        msg = {'message_id': next(self._ids), 'date': int(time.time()),
+               'chat': {'id': chat_id or uid, 'type': 'private'}, 'from': self._user(uid)}
+        msg.update(fields)
+        return {'update_id': next(self._ids), 'message': msg}
+
+    def _text(self, uid: int, text: str) -> Dict:
+        return self._message(uid, text=text)
+
+    async def feed(self, step: str, update: Dict):
+        from aiogram.types import Update
+        start = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, Update(**update))
+        except Exception:
+            self.errors[step] += 1
+        self.latency.append(time.perf_counter() - start)
+        self.counts[step] += 1
+
+    async def admin(self, step: str, text: str):
+        """Команда от имени администратора"""
+        update = self._message(self.admin_id, text=text)
+        update['message']['from'] = {'id': self.admin_id, 'is_bot': False, 'first_name': 'Admin'}
+        await self.feed(step, update)
+
+    async def ensure_balance(self, uid: int, amount: int):
+        """Неучтенные в БД начисления (админские) восполняются /addbalance и попадают в отчет"""
+        shortfall = amount - self.get_balance(uid)
+        if shortfall > 0:
+            self.topups[uid] += shortfall
+            await self.admin('topup', f"/addbalance {uid} {shortfall}")
+
+    async def run_event(self, e: Dict):
+        uid = e['uid']
+        kind = e['kind']
+        if kind == 'start':
+            await self.feed('start', self._text(uid, '/start'))
+
+        elif kind == 'deposit':
+            payload = f"{uid}:deposit:{e['amount']}"
+            await self.feed('payment', self._message(uid, successful_payment={
+                'currency': 'XTR', 'total_amount': e['amount'], 'invoice_payload': payload,
+                'telegram_payment_charge_id': e['charge_id'], 'provider_payment_charge_id': ''
+            }))
+
+        elif kind == 'bet':
+            self.api.dice_queues[uid].append(e['dice_value'])
+            if e['payment_id'] not in ('balance', 'table'):
+                # Ставка оплачена счетом
+                payload = f"{uid}:{e['game']}:{e['bet_type']}:{e['amount']}"
+                await self.feed('paid_bet', self._message(uid, successful_payment={
+                    'currency': 'XTR', 'total_amount': e['amount'], 'invoice_payload': payload,
+                    'telegram_payment_charge_id': e['payment_id'], 'provider_payment_charge_id': ''
+                }))
+                return
+            await self.ensure_balance(uid, e['amount'])
+            from bench.load_generator import GAME_BUTTONS, BET_BUTTONS
+            if e['amount'] in AMOUNT_BUTTONS and e['bet_type'] in BET_BUTTONS.get(e['game'], {}):
+                await self.feed('game_menu', self._text(uid, GAME_BUTTONS[e['game']]))
+                await self.feed('bet_type', self._text(uid, BET_BUTTONS[e['game']][e['bet_type']]))
+                await self.feed('bet_amount', self._text(uid, f"⭐ {e['amount']}"))
+            else:
+                # Нестандартная сумма или ставка со стола - один раунд автоигры
+                await self.feed('autoplay', self._text(
+                    uid, f"/autoplay {e['game']} {e['bet_type']} {e['amount']} 1"
+                ))
+                # Автоигра идет фоновой задачей - дожидаемся ее, чтобы сохранить порядок событий
+                from bot import autoplay_tasks
+                if uid in autoplay_tasks:
+                    await autoplay_tasks[uid]
+
+        elif kind == 'refund':
+            await self.admin('refund', f"/refund {uid} {e['payment_id']}")
+
+        elif kind == 'adjust':
+            # /setbalance записан как разница - воспроизводится через /addbalance
+            await self.admin('adjust', f"/addbalance {uid} {e['delta']}")
+
+        elif kind == 'withdraw':
+            await self.ensure_balance(uid, e['amount'])
+            update = {'update_id': next(self._ids), 'callback_query': {
+                'id': f"cb{next(self._ids)}", 'chat_instance': 'replay',
+                'from': {'id': self.admin_id, 'is_bot': False, 'first_name': 'Admin'},
+                'data': f"send_stars:{uid}:{e['amount']}",
+                'message': {'message_id': next(self._ids), 'date': int(time.time()),
+                            'chat': {'id': self.admin_id, 'type': 'private'}, 'text': 'Заявка на вывод'}
+            }}
+            await self.feed('withdraw', update)
+
+    async def run(self, events: List[Dict], speedup: float, concurrency: int):
+        """
+        События одного пользователя идут строго по порядку, пользователи - параллельно.
+        При speedup > 0 событие ждет своего времени: (t - t0) / speedup
+        """
+        per_user = defaultdict(list)
+        for e in events:
+            per_user[e['uid']].append(e)
+        t0 = min((_timestamp(e['minute']) for e in events if e['minute']), default=0)
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def user_task(user_events):
+            async with semaphore:
+                for e in user_events:
+                    if speedup > 0 and e['minute']:
+                        delay = (_timestamp(e['minute']) - t0) / speedup - (time.perf_counter() - start)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    await self.run_event(e)
+
+        await asyncio.gather(*(user_task(ev) for ev in per_user.values()))
+        return time.perf_counter() - start
+
+
+def verify(recorded: Dict[int, Dict], replayed: Dict[int, Dict], topups: Dict[int, int]) -> Dict:
+    """Сверка балансов и счетчиков игр с записанной БД"""
+    mismatches = []
+    matched = 0
+    for uid, ud in recorded.items():
+        r = replayed.get(uid)
+        if r is None:
+            mismatches.append({'user_id': uid, 'problem': 'нет после воспроизведения'})
+            continue
+        delta = ud['balance'] - r['balance']
+        if delta == 0 and r['games_played'] == ud['games_played']:
+            matched += 1
+        else:
+            mismatches.append({
+                'user_id': uid,
+                'recorded_balance': ud['balance'],
+                'replayed_balance': r['balance'],
+                'recorded_games': ud['games_played'],
+                'replayed_games': r['games_played'],
+                'topup': topups.get(uid, 0)
+            })
+    return {'users': len(recorded), 'matched': matched, 'mismatches': mismatches}
+
+
+async def replay(args) -> Dict:
+    recorded = load_recorded(args.db)
+    events = build_events(recorded, args.logs)
+
+    # Бот пишет БД и логи в рабочую папку воспроизведения, а не в боевые файлы
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    os.environ['DB_FILE'] = os.path.join(args.workdir, 'replay_db.json')
+    os.environ.setdefault('DICE_ANIMATION_DELAY', '0')
+    if os.path.exists(os.environ['DB_FILE']):
+        os.remove(os.environ['DB_FILE'])
+
+    from aiohttp import web
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.fsm.storage.memory import MemoryStorage
+    import bot as bot_module
+    import database
+    from bench.fake_bot_api import FakeBotAPI
+    from config import TOKEN, ADMIN_ID
+
+    api = FakeBotAPI(seed=args.seed)
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")))
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(bot_module.router)
+    database.load_database(os.environ['DB_FILE'])
+
+    replayer = Replayer(dp, bot, api, recorded, ADMIN_ID,
+                        lambda uid: database.users_db.get(uid, {}).get('balance', 0))
+    try:
+        elapsed = await replayer.run(events, args.speedup, args.concurrency)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+    database.save_database(os.environ['DB_FILE'])
+
+    latency = sorted(replayer.latency)
+
+    def pct(q):
+        return round(latency[min(len(latency) - 1, int(q * len(latency)))] * 1000, 2) if latency else 0
+
+    result = verify(recorded, database.users_db, replayer.topups)
+    return {
+        'events': len(events),
+        'updates': len(latency),
+        'seconds': round(elapsed, 2),
+        'updates_per_sec': round(len(latency) / elapsed, 1) if elapsed else 0,
+        'latency_ms': {'p50': pct(0.5), 'p95': pct(0.95), 'p99': pct(0.99)},
+        'steps': dict(replayer.counts),
+        'errors': dict(replayer.errors),
+        'api_calls': dict(api.counts),
+        'balances_ok': not result['mismatches'],
+        'matched_users': result['matched'],
+        'users': result['users'],
+        'topups': sum(replayer.topups.values()),
+        'mismatches': result['mismatches'][:20]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанной активности через хендлеры бота")
+    parser.add_argument('--db', required=True, help="записанная БД (users_database.json)")
+    parser.add_argument('--logs', default=None, help="папка логов для событий /start")
+    parser.add_argument('--speedup', type=float, default=0, help="ускорение времени, 0 - без пауз")
+    parser.add_argument('--concurrency', type=int, default=50, help="пользователей одновременно")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'bot_replay'))
+    args = parser.parse_args()
+    args.db = os.path.abspath(args.db)
+    args.logs = os.path.abspath(args.logs) if args.logs else None
+    args.workdir = os.path.abspath(args.workdir)
+
+    report = asyncio.run(replay(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report['balances_ok']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# Микробенчмарки хранилища database.py на синтетических БД разного размера
+#
+# python -m bench.storage_bench --sizes 10000,100000 --output bench_storage.json
+# python -m bench.storage_bench --sizes 10000,100000 --compare bench_storage.json
+#
+# Каждый размер замеряется в отдельном процессе, чтобы пиковый RSS не смешивался
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from config import COEFFICIENTS, DICE_FACES
+import database
+from game_logic import determine_game_result
+from user_index import user_order_index, name_index, SORT_KEYS
+
+# Средняя длина истории: у большинства пользователей несколько игр, у немногих - сотни
+HISTORY_MEAN = 8
+HISTORY_MAX = 1000
+
+
+def make_user(uid: int, rng: random.Random, history_mean: float) -> Dict:
+    """Запись пользователя в формате get_user_data/settle_bet"""
+    games = list(COEFFICIENTS)
+    start = datetime(2025, 1, 1) + timedelta(minutes=rng.randrange(500000))
+    history = []
+    total_bets = total_wins = total_losses = balance = 0
+    payments = []
+    for i in range(min(int(rng.expovariate(1 / history_mean)), HISTORY_MAX)):
+        game = rng.choice(games)
+        bet_type = rng.choice(list(COEFFICIENTS[game]))
+        amount = rng.choice((10, 10, 25, 50, 100))
+        dice_value = rng.randint(1, DICE_FACES[game])
+        res = determine_game_result(game, bet_type, dice_value)
+        w = int(amount * res['coefficient']) if res['win'] else -amount
+        total_bets += amount
+        if res['win']:
+            total_wins += w
+        else:
+            total_losses += amount
+        history.append({
+            'date': (start + timedelta(minutes=i * 3)).strftime('%Y-%m-%d %H:%M'),
+            'game': game,
+            'bet_type': bet_type,
+            'amount': amount,
+            'result': res['outcome'],
+            'dice_value': dice_value,
+            'win': res['win'],
+            'winnings': w,
+            'payment_id': 'balance'
+        })
+    if history or rng.random() < 0.3:
+        amount = rng.choice((50, 100, 250))
+        balance = amount
+        payments.append({
+            'amount': amount,
+            'telegram_payment_charge_id': f'stxBench{uid}',
+            'date': start.isoformat(),
+            'refunded': False
+        })
+    ud = {
+        'balance': balance,
+        'total_bets': total_bets,
+        'total_wins': total_wins,
+        'total_losses': total_losses,
+        'games_played': len(history),
+        'history': history,
+        'stats': database.build_stats(history),
+        'payments': payments,
+        'username': f'user{uid}',
+        'first_name': f'Имя{uid % 5000}',
+        'last_name': None,
+        'last_active': history[-1]['date'] if history else start.strftime('%Y-%m-%d %H:%M')
+    }
+    return ud
+
+
+def generate_dataset(path: str, users: int, seed: int = 1, history_mean: float = HISTORY_MEAN) -> int:
+    """
+    Записать синтетическую БД потоково (без построения всего словаря в памяти)
+
+    Returns:
+        int: Всего записей истории
+    """
+    rng = random.Random(seed)
+    records = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for i in range(users):
+            uid = 100000000 + i
+            ud = make_user(uid, rng, history_mean)
+            records += len(ud['history'])
+            f.write((',' if i else '') + f'"{uid}": ' + json.dumps(ud, ensure_ascii=False))
+        f.write('}')
+    return records
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: килобайты на Linux, байты на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _timed(func, repeat: int) -> float:
+    """Медиана времени выполнения, мс"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times) * 1000, 3)
+
+
+def run_size(users: int, workdir: str, seed: int, history_mean: float, repeat: int) -> Dict:
+    """Все замеры для одного размера (выполняется в дочернем процессе)"""
+    path = os.path.join(workdir, f'bench_db_{users}.json')
+    gen_start = time.perf_counter()
+    records = generate_dataset(path, users, seed, history_mean)
+    result = {
+        'users': users,
+        'history_records': records,
+        'generate_s': round(time.perf_counter() - gen_start, 2),
+        'timings_ms': {}
+    }
+    t = result['timings_ms']
+    # Крупные наборы сохраняются/загружаются секундами - меньше повторов
+    heavy = max(1, repeat if users <= 100000 else 1)
+
+    def cold_load():
+        database._db_stamp = None
+        database.load_database(path)
+
+    t['load_database'] = _timed(cold_load, heavy)
+    result['rss_after_load_mb'] = _peak_rss_mb()
+    result['db_bytes'] = os.path.getsize(path)
+
+    t['save_database'] = _timed(lambda: database.save_database(path), heavy)
+    result['db_bytes_saved'] = os.path.getsize(path)
+
+    rng = random.Random(seed)
+    keys = list(database.users_db)
+    uids = [rng.choice(keys) for _ in range(10000)]
+    # На 10000 вызовов, результат - на один вызов
+    t['get_user_data_us'] = round(_timed(lambda: [database.get_user_data(u) for u in uids], repeat) / 10, 3)
+    # С db_file файл не менялся с последней записи (_db_stamp совпадает) - это только exists + stat
+    t['get_user_data_stat_us'] = round(
+        _timed(lambda: [database.get_user_data(u, None, path) for u in uids], repeat) / 10, 3
+    )
+
+    def forced_reload():
+        # Файл изменили извне - get_user_data перечитывает всю БД
+        database._db_stamp = None
+        database.get_user_data(uids[0], None, path)
+
+    t['get_user_data_reload'] = _timed(forced_reload, heavy)
+    t['get_user_stats'] = _timed(database.get_user_stats, repeat)
+    for key in SORT_KEYS:
+        t[f'sort_{key}'] = _timed(
+            lambda: user_order_index.get_order(database.users_db, key, refresh=True), repeat
+        )
+    t['users_page_cached'] = _timed(lambda: user_order_index.page(database.users_db, 'balance', 0, 10), repeat)
+    t['name_index_rebuild'] = _timed(lambda: name_index.rebuild(database.users_db), repeat)
+    t['name_index_search'] = _timed(lambda: name_index.search('user1'), repeat)
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    os.remove(path)
+    return result
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Сравнение с сохраненным базовым прогоном
+
+    Returns:
+        list: Строки о регрессиях (время выросло больше чем на threshold и заметно по абсолютной величине)
+    """
+    regressions = []
+    print(f"{'размер':>9} {'замер':<28} {'база':>11} {'сейчас':>11} {'изм.':>8}")
+    for size, res in results['results'].items():
+        base = baseline.get('results', {}).get(size)
+        if not base:
+            continue
+        metrics = dict(res['timings_ms'], peak_rss_mb=res['peak_rss_mb'])
+        base_metrics = dict(base['timings_ms'], peak_rss_mb=base['peak_rss_mb'])
+        for name, value in metrics.items():
+            old = base_metrics.get(name)
+            if not old:
+                continue
+            change = value / old - 1
+            mark = ''
+            # Доли миллисекунды - шум, на них не реагируем
+            if change > threshold and value - old > (0.5 if name.endswith('_us') else 1):
+                mark = ' ⚠️'
+                regressions.append(f"{size} {name}: {old} -> {value} ({change:+.0%})")
+            print(f"{size:>9} {name:<28} {old:>11} {value:>11} {change:>+8.0%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища database.py")
+    parser.add_argument('--sizes', default='10000,100000', help="размеры через запятую (например 10000,100000,1000000)")
+    parser.add_argument('--history-mean', type=float, default=HISTORY_MEAN, help="средняя длина истории")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None, help="папка для синтетических БД")
+    parser.add_argument('--output', default=None, help="сохранить результат в JSON")
+    parser.add_argument('--compare', default=None, help="JSON базового прогона для сравнения")
+    parser.add_argument('--threshold', type=float, default=0.2, help="допустимый рост времени (доля)")
+    parser.add_argument('--child', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    workdir = args.workdir or tempfile.gettempdir()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, workdir, args.seed, args.history_mean, args.repeat)))
+        return
+
+    results = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'history_mean': args.history_mean,
+        'results': {}
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        cmd = [sys.executable, '-m', 'bench.storage_bench', '--child', str(size),
+               '--workdir', workdir, '--seed', str(args.seed),
+               '--history-mean', str(args.history_mean), '--repeat', str(args.repeat)]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results['results'][str(size)] = json.loads(out.strip().splitlines()[-1])
+        print(f"✅ {size}: {results['results'][str(size)]['timings_ms']}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n❌ Регрессии:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\n✅ Регрессий нет")
+    elif not args.output:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,30 @@
 import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import os
 
 from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramAPIError, TelegramNetworkError
 from aiogram.filters import Command, CommandStart, StateFilter
-from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
 # Импорты из наших модулей
-from config import TOKEN, ADMIN_ID, DB_FILE
+from config import (
+    TOKEN, ADMIN_ID, DB_FILE, COEFFICIENTS, GAME_NAMES, BET_TYPE_NAMES,
+    TABLE_BET_WINDOW, AUTOPLAY_MAX_ROUNDS, HISTORY_PAGE_SIZE, USERS_PAGE_SIZE,
+    LOG_FOLLOW_SECONDS, LOG_FOLLOW_INTERVAL, TELEGRAM_API_URL, DICE_ANIMATION_DELAY,
+    WITHDRAW_PAGE_SIZE
+)
 from database import (
     load_database, save_database, get_user_data, 
-    get_all_users, get_user_stats
+    get_all_users, get_user_stats, get_history_page, add_adjustment
 )
 from keyboards import (
     get_main_keyboard, get_admin_keyboard, get_games_keyboard,
@@ -22,15 +32,38 @@ from keyboards import (
     get_game_result_keyboard, get_back_button, get_reply_keyboard,
     get_profile_keyboard, get_deposit_keyboard, get_cancel_keyboard,
     get_games_reply_keyboard, get_profile_reply_keyboard, get_deposit_amounts_keyboard,
-    get_cancel_reply_keyboard, get_bet_type_keyboard, get_bet_amount_keyboard
+    get_cancel_reply_keyboard, get_bet_type_keyboard, get_bet_amount_keyboard,
+    get_table_bets_keyboard, get_history_keyboard, get_users_browser_keyboard,
+    get_withdrawals_keyboard
 )
-from game_logic import determine_game_result, get_rules_text
+from game_logic import settle_bet, get_rules_text
+from table_game import open_table, close_table, place_table_bet, settle_table, refund_table, open_tables
+from autoplay import run_autoplay, active_autoplays
+from user_index import user_order_index, name_index, SORT_KEYS
+from export import write_export, parse_export_args
+from action_log import query_user_actions
+from analysis import analyze_all, simulate_bankroll, format_analysis, format_simulation
+from audit import audit_file, format_audit, write_snapshot
 from logger import (
     log_start, log_register, log_game_start, log_win, log_loss,
     log_payment, log_balance_change, log_refund, log_admin_action,
-    get_today_stats
+    get_today_stats, get_log_file, tail_lines, read_new_lines,
+    log_queue, queue_handler
+)
+from metrics import registry
+from admission import game_admission, BUSY_MESSAGES
+from withdrawals import (
+    withdraw_queue, process_withdrawals, reserve_withdrawal, release_withdrawal,
+    format_item, format_batch
+)
+from loop_monitor import loop_monitor
+from mem_report import track, set_baseline, memory_report, format_memory_report
+from profiler import profiler, write_collapsed, format_profile_summary, PROFILE_MAX_SECONDS
+from middlewares import (
+    UpdateMetricsMiddleware, HandlerMetricsMiddleware, RequestMetricsMiddleware,
+    TracingMiddleware, TracingRequestMiddleware, ThrottlingMiddleware
 )
-from web_server import start_web_server
+from web_server import start_web_server, setup_routes
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -132,7 +165,13 @@ async def cmd_admin(msg: Message):
         f"/setbalance [user_id] [сумма]\n"
         f"/addbalance [user_id] [сумма]\n"
         f"/refund [user_id] [payment_id]\n"
-        f"/logs - логи за сегодня",
+        f"/find [имя] - поиск пользователя\n"
+        f"/logs [user id|tail N|follow] - логи за сегодня / пользователя\n"
+        f"/rtp [сумма] - анализ коэффициентов\n"
+        f"/profile start [сек] | stop - профилирование\n"
+        f"/mem [baseline] - память процесса\n"
+        f"/withdrawals - заявки на вывод\n"
+        f"/audit [N] - сверка балансов",
         reply_markup=get_admin_keyboard()
     )
 
@@ -185,6 +224,7 @@ async def cmd_setbalance(msg: Message, bot: Bot):
         ud = get_user_data(uid, None, DB_FILE)
         old_balance = ud['balance']
         ud['balance'] = amount
+        add_adjustment(ud, amount - old_balance, "admin_set")
         save_database(DB_FILE)
         
         # Логирование
@@ -230,6 +270,7 @@ async def cmd_addbalance(msg: Message, bot: Bot):
         ud = get_user_data(uid, None, DB_FILE)
         old_balance = ud['balance']
         ud['balance'] += amount
+        add_adjustment(ud, amount, "admin_add")
         save_database(DB_FILE)
         
         # Логирование
@@ -317,51 +358,218 @@ async def cmd_refund(msg: Message, bot: Bot):
         await msg.answer(f"❌ Ошибка: {e}")
 
 
-@router.message(Command("users"))
-async def cmd_users(msg: Message):
-    """Список всех пользователей"""
-    if msg.from_user.id != ADMIN_ID:
-        return await msg.answer("❌ Нет доступа")
-    
+async def format_users_page(key: str, offset: int, refresh: bool = False) -> tuple:
+    """Текст и клавиатура страницы админского списка пользователей"""
     users_db = get_all_users()
-    if not users_db:
-        return await msg.answer("📭 Пользователей пока нет")
-    
-    sorted_users = sorted(users_db.items(), key=lambda x: x[1]['games_played'], reverse=True)
-    txt = f"👥 СПИСОК ПОЛЬЗОВАТЕЛЕЙ ({len(users_db)})\n\n"
+    # Перестройка снимка - сортировка всех пользователей, поэтому в потоке
+    uids, total = await asyncio.to_thread(
+        user_order_index.page, users_db, key, offset, USERS_PAGE_SIZE, refresh
+    )
     
-    for uid, data in sorted_users:
+    entries = []
+    for uid in uids:
+        data = users_db.get(uid)
+        if data is None:
+            continue
         username = f"@{data.get('username')}" if data.get('username') else "—"
-        first_name = data.get('first_name', '—')
-        last_name = data.get('last_name', '')
+        first_name = data.get('first_name') or '—'
+        last_name = data.get('last_name')
         full_name = f"{first_name} {last_name}".strip() if last_name else first_name
         
-        txt += (
+        entries.append(
             f"👤 {full_name}\n"
             f"   ID: {uid}\n"
             f"   Username: {username}\n"
             f"   💳 Баланс: {data['balance']} ⭐\n"
-            f"   🎮 Игр: {data['games_played']}\n\n"
+            f"   🎮 Игр: {data['games_played']}"
         )
-        
-        if len(txt) > 3500:
-            await msg.answer(txt)
-            txt = ""
     
-    if txt:
-        await msg.answer(txt)
+    last = min(offset + USERS_PAGE_SIZE, total)
+    txt = f"👥 ПОЛЬЗОВАТЕЛИ ({offset + 1}-{last} из {total})\n\n" + "\n\n".join(entries)
+    return txt, get_users_browser_keyboard(key, offset, total, USERS_PAGE_SIZE)
+
+
+@router.message(Command("users"))
+async def cmd_users(msg: Message):
+    """Список пользователей: /users [balance|games|recent]"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    if not get_all_users():
+        return await msg.answer("📭 Пользователей пока нет")
+    
+    p = msg.text.split()
+    key = p[1] if len(p) > 1 and p[1] in SORT_KEYS else 'games'
+    txt, kb = await format_users_page(key, 0, refresh=True)
+    await msg.answer(txt, reply_markup=kb)
+
+
+@router.message(Command("find"))
+async def cmd_find(msg: Message):
+    """Поиск пользователя по username / имени: /find [запрос]"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    p = msg.text.split(maxsplit=1)
+    if len(p) < 2:
+        return await msg.answer("❌ Формат: /find [username или имя]")
+    
+    users_db = get_all_users()
+    uids = name_index.search(p[1].strip())
+    if not uids:
+        return await msg.answer("🔍 Никого не найдено")
+    
+    lines = []
+    for uid in uids:
+        data = users_db.get(uid)
+        if not data:
+            continue
+        username = f"@{data['username']}" if data.get('username') else "—"
+        full_name = " ".join(x for x in (data.get('first_name'), data.get('last_name')) if x) or "—"
+        lines.append(f"👤 {full_name} {username}\n   ID: {uid} | 💳 {data['balance']} ⭐ | 🎮 {data['games_played']}")
+    
+    await msg.answer(f"🔍 Найдено: {len(lines)}\n\n" + "\n".join(lines))
+
+
+@router.message(Command("export"))
+async def cmd_export(msg: Message):
+    """Выгрузка данных одним документом: /export users|games|payments [from] [to] [csv|jsonl]"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    try:
+        kind, fmt, date_from, date_to = parse_export_args(msg.text.split()[1:])
+    except ValueError:
+        return await msg.answer(
+            "❌ Формат: /export users|games|payments [с YYYY-MM-DD] [по YYYY-MM-DD] [csv|jsonl]"
+        )
+    
+    log_admin_action(msg.from_user.id, "EXPORT", kind=kind, fmt=fmt)
+    
+    # Запись файла не должна блокировать цикл событий
+    path, count = await asyncio.to_thread(write_export, kind, fmt, date_from, date_to)
+    try:
+        period = f"{date_from or '…'} — {date_to or '…'}" if date_from or date_to else "всё время"
+        await msg.answer_document(
+            FSInputFile(path),
+            caption=f"📦 Выгрузка {kind}: {count} строк ({period})"
+        )
+    finally:
+        os.remove(path)
+
+
+async def logs_user_query(msg: Message, args: list):
+    """Действия пользователя из структурированного журнала: /logs user [id] [с] [по]"""
+    try:
+        uid = int(args[0])
+        dates = args[1:3]
+        for d in dates:
+            datetime.strptime(d, '%Y-%m-%d')
+    except (IndexError, ValueError):
+        return await msg.answer("❌ Формат: /logs user [user_id] [с YYYY-MM-DD] [по YYYY-MM-DD]")
+    
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    records = await asyncio.to_thread(query_user_actions, uid, date_from, date_to, 30)
+    if not records:
+        return await msg.answer(f"📭 Действий пользователя {uid} не найдено")
+    
+    lines = []
+    for rec in records:
+        fields = " ".join(
+            f"{k}:{v}" for k, v in rec.items() if k not in ('ts', 'action', 'user_id', 'username')
+        )
+        lines.append(f"{datetime.fromtimestamp(rec['ts']).strftime('%m-%d %H:%M:%S')} {rec['action']} {fields}")
+    
+    txt = f"🔎 Действия {uid} (последние {len(records)}):\n\n" + "\n".join(lines)
+    await msg.answer(txt[-4000:])
+
+
+def format_log_lines(title: str, lines: list) -> str:
+    """Блок строк лога для сообщения (Markdown, с обрезкой под лимит Telegram)"""
+    body = "\n".join(lines).replace("`", "'")
+    return f"{title}\n\n```\n{body[-3800:]}\n```"
+
+
+# Задача /logs follow для каждого чата администратора
+log_followers = {}
+
+
+async def follow_log(bot: Bot, chat_id: int, message_id: int, lines: list, offset: int):
+    """Дописывать новые строки лога в одно сообщение, пока не истечет LOG_FOLLOW_SECONDS"""
+    path = get_log_file()
+    shown = list(lines)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LOG_FOLLOW_SECONDS
+    try:
+        while loop.time() < deadline:
+            await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+            current = get_log_file()
+            if current != path:
+                # Смена дня - читаем новый файл с начала
+                path, offset = current, 0
+            try:
+                new_lines, offset = await asyncio.to_thread(read_new_lines, path, offset)
+            except FileNotFoundError:
+                continue
+            if not new_lines:
+                continue
+            shown = (shown + new_lines)[-20:]
+            try:
+                await bot.edit_message_text(
+                    format_log_lines("📡 Лог в реальном времени:", shown),
+                    chat_id=chat_id, message_id=message_id, parse_mode="Markdown"
+                )
+            except TelegramBadRequest as e:
+                logger.warning(f"Не удалось обновить /logs follow: {e}")
+        await bot.edit_message_text(
+            format_log_lines("⏹ Слежение за логом завершено:", shown),
+            chat_id=chat_id, message_id=message_id, parse_mode="Markdown"
+        )
+    except TelegramBadRequest:
+        pass
+    finally:
+        if log_followers.get(chat_id) is asyncio.current_task():
+            del log_followers[chat_id]
 
 
 @router.message(Command("logs"))
 async def cmd_logs(msg: Message):
-    """Просмотр логов за сегодня"""
+    """Просмотр логов: статистика, /logs tail N, /logs follow, /logs user"""
     if msg.from_user.id != ADMIN_ID:
         return await msg.answer("❌ Нет доступа")
     
     log_admin_action(msg.from_user.id, "VIEW_LOGS")
     
+    p = msg.text.split()
+    if len(p) > 1 and p[1] == "user":
+        return await logs_user_query(msg, p[2:])
+    
+    if len(p) > 1 and p[1] in ("tail", "follow"):
+        try:
+            n = 10 if p[1] == "follow" else min(max(int(p[2]), 1), 100) if len(p) > 2 else 15
+        except ValueError:
+            return await msg.answer("❌ Формат: /logs tail [N] или /logs follow")
+        try:
+            lines, offset = await asyncio.to_thread(tail_lines, get_log_file(), n)
+        except FileNotFoundError:
+            return await msg.answer("📭 Логов за сегодня пока нет")
+        
+        if p[1] == "tail":
+            return await msg.answer(format_log_lines(f"📋 Последние {len(lines)} строк:", lines), parse_mode="Markdown")
+        
+        sent = await msg.answer(format_log_lines("📡 Лог в реальном времени:", lines), parse_mode="Markdown")
+        # Новое слежение в этом чате заменяет предыдущее
+        old = log_followers.pop(msg.chat.id, None)
+        if old:
+            old.cancel()
+        log_followers[msg.chat.id] = asyncio.create_task(
+            follow_log(msg.bot, msg.chat.id, sent.message_id, lines, offset)
+        )
+        return
+    
     stats = get_today_stats()
-    if not stats:
+    if not stats['total_actions']:
         return await msg.answer("📭 Логов за сегодня пока нет")
     
     txt = (
@@ -374,25 +582,146 @@ async def cmd_logs(msg: Message):
         f"❌ Проигрышей: {stats['losses']}\n"
         f"💳 Платежей: {stats['payments']}\n"
         f"↩️ Возвратов: {stats['refunds']}\n\n"
-        f"📁 Файл: logs/users_{datetime.now().strftime('%Y-%m-%d')}.log"
+        f"📁 Файл: {get_log_file()}"
     )
     
     await msg.answer(txt)
     
-    # Отправляем последние 15 записей лога
+    # Последние 15 записей: читаем с конца файла только нужные блоки
     try:
-        log_file = f"logs/users_{datetime.now().strftime('%Y-%m-%d')}.log"
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
+        lines, _ = await asyncio.to_thread(tail_lines, get_log_file(), 15)
         if lines:
-            last_lines = lines[-15:]  # Последние 15 записей
-            log_text = "📋 Последние 15 действий:\n\n```\n" + "".join(last_lines) + "```"
-            await msg.answer(log_text, parse_mode="Markdown")
+            await msg.answer(format_log_lines("📋 Последние 15 действий:", lines), parse_mode="Markdown")
+    except FileNotFoundError:
+        pass
     except Exception as e:
         logger.error(f"Ошибка чтения лога: {e}")
+
+
+@router.message(Command("rtp"))
+async def cmd_rtp(msg: Message):
+    """Анализ RTP и прибыли по таблице коэффициентов"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
     
-    await msg.answer(txt)
+    try:
+        p = msg.text.split()
+        amount = int(p[1]) if len(p) > 1 else None
+    except ValueError:
+        return await msg.answer("❌ Формат: /rtp [сумма]")
+    
+    log_admin_action(msg.from_user.id, "RTP")
+    
+    # Симуляция блокирует CPU - выполняем в отдельном потоке
+    sim = await asyncio.to_thread(simulate_bankroll, None, amount or 10, 10000, 200)
+    
+    await msg.answer(format_analysis(analyze_all(amount)) + "\n\n" + format_simulation(sim))
+
+
+# Задача автоостановки текущей сессии /profile
+profile_task = None
+
+
+async def finish_profile(bot: Bot, chat_id: int):
+    """Остановить профайлер и отправить сводку и collapsed-стеки администратору"""
+    result = profiler.stop()
+    summary = format_profile_summary(result)
+    if not result['stacks']:
+        return await bot.send_message(chat_id, summary)
+    
+    path = await asyncio.to_thread(write_collapsed, result)
+    try:
+        await bot.send_document(chat_id, FSInputFile(path), caption=summary[:1024])
+    finally:
+        os.remove(path)
+
+
+async def profile_timer(bot: Bot, chat_id: int, seconds: int):
+    global profile_task
+    await asyncio.sleep(seconds)
+    profile_task = None
+    await finish_profile(bot, chat_id)
+
+
+@router.message(Command("profile"))
+async def cmd_profile(msg: Message):
+    """Сэмплирующий профайлер: /profile start [сек] | /profile stop"""
+    global profile_task
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    p = msg.text.split()
+    action = p[1] if len(p) > 1 else ""
+    
+    if action == "start":
+        try:
+            seconds = min(int(p[2]), PROFILE_MAX_SECONDS) if len(p) > 2 else 30
+        except ValueError:
+            return await msg.answer("❌ Формат: /profile start [секунды]")
+        if not profiler.start(seconds):
+            return await msg.answer("⏳ Профайлер уже запущен. /profile stop - остановить")
+        
+        log_admin_action(msg.from_user.id, "PROFILE_START", seconds=seconds)
+        profile_task = asyncio.create_task(profile_timer(msg.bot, msg.chat.id, seconds))
+        return await msg.answer(f"🔬 Профайлер запущен на {seconds} сек")
+    
+    if action == "stop":
+        if not profiler.running:
+            return await msg.answer("📭 Профайлер не запущен")
+        if profile_task:
+            profile_task.cancel()
+            profile_task = None
+        log_admin_action(msg.from_user.id, "PROFILE_STOP")
+        return await finish_profile(msg.bot, msg.chat.id)
+    
+    await msg.answer("❌ Формат: /profile start [секунды] | /profile stop")
+
+
+@router.message(Command("mem"))
+async def cmd_mem(msg: Message):
+    """Отчет о памяти: /mem или /mem baseline"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    p = msg.text.split()
+    if len(p) > 1 and p[1] == "baseline":
+        started = await asyncio.to_thread(set_baseline)
+        log_admin_action(msg.from_user.id, "MEM_BASELINE")
+        return await msg.answer(
+            ("▶️ tracemalloc запущен. " if started else "") + "📸 Базовый снимок сохранен, /mem покажет прирост"
+        )
+    
+    log_admin_action(msg.from_user.id, "MEM")
+    # Обход всех структур - в отдельном потоке, чтобы не блокировать цикл событий
+    report = await asyncio.to_thread(memory_report)
+    await msg.answer(format_memory_report(report)[:4000])
+
+
+@router.message(Command("audit"))
+async def cmd_audit(msg: Message):
+    """Сверка балансов с журналом: /audit [сколько худших показать]"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    p = msg.text.split()
+    top = min(max(int(p[1]), 1), 30) if len(p) > 1 and p[1].isdigit() else 10
+    
+    log_admin_action(msg.from_user.id, "AUDIT")
+    status = await msg.answer("🧾 Сверяем балансы...")
+    snapshot = f"{DB_FILE}.audit"
+    try:
+        # Согласованный снимок - на цикле событий, без await; разбор и расчет -
+        # в отдельном процессе (spawn, а не fork многопоточного бота), GIL бота свободен
+        write_snapshot(get_all_users(), snapshot)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            result = await asyncio.get_running_loop().run_in_executor(pool, audit_file, snapshot, top)
+    except Exception as e:
+        logger.error(f"Ошибка сверки: {e}")
+        return await status.edit_text(f"❌ Ошибка сверки: {e}")
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+    await status.edit_text(format_audit(result)[:4000])
 
 
 @router.message(Command("deposit"))
@@ -424,6 +753,182 @@ async def cmd_withdraw(msg: Message, state: FSMContext):
     await state.set_state(BetStates.waiting_withdraw_amount)
 
 
+@router.message(Command("table"))
+async def cmd_table(msg: Message, bot: Bot):
+    """Открыть общий стол в группе: /table [игра]"""
+    if msg.chat.type not in ("group", "supergroup"):
+        return await msg.answer("❌ Общий стол доступен только в группах")
+    
+    p = msg.text.split()
+    game = p[1] if len(p) > 1 else '🎲'
+    if game not in GAME_NAMES:
+        return await msg.answer(f"❌ Формат: /table [{' '.join(GAME_NAMES)}]")
+    
+    table = open_table(msg.chat.id, game, TABLE_BET_WINDOW)
+    if not table:
+        return await msg.answer("⏳ Стол уже открыт, делай ставки!")
+    
+    sent_msg = await msg.answer(
+        f"🎰 Стол открыт: {game} {GAME_NAMES[game]}\n\n"
+        f"⏱ Прием ставок: {TABLE_BET_WINDOW} сек\n"
+        f"Ставки списываются с баланса, один бросок для всех",
+        reply_markup=get_table_bets_keyboard(game)
+    )
+    table.message_id = sent_msg.message_id
+    table.task = asyncio.create_task(run_table(bot, table))
+
+
+async def run_table(bot: Bot, table):
+    """Таймер стола: закрыть прием ставок, один бросок, пакетный расчет"""
+    try:
+        await asyncio.sleep(TABLE_BET_WINDOW)
+    finally:
+        close_table(table.chat_id)
+    
+    try:
+        await bot.edit_message_reply_markup(chat_id=table.chat_id, message_id=table.message_id, reply_markup=None)
+    except:
+        pass
+    
+    if not table.bets:
+        return await bot.send_message(table.chat_id, f"🎰 {table.game} Стол закрыт: ставок не было")
+    
+    for bet in table.bets:
+        log_game_start(bet['user_id'], table.game, bet['bet_type'], bet['amount'], bet['username'])
+    
+    try:
+        dm = await bot.send_dice(chat_id=table.chat_id, emoji=table.game)
+    except Exception as e:
+        logger.error(f"Ошибка броска за столом {table.chat_id}: {e}")
+        refund_table(table, DB_FILE)
+        return await bot.send_message(table.chat_id, "❌ Бросок не удался, ставки возвращены на баланс")
+    await asyncio.sleep(DICE_ANIMATION_DELAY)
+    
+    results = settle_table(table, dm.dice.value, DB_FILE)
+    
+    lines = []
+    for r in results:
+        if r['result']['win']:
+            log_win(r['user_id'], table.game, r['bet_type'], r['amount'], r['winnings'], r['username'])
+            lines.append(f"✅ {r['name']}: {BET_TYPE_NAMES.get(r['bet_type'], r['bet_type'])} {r['amount']} ⭐ → +{r['winnings']} ⭐")
+        else:
+            log_loss(r['user_id'], table.game, r['bet_type'], r['amount'], r['username'])
+            lines.append(f"❌ {r['name']}: {BET_TYPE_NAMES.get(r['bet_type'], r['bet_type'])} {r['amount']} ⭐")
+    
+    await bot.send_message(
+        table.chat_id,
+        f"🎰 {table.game} Выпало: {results[0]['result']['outcome']}\n"
+        f"💰 Банк стола: {table.pot} ⭐ | Ставок: {len(results)}\n\n" + "\n".join(lines)
+    )
+
+
+@router.callback_query(F.data.startswith("tbet_"))
+async def table_bet(cb: CallbackQuery):
+    """Ставка за общим столом"""
+    table = open_tables.get(cb.message.chat.id)
+    if not table:
+        return await cb.answer("⏳ Стол закрыт", show_alert=True)
+    if game_admission.overloaded():
+        return await cb.answer(BUSY_MESSAGES['overload'], show_alert=True)
+    
+    bet_type, amount = cb.data[len("tbet_"):].rsplit("_", 1)
+    amount = int(amount)
+    
+    get_user_data(cb.from_user.id, cb.from_user, DB_FILE)
+    error = place_table_bet(
+        table, cb.from_user.id, cb.from_user.first_name, cb.from_user.username,
+        bet_type, amount, DB_FILE
+    )
+    if error:
+        return await cb.answer(error, show_alert=True)
+    
+    await cb.answer(f"✅ Ставка принята: {BET_TYPE_NAMES.get(bet_type, bet_type)} {amount} ⭐")
+
+
+@router.message(Command("autoplay"))
+async def cmd_autoplay(msg: Message, bot: Bot):
+    """Автоигра: /autoplay [игра] [ставка] [сумма] [раунды] [стоп_баланс] [win]"""
+    usage = (
+        "🔁 Автоигра\n\n"
+        "Формат: /autoplay [игра] [ставка] [сумма] [раунды] [стоп_баланс] [win]\n"
+        "Пример: /autoplay 🎲 четное 10 20 50 win\n\n"
+        "• стоп_баланс - остановиться, когда баланс ниже\n"
+        "• win - остановиться после первого выигрыша"
+    )
+    uid = msg.from_user.id
+    
+    try:
+        p = msg.text.split()
+        game, bet_type, amount, rounds = p[1], p[2], int(p[3]), int(p[4])
+        extra = p[5:]
+        stop_on_win = 'win' in extra
+        stop_below = next((int(x) for x in extra if x.isdigit()), 0)
+    except (IndexError, ValueError):
+        return await msg.answer(usage)
+    
+    if game not in COEFFICIENTS or bet_type not in COEFFICIENTS[game]:
+        return await msg.answer(usage)
+    if amount < 1 or not 1 <= rounds <= AUTOPLAY_MAX_ROUNDS:
+        return await msg.answer(f"❌ Сумма от 1 ⭐, раундов от 1 до {AUTOPLAY_MAX_ROUNDS}")
+    if uid in active_autoplays:
+        return await msg.answer("⏳ Автоигра уже идет")
+    # Серия из десятков бросков - при перегрузке не запускаем (как новые игры в admission)
+    if game_admission.overloaded():
+        return await msg.answer(BUSY_MESSAGES['overload'])
+    
+    ud = get_user_data(uid, msg.from_user, DB_FILE)
+    if ud['balance'] < amount:
+        return await msg.answer(f"❌ Недостаточно средств\n💳 Баланс: {ud['balance']} ⭐")
+    
+    # Занимаем слот до первого await, серия идет фоновой задачей (как run_table),
+    # чтобы не держать обработку обновления (и ответ webhook) минутами
+    active_autoplays.add(uid)
+    autoplay_tasks[uid] = asyncio.create_task(run_autoplay_series(
+        bot, msg, game, bet_type, amount, rounds, stop_below, stop_on_win, ud['balance']
+    ))
+
+
+# Фоновые задачи автоигры по пользователям
+autoplay_tasks = {}
+
+
+async def run_autoplay_series(bot: Bot, msg: Message, game: str, bet_type: str, amount: int,
+                              rounds: int, stop_below: int, stop_on_win: bool, start_balance: int):
+    """Серия автоигры и итоговое сообщение"""
+    uid = msg.from_user.id
+    try:
+        await msg.answer(f"🔁 Автоигра: {game} {bet_type} по {amount} ⭐, до {rounds} раундов...")
+        
+        summary = await run_autoplay(
+            bot, uid, msg.from_user.username, game, bet_type, amount,
+            rounds, stop_below, stop_on_win, DB_FILE
+        )
+        
+        # Даем доиграть анимации последнего броска
+        await asyncio.sleep(DICE_ANIMATION_DELAY)
+        
+        reasons = {
+            'rounds': "сыграны все раунды",
+            'win': "выигрыш",
+            'balance': "недостаточно средств",
+            'stop_below': f"баланс ниже {stop_below} ⭐",
+            'error': "ошибка броска"
+        }
+        await msg.answer(
+            f"🔁 Автоигра завершена: {reasons[summary['reason']]}\n\n"
+            f"🎮 Сыграно: {summary['played']}\n"
+            f"✅ Выигрышей: {summary['wins']}\n"
+            f"📊 Итог: {summary['profit']:+d} ⭐\n"
+            f"💳 Баланс: {start_balance} → {summary['balance']} ⭐"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка автоигры {uid}: {e}")
+    finally:
+        active_autoplays.discard(uid)
+        if autoplay_tasks.get(uid) is asyncio.current_task():
+            del autoplay_tasks[uid]
+
+
 @router.message(F.text == "🎮 Играть")
 async def text_play(msg: Message, bot: Bot):
     """Текстовая команда Играть"""
@@ -443,6 +948,42 @@ async def text_play(msg: Message, bot: Bot):
     await save_message_id(msg.from_user.id, sent_msg.message_id)
 
 
+def format_profile(ud: dict) -> str:
+    """Текст профиля по счетчикам пользователя (без прохода по истории)"""
+    stats = ud['stats']
+    wr = (stats['wins'] / ud['games_played'] * 100) if ud['games_played'] > 0 else 0
+    
+    txt = (
+        f"👤 Профиль\n\n"
+        f"💳 Баланс: {ud['balance']} ⭐\n"
+        f"🎮 Всего игр: {ud['games_played']}\n"
+        f"✅ Выигрышей: {stats['wins']} игр ({wr:.1f}%)\n"
+        f"❌ Проигрышей: {stats['losses']} игр\n"
+        f"💰 Всего ставок: {ud['total_bets']} ⭐"
+    )
+    
+    if stats['biggest_win']:
+        txt += f"\n🏆 Крупнейший выигрыш: {stats['biggest_win']} ⭐"
+    if stats['streak'] > 1:
+        txt += f"\n🔥 Серия побед: {stats['streak']}"
+    elif stats['streak'] < -1:
+        txt += f"\n🧊 Серия поражений: {-stats['streak']}"
+    
+    if stats['by_game']:
+        txt += "\n\n🎯 По играм:\n" + "\n".join(
+            f"{game} {g['wins']}/{g['games']} ({g['wins'] / g['games'] * 100:.0f}%)"
+            for game, g in stats['by_game'].items()
+        )
+    
+    if stats['recent']:
+        txt += "\n\n📜 Последние 5:\n" + "\n".join(
+            f"{'✅' if g['win'] else '❌'} {g['game']} {g['bet_type']} {g['winnings']:+d} ⭐"
+            for g in stats['recent'][::-1]
+        )
+    
+    return txt
+
+
 @router.message(F.text == "👤 Профиль")
 async def text_profile(msg: Message, state: FSMContext, bot: Bot):
     """Текстовая команда Профиль"""
@@ -457,25 +998,7 @@ async def text_profile(msg: Message, state: FSMContext, bot: Bot):
     
     ud = get_user_data(msg.from_user.id, msg.from_user, DB_FILE)
     
-    # Подсчет выигрышных и проигрышных игр
-    wins_count = sum(1 for g in ud['history'] if g['win'])
-    losses_count = sum(1 for g in ud['history'] if not g['win'])
-    wr = (wins_count / ud['games_played'] * 100) if ud['games_played'] > 0 else 0
-    
-    txt = (
-        f"👤 Профиль\n\n"
-        f"💳 Баланс: {ud['balance']} ⭐\n"
-        f"🎮 Всего игр: {ud['games_played']}\n"
-        f"✅ Выигрышей: {wins_count} игр ({wr:.1f}%)\n"
-        f"❌ Проигрышей: {losses_count} игр\n"
-        f"💰 Всего ставок: {ud['total_bets']} ⭐"
-    )
-    
-    if ud['history']:
-        txt += "\n\n📜 Последние 5:\n" + "\n".join(
-            f"{'✅' if g['win'] else '❌'} {g['game']} {g['bet_type']} {g['winnings']:+d} ⭐"
-            for g in ud['history'][-5:][::-1]
-        )
+    txt = format_profile(ud)
     
     await delete_last_message(msg.from_user.id, bot)
     
@@ -487,6 +1010,45 @@ async def text_profile(msg: Message, state: FSMContext, bot: Bot):
     await save_message_id(msg.from_user.id, sent_msg.message_id)
 
 
+def format_history_page(user_id: int, end: int = None) -> tuple:
+    """Текст и клавиатура страницы истории"""
+    games, start, end, total = get_history_page(user_id, end, HISTORY_PAGE_SIZE)
+    if not total:
+        return "📜 История пуста", None
+    
+    lines = [
+        f"{i}. {'✅' if g['win'] else '❌'} {g['game']} {g['bet_type']} {g['winnings']:+d} ⭐"
+        f"{' [ВОЗВРАТ]' if g.get('refunded') else ''}\n   {g['date']}"
+        for i, g in zip(range(end, start, -1), games)
+    ]
+    txt = f"📜 История игр ({start + 1}-{end} из {total})\n\n" + "\n".join(lines)
+    return txt, get_history_keyboard(start, end, total, HISTORY_PAGE_SIZE)
+
+
+@router.message(Command("history"))
+@router.message(F.text == "📜 История")
+async def cmd_history(msg: Message, bot: Bot):
+    """История игр с постраничной навигацией"""
+    if msg.text == "📜 История":
+        try:
+            await msg.delete()
+        except:
+            pass
+    
+    get_user_data(msg.from_user.id, msg.from_user, DB_FILE)
+    txt, kb = format_history_page(msg.from_user.id)
+    await msg.answer(txt, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("hist_"))
+async def history_page(cb: CallbackQuery):
+    """Переключение страницы истории (редактирование сообщения)"""
+    txt, kb = format_history_page(cb.from_user.id, int(cb.data[len("hist_"):]))
+    if cb.message.text != txt:
+        await cb.message.edit_text(txt, reply_markup=kb)
+    await cb.answer()
+
+
 @router.message(F.text == "ℹ️ Правила")
 async def text_rules(msg: Message, bot: Bot):
     """Текстовая команда Правила"""
@@ -567,25 +1129,7 @@ async def back_to_main(msg: Message, state: FSMContext, bot: Bot):
         
         ud = get_user_data(msg.from_user.id, msg.from_user, DB_FILE)
         
-        # Подсчет выигрышных и проигрышных игр
-        wins_count = sum(1 for g in ud['history'] if g['win'])
-        losses_count = sum(1 for g in ud['history'] if not g['win'])
-        wr = (wins_count / ud['games_played'] * 100) if ud['games_played'] > 0 else 0
-        
-        txt = (
-            f"👤 Профиль\n\n"
-            f"💳 Баланс: {ud['balance']} ⭐\n"
-            f"🎮 Всего игр: {ud['games_played']}\n"
-            f"✅ Выигрышей: {wins_count} игр ({wr:.1f}%)\n"
-            f"❌ Проигрышей: {losses_count} игр\n"
-            f"💰 Всего ставок: {ud['total_bets']} ⭐"
-        )
-        
-        if ud['history']:
-            txt += "\n\n📜 Последние 5:\n" + "\n".join(
-                f"{'✅' if g['win'] else '❌'} {g['game']} {g['bet_type']} {g['winnings']:+d} ⭐"
-                for g in ud['history'][-5:][::-1]
-            )
+        txt = format_profile(ud)
         
         sent_msg = await bot.send_message(
             chat_id=msg.from_user.id,
@@ -600,25 +1144,7 @@ async def back_to_main(msg: Message, state: FSMContext, bot: Bot):
         
         ud = get_user_data(msg.from_user.id, msg.from_user, DB_FILE)
         
-        # Подсчет выигрышных и проигрышных игр
-        wins_count = sum(1 for g in ud['history'] if g['win'])
-        losses_count = sum(1 for g in ud['history'] if not g['win'])
-        wr = (wins_count / ud['games_played'] * 100) if ud['games_played'] > 0 else 0
-        
-        txt = (
-            f"👤 Профиль\n\n"
-            f"💳 Баланс: {ud['balance']} ⭐\n"
-            f"🎮 Всего игр: {ud['games_played']}\n"
-            f"✅ Выигрышей: {wins_count} игр ({wr:.1f}%)\n"
-            f"❌ Проигрышей: {losses_count} игр\n"
-            f"💰 Всего ставок: {ud['total_bets']} ⭐"
-        )
-        
-        if ud['history']:
-            txt += "\n\n📜 Последние 5:\n" + "\n".join(
-                f"{'✅' if g['win'] else '❌'} {g['game']} {g['bet_type']} {g['winnings']:+d} ⭐"
-                for g in ud['history'][-5:][::-1]
-            )
+        txt = format_profile(ud)
         
         sent_msg = await bot.send_message(
             chat_id=msg.from_user.id,
@@ -732,6 +1258,11 @@ async def profile_actions(msg: Message, state: FSMContext, bot: Bot):
 @router.message(F.text.startswith("⭐ "))
 async def deposit_amount_selected(msg: Message, bot: Bot, state: FSMContext):
     """Выбор фиксированной суммы пополнения"""
+    # Кнопки сумм ставки тоже начинаются с "⭐ " - если выбран тип ставки, это ставка
+    data = await state.get_data()
+    if data.get('selected_bet_type'):
+        return await bet_amount_selected_text(msg, state, bot)
+    
     # Удаляем сообщение пользователя
     try:
         await msg.delete()
@@ -816,6 +1347,25 @@ async def game_selected(msg: Message, state: FSMContext, bot: Bot):
     await save_message_id(msg.from_user.id, sent_msg.message_id)
 
 
+def format_game_result(game: str, bet_type: str, amount: int, res: dict, winnings: int, balance: int) -> str:
+    """Текст результата игры"""
+    if res['win']:
+        return (
+            f"🎉 ВЫИГРЫШ!\n\n"
+            f"{game} Выпало: {res['outcome']}\n"
+            f"🎯 Ставка: {bet_type}\n\n"
+            f"💰 Выигрыш: {winnings} ⭐ (x{res['coefficient']})\n"
+            f"💳 Баланс: {balance} ⭐"
+        )
+    return (
+        f"😔 Не повезло\n\n"
+        f"{game} Выпало: {res['outcome']}\n"
+        f"🎯 Ставка: {bet_type}\n\n"
+        f"💸 Потеря: {amount} ⭐\n"
+        f"💳 Баланс: {balance} ⭐"
+    )
+
+
 async def play_from_balance_text(msg: Message, game: str, bet_type: str, amount: int, user_data: dict, state: FSMContext):
     """Игра с баланса через текстовый интерфейс"""
     uid = msg.from_user.id
@@ -828,51 +1378,16 @@ async def play_from_balance_text(msg: Message, game: str, bet_type: str, amount:
     user_data['balance'] -= amount
     
     dm = await msg.answer_dice(emoji=game)
-    await asyncio.sleep(4)
+    await asyncio.sleep(DICE_ANIMATION_DELAY)
     
-    dv = dm.dice.value
-    res = determine_game_result(game, bet_type, dv)
-    
-    user_data['total_bets'] += amount
-    user_data['games_played'] += 1
+    res, w = settle_bet(user_data, game, bet_type, amount, dm.dice.value)
     
     if res['win']:
-        w = int(amount * res['coefficient'])
-        user_data['balance'] += w
-        user_data['total_wins'] += w
         log_win(uid, game, bet_type, amount, w, username)
-        
-        txt = (
-            f"🎉 ВЫИГРЫШ!\n\n"
-            f"{game} Выпало: {res['outcome']}\n"
-            f"🎯 Ставка: {bet_type}\n\n"
-            f"💰 Выигрыш: {w} ⭐ (x{res['coefficient']})\n"
-            f"💳 Баланс: {user_data['balance']} ⭐"
-        )
     else:
-        user_data['total_losses'] += amount
-        w = -amount
         log_loss(uid, game, bet_type, amount, username)
-        
-        txt = (
-            f"😔 Не повезло\n\n"
-            f"{game} Выпало: {res['outcome']}\n"
-            f"🎯 Ставка: {bet_type}\n\n"
-            f"💸 Потеря: {amount} ⭐\n"
-            f"💳 Баланс: {user_data['balance']} ⭐"
-        )
     
-    user_data['history'].append({
-        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-        'game': game,
-        'bet_type': bet_type,
-        'amount': amount,
-        'result': res['outcome'],
-        'dice_value': dv,
-        'win': res['win'],
-        'winnings': w,
-        'payment_id': 'balance'
-    })
+    txt = format_game_result(game, bet_type, amount, res, w, user_data['balance'])
     
     save_database(DB_FILE)
     await msg.answer(txt)
@@ -884,63 +1399,36 @@ async def play_from_balance_callback(cb: CallbackQuery, game: str, bet_type: str
     uid = cb.from_user.id
     username = cb.from_user.username
     
-    log_game_start(uid, game, bet_type, amount, username)
-    
-    sent_msg = await bot.send_message(
-        chat_id=cb.from_user.id,
-        text=f"💳 Списываем {amount} ⭐ с баланса...\n\n🎮 Запускаем {game}..."
-    )
+    # Перегрузка: быстрый отказ до списания
+    busy = game_admission.acquire(uid)
+    if busy:
+        return await cb.answer(BUSY_MESSAGES[busy], show_alert=True)
     
-    user_data['balance'] -= amount
-    
-    dm = await bot.send_dice(chat_id=cb.from_user.id, emoji=game)
-    await asyncio.sleep(4)
-    
-    dv = dm.dice.value
-    res = determine_game_result(game, bet_type, dv)
-    
-    user_data['total_bets'] += amount
-    user_data['games_played'] += 1
-    
-    if res['win']:
-        w = int(amount * res['coefficient'])
-        user_data['balance'] += w
-        user_data['total_wins'] += w
-        log_win(uid, game, bet_type, amount, w, username)
+    try:
+        log_game_start(uid, game, bet_type, amount, username)
         
-        txt = (
-            f"🎉 ВЫИГРЫШ!\n\n"
-            f"{game} Выпало: {res['outcome']}\n"
-            f"🎯 Ставка: {bet_type}\n\n"
-            f"💰 Выигрыш: {w} ⭐ (x{res['coefficient']})\n"
-            f"💳 Баланс: {user_data['balance']} ⭐"
+        sent_msg = await bot.send_message(
+            chat_id=cb.from_user.id,
+            text=f"💳 Списываем {amount} ⭐ с баланса...\n\n🎮 Запускаем {game}..."
         )
-    else:
-        user_data['total_losses'] += amount
-        w = -amount
-        log_loss(uid, game, bet_type, amount, username)
         
-        txt = (
-            f"😔 Не повезло\n\n"
-            f"{game} Выпало: {res['outcome']}\n"
-            f"🎯 Ставка: {bet_type}\n\n"
-            f"💸 Потеря: {amount} ⭐\n"
-            f"💳 Баланс: {user_data['balance']} ⭐"
-        )
-    
-    user_data['history'].append({
-        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-        'game': game,
-        'bet_type': bet_type,
-        'amount': amount,
-        'result': res['outcome'],
-        'dice_value': dv,
-        'win': res['win'],
-        'winnings': w,
-        'payment_id': 'balance'
-    })
-    
-    save_database(DB_FILE)
+        user_data['balance'] -= amount
+        
+        dm = await bot.send_dice(chat_id=cb.from_user.id, emoji=game)
+        await asyncio.sleep(DICE_ANIMATION_DELAY)
+        
+        res, w = settle_bet(user_data, game, bet_type, amount, dm.dice.value)
+        
+        if res['win']:
+            log_win(uid, game, bet_type, amount, w, username)
+        else:
+            log_loss(uid, game, bet_type, amount, username)
+        
+        txt = format_game_result(game, bet_type, amount, res, w, user_data['balance'])
+        
+        save_database(DB_FILE)
+    finally:
+        game_admission.release(uid)
     await bot.send_message(chat_id=cb.from_user.id, text=txt)
     await state.clear()
 
@@ -999,6 +1487,19 @@ async def bet_type_selected_text(msg: Message, state: FSMContext, bot: Bot):
 @router.message(F.text.in_(["⭐ 1", "⭐ 5", "⭐ 10", "⭐ 25", "⭐ 50", "⭐ 100", "⭐ 250", "⭐ 500", "⭐ 1000"]))
 async def bet_amount_selected_text(msg: Message, state: FSMContext, bot: Bot):
     """Выбор суммы ставки через Reply кнопку"""
+    # Перегрузка: быстрый отказ до любой работы, выбор игры и ставки сохраняется для повтора
+    busy = game_admission.acquire(msg.from_user.id)
+    if busy:
+        return await msg.answer(BUSY_MESSAGES[busy])
+    
+    try:
+        await bet_amount_admitted(msg, state, bot)
+    finally:
+        game_admission.release(msg.from_user.id)
+
+
+async def bet_amount_admitted(msg: Message, state: FSMContext, bot: Bot):
+    """Ставка после допуска: игра с баланса или счет на оплату"""
     # Удаляем сообщение пользователя
     try:
         await msg.delete()
@@ -1027,7 +1528,7 @@ async def bet_amount_selected_text(msg: Message, state: FSMContext, bot: Bot):
             chat_id=msg.from_user.id,
             title=f"{game} {bet_type}",
             description=f"Ставка {amount} ⭐ на {bet_type}",
-            payload=f"{game}:{bet_type}:{amount}",
+            payload=f"{msg.from_user.id}:{game}:{bet_type}:{amount}",
             provider_token="",
             currency="XTR",
             prices=[LabeledPrice(label="Ставка", amount=amount)]
@@ -1041,39 +1542,40 @@ async def bet_amount_selected_text(msg: Message, state: FSMContext, bot: Bot):
 
 @router.callback_query(F.data == "admin_users")
 async def admin_show_users(cb: CallbackQuery):
-    """Показать всех пользователей"""
+    """Показать пользователей (постранично)"""
     if cb.from_user.id != ADMIN_ID:
         return await cb.answer("❌ Нет доступа", show_alert=True)
     
-    users_db = get_all_users()
-    if not users_db:
+    if not get_all_users():
         return await cb.answer("📭 Пользователей пока нет", show_alert=True)
     
-    sorted_users = sorted(users_db.items(), key=lambda x: x[1]['games_played'], reverse=True)
-    txt = f"👥 СПИСОК ПОЛЬЗОВАТЕЛЕЙ ({len(users_db)})\n\n"
-    
-    for uid, data in sorted_users:
-        username = f"@{data.get('username')}" if data.get('username') else "—"
-        first_name = data.get('first_name', '—')
-        last_name = data.get('last_name', '')
-        full_name = f"{first_name} {last_name}".strip() if last_name else first_name
-        
-        txt += (
-            f"👤 {full_name}\n"
-            f"   ID: {uid}\n"
-            f"   Username: {username}\n"
-            f"   💳 Баланс: {data['balance']} ⭐\n"
-            f"   🎮 Игр: {data['games_played']}\n\n"
-        )
-        
-        if len(txt) > 3500:
-            await cb.message.answer(txt)
-            txt = ""
+    txt, kb = await format_users_page('games', 0, refresh=True)
+    try:
+        await cb.message.edit_text(txt, reply_markup=kb)
+    except TelegramBadRequest:
+        # Список уже открыт и не изменился
+        pass
+    await cb.answer()
+
+
+@router.callback_query(F.data.startswith("users_"))
+async def admin_users_page(cb: CallbackQuery):
+    """Навигация по списку пользователей: users_{ключ}_{offset}[_r]"""
+    if cb.from_user.id != ADMIN_ID:
+        return await cb.answer("❌ Нет доступа", show_alert=True)
     
-    if txt:
-        await cb.message.answer(txt)
+    p = cb.data.split("_")
+    key, offset, refresh = p[1], int(p[2]), len(p) > 3
+    if key not in SORT_KEYS:
+        return await cb.answer()
     
-    await cb.answer("✅ Список отправлен")
+    txt, kb = await format_users_page(key, offset, refresh)
+    try:
+        await cb.message.edit_text(txt, reply_markup=kb)
+    except TelegramBadRequest:
+        # Страница не изменилась
+        pass
+    await cb.answer()
 
 
 @router.callback_query(F.data == "admin_stats")
@@ -1154,7 +1656,13 @@ async def admin_refresh(cb: CallbackQuery):
         f"/setbalance [user_id] [сумма]\n"
         f"/addbalance [user_id] [сумма]\n"
         f"/refund [user_id] [payment_id]\n"
-        f"/logs - логи за сегодня"
+        f"/find [имя] - поиск пользователя\n"
+        f"/logs [user id|tail N|follow] - логи за сегодня / пользователя\n"
+        f"/rtp [сумма] - анализ коэффициентов\n"
+        f"/profile start [сек] | stop - профилирование\n"
+        f"/mem [baseline] - память процесса\n"
+        f"/withdrawals - заявки на вывод\n"
+        f"/audit [N] - сверка балансов"
     )
     
     # Проверяем, изменился ли текст
@@ -1165,6 +1673,112 @@ async def admin_refresh(cb: CallbackQuery):
         await cb.answer("✅ Данные актуальны", show_alert=True)
 
 
+# Выбранные заявки в /withdrawals и выполняющийся пакет выплат
+withdraw_selection = set()
+withdraw_batch = None
+
+
+def format_withdrawals_page() -> tuple:
+    """Текст и клавиатура списка заявок на вывод"""
+    items = withdraw_queue.pending()
+    withdraw_selection.intersection_update(i['id'] for i in items)
+    if not items:
+        return "💸 Заявок на вывод нет", None
+    page = items[:WITHDRAW_PAGE_SIZE]
+    txt = (
+        f"💸 ЗАЯВКИ НА ВЫВОД: {len(items)} на {sum(i['amount'] for i in items)} ⭐\n\n"
+        + "\n".join(format_item(i) for i in page)
+    )
+    if len(items) > len(page):
+        txt += f"\n... и еще {len(items) - len(page)} (входят в \"Одобрить все\")"
+    return txt, get_withdrawals_keyboard(page, withdraw_selection)
+
+
+async def run_withdraw_batch(bot: Bot, chat_id: int, items: list):
+    """Пакет выплат с одной сводкой, которая правится по мере выполнения"""
+    summary = await bot.send_message(chat_id, format_batch(items))
+    last_edit = 0.0
+    
+    async def edit_summary(text: str):
+        try:
+            await summary.edit_text(text)
+        except TelegramBadRequest:
+            # Текст не изменился
+            pass
+    
+    async def progress():
+        nonlocal last_edit
+        # Правим сводку не чаще раза в секунду
+        now = asyncio.get_running_loop().time()
+        if now - last_edit >= 1:
+            last_edit = now
+            await edit_summary(format_batch(items))
+    
+    try:
+        result = await process_withdrawals(bot, items, DB_FILE, progress)
+        await edit_summary(
+            format_batch(items) +
+            f"\n\n🏁 Выплачено: {result['done']} на {result['amount']} ⭐, ошибок: {result['failed']}"
+        )
+        log_admin_action(chat_id, "WITHDRAW_BATCH", done=result['done'],
+                         failed=result['failed'], amount=f"{result['amount']}⭐")
+    except Exception as e:
+        logger.error(f"Ошибка пакета выплат: {e}")
+        await edit_summary(format_batch(items) + f"\n\n❌ Ошибка: {e}")
+
+
+@router.message(Command("withdrawals"))
+async def cmd_withdrawals(msg: Message):
+    """Очередь заявок на вывод"""
+    if msg.from_user.id != ADMIN_ID:
+        return await msg.answer("❌ Нет доступа")
+    
+    txt, kb = format_withdrawals_page()
+    await msg.answer(txt, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("wd_"))
+async def withdrawals_action(cb: CallbackQuery, bot: Bot):
+    """Выбор заявок, одобрение (всех или выбранных) и отклонение"""
+    global withdraw_batch
+    if cb.from_user.id != ADMIN_ID:
+        return await cb.answer("❌ Нет доступа", show_alert=True)
+    
+    alert = None
+    if cb.data.startswith("wd_toggle:"):
+        withdraw_selection.symmetric_difference_update({int(cb.data.split(":")[1])})
+    elif cb.data in ("wd_all", "wd_sel"):
+        if withdraw_batch and not withdraw_batch.done():
+            return await cb.answer("⏳ Предыдущий пакет еще выполняется", show_alert=True)
+        items = withdraw_queue.pending(None if cb.data == "wd_all" else withdraw_selection)
+        if not items:
+            return await cb.answer("📭 Нет заявок", show_alert=True)
+        withdraw_selection.clear()
+        withdraw_batch = asyncio.create_task(run_withdraw_batch(bot, cb.message.chat.id, items))
+    elif cb.data == "wd_reject":
+        selected = withdraw_queue.pending(withdraw_selection)
+        # Заявки с резервом (прерванная выплата) можно только повторить: платеж мог уйти
+        items = [i for i in selected if not i.get('charge_id')]
+        withdraw_queue.remove({i['id'] for i in items})
+        withdraw_selection.clear()
+        if len(items) < len(selected):
+            alert = "⚠️ Заявки с начатой выплатой не отклонены - одобри их повторно"
+        for item in items:
+            log_admin_action(cb.from_user.id, "WITHDRAW_REJECT", item['user_id'], amount=f"{item['amount']}⭐")
+            try:
+                await bot.send_message(item['user_id'], f"❌ Заявка на вывод {item['amount']} ⭐ отклонена")
+            except Exception as e:
+                logger.error(f"Не удалось уведомить {item['user_id']}: {e}")
+    
+    txt, kb = format_withdrawals_page()
+    try:
+        await cb.message.edit_text(txt, reply_markup=kb)
+    except TelegramBadRequest:
+        # Список не изменился
+        pass
+    await cb.answer(alert, show_alert=bool(alert))
+
+
 @router.callback_query(F.data.startswith("send_stars:"))
 async def send_stars_to_user(cb: CallbackQuery, bot: Bot):
     """Отправка звезд пользователю через refund"""
@@ -1177,54 +1791,49 @@ async def send_stars_to_user(cb: CallbackQuery, bot: Bot):
         user_id = int(user_id)
         amount = int(amount)
         
+        # Выплата по заявке уже начата и не подтверждена - повторять только из очереди,
+        # иначе новый резерв заберет другой платеж и звезды уйдут дважды
+        if any(i['user_id'] == user_id and i.get('charge_id') for i in withdraw_queue.pending()):
+            return await cb.answer("⏳ Есть незавершенный вывод - повторите его в /withdrawals", show_alert=True)
+        
         # Получаем данные пользователя
         ud = get_user_data(user_id, None, DB_FILE)
         
-        # Проверяем баланс
-        if ud['balance'] < amount:
-            await cb.answer(f"❌ У пользователя недостаточно средств на балансе", show_alert=True)
-            return
-        
-        # Ищем подходящий платеж для возврата
-        available_payments = [p for p in ud.get('payments', []) if not p.get('refunded', False)]
-        
-        if not available_payments:
-            await cb.answer("❌ Нет доступных платежей для возврата. Пользователь должен сначала пополнить баланс.", show_alert=True)
+        # Проверяем баланс, занимаем подходящий платеж и списываем сумму
+        suitable_payment, error = reserve_withdrawal(ud, amount)
+        if not suitable_payment:
+            await cb.answer(f"❌ {error}", show_alert=True)
             return
         
-        # Ищем платеж с суммой >= запрошенной суммы
-        suitable_payment = None
-        for payment in available_payments:
-            if payment['amount'] >= amount:
-                suitable_payment = payment
-                break
-        
-        if not suitable_payment:
-            # Берем самый большой доступный платеж
-            suitable_payment = max(available_payments, key=lambda x: x['amount'])
-            if suitable_payment['amount'] < amount:
-                await cb.answer(
-                    f"❌ Максимальная сумма возврата: {suitable_payment['amount']} ⭐\n"
-                    f"Запрошено: {amount} ⭐",
-                    show_alert=True
-                )
-                return
+        # Резерв сохраняем до выплаты: после сбоя звезды не уйдут дважды
+        save_database(DB_FILE)
+        item = withdraw_queue.link_user_request(
+            user_id, amount, suitable_payment['telegram_payment_charge_id']
+        )
         
         # Выполняем возврат через Telegram API
         try:
-            await bot.refund_star_payment(
-                user_id=user_id,
-                telegram_payment_charge_id=suitable_payment['telegram_payment_charge_id']
-            )
+            try:
+                await bot.refund_star_payment(
+                    user_id=user_id,
+                    telegram_payment_charge_id=suitable_payment['telegram_payment_charge_id']
+                )
+            except TelegramAPIError as e:
+                # Явный отказ - откат; без ответа резерв остается до проверки админом
+                # (заявка хранит charge_id, повтор из очереди вернет тот же платеж)
+                if not isinstance(e, TelegramNetworkError):
+                    release_withdrawal(ud, suitable_payment, amount)
+                    save_database(DB_FILE)
+                    if item:
+                        item.pop('charge_id', None)
+                elif item:
+                    item['status'], item['error'] = 'failed', f"нет ответа Telegram: {str(e)[:80]}"
+                if item:
+                    withdraw_queue.save()
+                raise
             
-            # Помечаем платеж как возвращенный
-            suitable_payment['refunded'] = True
-            suitable_payment['refund_date'] = datetime.now().isoformat()
-            suitable_payment['refund_amount'] = amount
-            
-            # Списываем с баланса пользователя
-            ud['balance'] -= amount
-            save_database(DB_FILE)
+            if item:
+                withdraw_queue.remove({item['id']})
             
             log_balance_change(user_id, ud['balance'] + amount, ud['balance'], "withdraw", ud.get('username'))
             log_refund(user_id, amount, suitable_payment['telegram_payment_charge_id'], ud.get('username'))
@@ -1356,30 +1965,24 @@ async def process_withdraw(msg: Message, state: FSMContext, bot: Bot):
         if amount < 1:
             return await msg.answer("❌ Минимальная сумма: 1 ⭐")
         
-        if amount > ud['balance']:
-            return await msg.answer(f"❌ Недостаточно средств\n💳 Доступно: {ud['balance']} ⭐")
-        
-        # Создаем инлайн-кнопку для отправки звезд
-        send_stars_kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(
-                text=f"💫 Отправить {amount} ⭐",
-                callback_data=f"send_stars:{msg.from_user.id}:{amount}"
-            )]
-        ])
+        # Уже поданные заявки резервируют баланс
+        available = ud['balance'] - withdraw_queue.pending_amount(msg.from_user.id)
+        if amount > available:
+            return await msg.answer(f"❌ Недостаточно средств\n💳 Доступно: {available} ⭐")
         
-        # Отправляем запрос админу
-        await bot.send_message(
-            ADMIN_ID,
-            f"💸 ЗАПРОС НА ВЫВОД\n\n"
-            f"👤 User ID: {msg.from_user.id}\n"
-            f"👤 Username: @{msg.from_user.username or 'None'}\n"
-            f"👤 Имя: {msg.from_user.first_name}\n\n"
-            f"💰 Сумма: {amount} ⭐\n"
-            f"💳 Баланс: {ud['balance']} ⭐\n\n"
-            f"Нажми кнопку ниже, чтобы отправить звезды пользователю:",
-            reply_markup=send_stars_kb
+        item, was_empty = withdraw_queue.add(
+            msg.from_user.id, amount, msg.from_user.username, msg.from_user.first_name
         )
         
+        # Админ получает одно уведомление на пачку: пока очередь не разобрана, новых нет
+        if was_empty:
+            await bot.send_message(
+                ADMIN_ID,
+                f"💸 НОВЫЕ ЗАЯВКИ НА ВЫВОД\n\n"
+                f"{format_item(item)}\n\n"
+                f"/withdrawals - очередь заявок"
+            )
+        
         await delete_last_message(msg.from_user.id, bot)
         
         sent_msg = await bot.send_message(
@@ -1422,6 +2025,11 @@ async def cancel_operation_withdrawal(msg: Message, state: FSMContext, bot: Bot)
 @router.pre_checkout_query()
 async def pre_checkout(pcq: PreCheckoutQuery):
     """Предварительная проверка платежа"""
+    # Пополнения проходят всегда, новые оплаченные игры - только если бот не перегружен
+    parts = pcq.invoice_payload.split(":")
+    action = parts[1] if len(parts) > 1 else ""
+    if action != "deposit" and game_admission.overloaded():
+        return await pcq.answer(ok=False, error_message="Бот перегружен, попробуй через минуту")
     await pcq.answer(ok=True)
 
 
@@ -1479,70 +2087,67 @@ async def success_pay(msg: Message, state: FSMContext, bot: Bot):
         
         await msg.answer(f"✅ Оплата получена!\n\n🎮 Запускаем {g}...")
         
-        # Запускаем игру
-        dm = await msg.answer_dice(emoji=g)
-        await asyncio.sleep(4)
-        
-        dv = dm.dice.value
-        res = determine_game_result(g, bt, dv)
-        
-        ud['total_bets'] += amt
-        ud['games_played'] += 1
-        
-        if res['win']:
-            w = int(amt * res['coefficient'])
-            ud['balance'] += w
-            ud['total_wins'] += w
+        # Игра уже оплачена - допускается без лимитов, но учитывается в нагрузке
+        game_admission.acquire(uid, force=True)
+        try:
+            # Запускаем игру
+            dm = await msg.answer_dice(emoji=g)
+            await asyncio.sleep(DICE_ANIMATION_DELAY)
             
-            # Логируем выигрыш
-            log_win(uid, g, bt, amt, w, username)
+            res, w = settle_bet(ud, g, bt, amt, dm.dice.value, payment_id)
             
-            txt = (
-                f"🎉 ВЫИГРЫШ!\n\n"
-                f"{g} Выпало: {res['outcome']}\n"
-                f"🎯 Ставка: {bt}\n\n"
-                f"💰 Выигрыш: {w} ⭐ (x{res['coefficient']})\n"
-                f"💳 Баланс: {ud['balance']} ⭐"
-            )
-        else:
-            ud['total_losses'] += amt
-            w = -amt
+            if res['win']:
+                # Логируем выигрыш
+                log_win(uid, g, bt, amt, w, username)
+            else:
+                # Логируем проигрыш
+                log_loss(uid, g, bt, amt, username)
             
-            # Логируем проигрыш
-            log_loss(uid, g, bt, amt, username)
+            txt = format_game_result(g, bt, amt, res, w, ud['balance'])
             
-            txt = (
-                f"😔 Не повезло\n\n"
-                f"{g} Выпало: {res['outcome']}\n"
-                f"🎯 Ставка: {bt}\n\n"
-                f"💸 Потеря: {amt} ⭐\n"
-                f"💳 Баланс: {ud['balance']} ⭐"
-            )
-        
-        ud['history'].append({
-            'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-            'game': g,
-            'bet_type': bt,
-            'amount': amt,
-            'result': res['outcome'],
-            'dice_value': dv,
-            'win': res['win'],
-            'winnings': w,
-            'payment_id': msg.successful_payment.telegram_payment_charge_id
-        })
-        
-        save_database(DB_FILE)
+            save_database(DB_FILE)
+        finally:
+            game_admission.release(uid)
         await msg.answer(txt)
 
 
+def setup_metrics(bot: Bot, dp: Dispatcher):
+    """Подключить сбор метрик и трассировку: обновления, хендлеры, запросы к API, состояние процесса"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for observer in (router.message, router.callback_query, router.pre_checkout_query):
+        observer.middleware(HandlerMetricsMiddleware())
+        observer.middleware(TracingMiddleware())
+    bot.session.middleware(RequestMetricsMiddleware())
+    bot.session.middleware(TracingRequestMiddleware())
+    
+    registry.gauge('bot_log_queue_depth', 'Записей в очереди логирования', log_queue.qsize)
+    registry.gauge('bot_log_dropped', 'Записей лога отброшено при переполнении', lambda: queue_handler.dropped)
+    registry.gauge('bot_open_tables', 'Открытые столы в группах', lambda: len(open_tables))
+    registry.gauge('bot_active_autoplays', 'Запущенные автоигры', lambda: len(active_autoplays))
+    registry.gauge('bot_users_in_memory', 'Пользователей в памяти', lambda: len(get_all_users()))
+
+
 async def main():
     """Главная функция"""
-    # Загружаем базу данных
+    # Загружаем базу данных и очередь выводов
     load_database(DB_FILE)
+    withdraw_queue.load()
     
-    bot = Bot(token=TOKEN)
+    # Локальный стенд подменяет адрес Bot API
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=TOKEN, session=session)
     dp = Dispatcher(storage=MemoryStorage())
     dp.include_router(router)
+    setup_metrics(bot, dp)
+    # Антифлуд до фильтров и хендлеров; общий лимит на сообщения и кнопки
+    throttling = ThrottlingMiddleware()
+    router.message.outer_middleware(throttling)
+    router.callback_query.outer_middleware(throttling)
+    registry.gauge('bot_throttled_users', 'Пользователей в памяти антифлуда', lambda: len(throttling.buckets))
+    track('last_bot_messages', lambda: last_bot_messages)
+    track('fsm_storage', lambda: getattr(dp.storage, 'storage', {}))
+    loop_monitor.register_handlers(router)
+    loop_monitor.start()
     
     logger.info("🎰 Лотерейный бот запущен!")
     logger.info("💳 Прием платежей в Telegram Stars активирован")
@@ -1570,10 +2175,6 @@ async def main():
         from aiohttp import web
         app = web.Application()
         
-        # Health check endpoint
-        async def health(request):
-            return web.Response(text="Bot is running! 🎰")
-        
         # Webhook endpoint
         async def webhook_handler(request):
             update = await request.json()
@@ -1581,8 +2182,7 @@ async def main():
             await dp.feed_update(bot, Update(**update))
             return web.Response(text="OK")
         
-        app.router.add_get('/', health)
-        app.router.add_get('/health', health)
+        setup_routes(app)
         app.router.add_post(webhook_path, webhook_handler)
         
         runner = web.AppRunner(app)
@@ -1597,6 +2197,7 @@ async def main():
             await asyncio.Event().wait()
         finally:
             await runner.cleanup()
+            loop_monitor.stop()
             save_database(DB_FILE)
             logger.info("👋 Бот остановлен")
     else:
@@ -1612,6 +2213,7 @@ async def main():
             # Останавливаем веб-сервер
             await web_runner.cleanup()
             # Сохраняем базу данных при остановке
+            loop_monitor.stop()
             save_database(DB_FILE)
             logger.info("👋 Бот остановлен")
 
@@ -1,8 +1,15 @@
 # Конфигурация бота
 
+import os
+
 TOKEN = '8238936333:AAGnhtuo-1QEF4MHKh56uy-r_R6fRg8E7_Q'
 ADMIN_ID = 763276021  # ID администратора
-DB_FILE = 'users_database.json'
+DB_FILE = os.getenv('DB_FILE', 'users_database.json')
+
+# Адрес Bot API (для локального стенда bench/fake_bot_api.py), по умолчанию - api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Пауза на анимацию кубика перед показом результата (сек)
+DICE_ANIMATION_DELAY = float(os.getenv('DICE_ANIMATION_DELAY', 4))
 
 # Коэффициенты выигрышей для каждой игры
 COEFFICIENTS = {
@@ -13,5 +20,69 @@ COEFFICIENTS = {
     '🎳': {'страйк': 2.8, 'мимо': 1.3}
 }
 
+# Названия игр
+GAME_NAMES = {
+    '🏀': 'Баскетбол',
+    '🎲': 'Кости',
+    '⚽': 'Футбол',
+    '🎯': 'Дартс',
+    '🎳': 'Боулинг'
+}
+
+# Количество значений анимированного кубика Telegram (🏀 и ⚽ выдают 1-5)
+DICE_FACES = {'🏀': 5, '🎲': 6, '⚽': 5, '🎯': 6, '🎳': 6}
+
+# Названия типов ставок для правил
+BET_TYPE_NAMES = {
+    'гол': 'Гол',
+    'застрял': 'Застрял',
+    'мимо': 'Мимо',
+    'четное': 'Четное',
+    'нечетное': 'Нечетное',
+    'больше_3': 'Больше 3',
+    'меньше_4': 'Меньше 4',
+    'центр': 'Центр',
+    'красное': 'Красное',
+    'белое': 'Белое',
+    'страйк': 'Страйк'
+}
+
 # Доступные суммы ставок
 BET_AMOUNTS = [10, 25, 50, 100, 250]
+
+# Режим стола в группах: длительность приема ставок (сек) и суммы ставок
+TABLE_BET_WINDOW = 30
+TABLE_BET_AMOUNTS = [10, 25, 50, 100]
+
+# Автоигра: максимум раундов за запуск и сколько бросков держать в полете
+AUTOPLAY_MAX_ROUNDS = 100
+AUTOPLAY_PIPELINE = 3
+
+# Игр на одной странице /history
+HISTORY_PAGE_SIZE = 10
+
+# Пользователей на одной странице админского списка
+USERS_PAGE_SIZE = 10
+
+# /logs follow: сколько секунд следить за логом и как часто проверять новые строки
+LOG_FOLLOW_SECONDS = 120
+LOG_FOLLOW_INTERVAL = 3
+
+# Допуск новых игр: лимиты одновременных игр и пороги перегрузки (задержка loop в сек, очередь логов)
+GAME_MAX_IN_FLIGHT = 200
+GAME_MAX_PER_USER = 1
+GAME_MAX_LOOP_LAG = 0.5
+GAME_MAX_LOG_QUEUE = 5000
+
+# Антифлуд: пополнение токенов в сек и запас на пользователя (0 - выключен), окно повтора
+# одинакового текста (сек) и через сколько секунд простоя пользователь забывается
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', 2))
+FLOOD_BURST = 6
+FLOOD_DEBOUNCE = 1.0
+FLOOD_IDLE_SECONDS = 300
+
+# Очередь выводов: файл заявок, одновременных возвратов, возвратов в секунду, заявок в списке /withdrawals
+WITHDRAW_QUEUE_FILE = os.getenv('WITHDRAW_QUEUE_FILE', 'withdrawals.json')
+WITHDRAW_CONCURRENCY = 5
+WITHDRAW_RATE = 10
+WITHDRAW_PAGE_SIZE = 20
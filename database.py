@@ -3,37 +3,116 @@
 import json
 import os
 import logging
-from typing import Dict
+import time
+from typing import Dict, Iterator, Optional
 from datetime import datetime
 
+from metrics import db_save_seconds, db_save_bytes, db_save_bytes_total
+from tracing import span
+from user_index import name_index
+
 logger = logging.getLogger(__name__)
 
 users_db: Dict = {}
 
+# Отпечаток файла (mtime, size) после последней загрузки/сохранения
+_db_stamp = None
+
+
+def _file_stamp(db_file: str):
+    st = os.stat(db_file)
+    return (st.st_mtime_ns, st.st_size)
+
+
+# Сколько последних игр хранить в счетчиках для профиля
+RECENT_GAMES = 5
+
+
+def empty_stats() -> Dict:
+    """Пустые счетчики пользователя"""
+    return {
+        'wins': 0,
+        'losses': 0,
+        'by_game': {},  # {игра: {'games': n, 'wins': k}}
+        'biggest_win': 0,
+        'streak': 0,  # > 0 - серия выигрышей, < 0 - серия проигрышей
+        'recent': []  # последние RECENT_GAMES игр для профиля
+    }
+
+
+def update_stats(stats: Dict, game_data: dict):
+    """Учесть одну игру в счетчиках пользователя"""
+    win = game_data['win']
+    per_game = stats['by_game'].setdefault(game_data['game'], {'games': 0, 'wins': 0})
+    per_game['games'] += 1
+    if win:
+        stats['wins'] += 1
+        per_game['wins'] += 1
+        stats['biggest_win'] = max(stats['biggest_win'], game_data['winnings'])
+        stats['streak'] = stats['streak'] + 1 if stats['streak'] > 0 else 1
+    else:
+        stats['losses'] += 1
+        stats['streak'] = stats['streak'] - 1 if stats['streak'] < 0 else -1
+    
+    stats['recent'].append({
+        'game': game_data['game'],
+        'bet_type': game_data['bet_type'],
+        'win': win,
+        'winnings': game_data['winnings']
+    })
+    del stats['recent'][:-RECENT_GAMES]
+
+
+def build_stats(history: list) -> Dict:
+    """Пересчет счетчиков по истории (для старых записей без 'stats')"""
+    stats = empty_stats()
+    for g in history:
+        update_stats(stats, g)
+    return stats
+
 
 def load_database(db_file: str):
     """Загрузка базы данных из JSON файла"""
-    global users_db
+    global users_db, _db_stamp
     if os.path.exists(db_file):
+        # Файл не менялся с нашей последней загрузки/записи - в памяти актуальные данные,
+        # включая еще не сохраненные изменения (например, раунды автоигры)
+        if _db_stamp is not None and _file_stamp(db_file) == _db_stamp:
+            return
         try:
-            with open(db_file, 'r', encoding='utf-8') as f:
+            with span('db.load'), open(db_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 # Конвертируем ключи обратно в int
                 users_db = {int(k): v for k, v in data.items()}
-                logger.info(f"✅ База данных загружена: {len(users_db)} пользователей")
+            # Досчитываем счетчики для записей, созданных до их появления
+            for ud in users_db.values():
+                if 'stats' not in ud:
+                    ud['stats'] = build_stats(ud.get('history', []))
+            name_index.rebuild(users_db)
+            _db_stamp = _file_stamp(db_file)
+            logger.info(f"✅ База данных загружена: {len(users_db)} пользователей")
         except Exception as e:
             logger.error(f"❌ Ошибка загрузки БД: {e}")
             users_db = {}
+            name_index.rebuild(users_db)
     else:
         logger.info("📝 База данных не найдена, создана новая")
         users_db = {}
+        name_index.rebuild(users_db)
 
 
 def save_database(db_file: str):
     """Сохранение базы данных в JSON файл"""
+    global _db_stamp
     try:
-        with open(db_file, 'w', encoding='utf-8') as f:
+        start = time.perf_counter()
+        with span('db.save', users=len(users_db)), open(db_file, 'w', encoding='utf-8') as f:
             json.dump(users_db, f, ensure_ascii=False, indent=2)
+            size = f.tell()
+        _db_stamp = _file_stamp(db_file)
+        db_save_seconds.observe(time.perf_counter() - start)
+        db_save_bytes.set(size)
+        db_save_bytes_total.inc(size)
         logger.info(f"💾 База данных сохранена: {len(users_db)} пользователей")
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения БД: {e}")
@@ -53,10 +132,12 @@ def get_user_data(user_id: int, user_obj=None, db_file: str = None) -> Dict:
             'total_losses': 0,
             'games_played': 0,
             'history': [],
+            'stats': empty_stats(),  # Счетчики для профиля
             'payments': [],  # История платежей для возврата
             'username': None,
             'first_name': None,
-            'last_name': None
+            'last_name': None,
+            'last_active': None
         }
         if db_file:
             save_database(db_file)
@@ -67,11 +148,16 @@ def get_user_data(user_id: int, user_obj=None, db_file: str = None) -> Dict:
         if db_file:
             save_database(db_file)
     
+    if 'stats' not in users_db[user_id]:
+        users_db[user_id]['stats'] = build_stats(users_db[user_id]['history'])
+    
     # Обновляем информацию о пользователе, если передан объект
     if user_obj:
         users_db[user_id]['username'] = user_obj.username
         users_db[user_id]['first_name'] = user_obj.first_name
         users_db[user_id]['last_name'] = user_obj.last_name
+        users_db[user_id]['last_active'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+        name_index.update(user_id, users_db[user_id])
         if db_file:
             save_database(db_file)
     
@@ -90,6 +176,26 @@ def update_user_balance(user_id: int, amount: int, db_file: str):
         save_database(db_file)
 
 
+def debit_balance(user_id: int, amount: int, db_file: str = None) -> bool:
+    """Списание с баланса, если хватает средств"""
+    ud = users_db.get(user_id)
+    if ud is None or amount < 1 or ud['balance'] < amount:
+        return False
+    ud['balance'] -= amount
+    if db_file:
+        save_database(db_file)
+    return True
+
+
+def add_adjustment(user_data: dict, delta: int, reason: str):
+    """Запомнить ручное изменение баланса (для сверки /audit)"""
+    user_data.setdefault('adjustments', []).append({
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'delta': delta,
+        'reason': reason
+    })
+
+
 def add_game_to_history(user_id: int, game_data: dict, db_file: str):
     """Добавление игры в историю пользователя"""
     if user_id in users_db:
@@ -97,6 +203,25 @@ def add_game_to_history(user_id: int, game_data: dict, db_file: str):
         save_database(db_file)
 
 
+def get_history_page(user_id: int, end: int = None, page_size: int = 10) -> tuple:
+    """
+    Страница истории игр по курсору
+    
+    Args:
+        user_id: ID пользователя
+        end: Индекс в истории, до которого (не включая) читать страницу; None - с самых новых
+        page_size: Размер страницы
+    
+    Returns:
+        tuple: (игры страницы от новых к старым, start, end, всего игр)
+    """
+    history = users_db.get(user_id, {}).get('history', [])
+    total = len(history)
+    end = total if end is None else max(0, min(end, total))
+    start = max(0, end - page_size)
+    return history[start:end][::-1], start, end, total
+
+
 def get_user_stats() -> dict:
     """Получение общей статистики по всем пользователям"""
     return {
@@ -106,3 +231,44 @@ def get_user_stats() -> dict:
         'total_wins': sum(u['total_wins'] for u in users_db.values()),
         'total_losses': sum(u['total_losses'] for u in users_db.values())
     }
+
+
+# Колонки выгрузок
+USER_COLUMNS = ['user_id', 'username', 'first_name', 'last_name', 'balance', 'games_played',
+                'total_bets', 'total_wins', 'total_losses', 'last_active']
+GAME_COLUMNS = ['user_id', 'date', 'game', 'bet_type', 'amount', 'dice_value', 'result',
+                'win', 'winnings', 'payment_id', 'refunded']
+PAYMENT_COLUMNS = ['user_id', 'date', 'amount', 'telegram_payment_charge_id', 'refunded',
+                   'refund_date', 'refund_amount']
+
+
+def _in_range(date: str, date_from: Optional[str], date_to: Optional[str]) -> bool:
+    """Дата записи (YYYY-MM-DD...) в диапазоне [date_from, date_to] включительно"""
+    day = (date or '')[:10]
+    return (not date_from or day >= date_from) and (not date_to or day <= date_to)
+
+
+def iter_user_rows() -> Iterator[dict]:
+    """Построчный обход пользователей для выгрузки"""
+    # Снимок ключей: словарь может меняться, пока идет выгрузка
+    for uid in list(users_db):
+        ud = users_db.get(uid)
+        if ud is None:
+            continue
+        yield {'user_id': uid, **{c: ud.get(c) for c in USER_COLUMNS[1:]}}
+
+
+def iter_game_rows(date_from: str = None, date_to: str = None) -> Iterator[dict]:
+    """Построчный обход истории игр всех пользователей"""
+    for uid in list(users_db):
+        for g in users_db.get(uid, {}).get('history', []):
+            if _in_range(g.get('date'), date_from, date_to):
+                yield {'user_id': uid, **{c: g.get(c) for c in GAME_COLUMNS[1:]}}
+
+
+def iter_payment_rows(date_from: str = None, date_to: str = None) -> Iterator[dict]:
+    """Построчный обход платежей всех пользователей"""
+    for uid in list(users_db):
+        for p in users_db.get(uid, {}).get('payments', []):
+            if _in_range(p.get('date'), date_from, date_to):
+                yield {'user_id': uid, **{c: p.get(c) for c in PAYMENT_COLUMNS[1:]}}
@@ -0,0 +1,80 @@
+# Потоковая выгрузка данных в сжатый CSV / JSONL
+
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from database import (
+    iter_user_rows, iter_game_rows, iter_payment_rows,
+    USER_COLUMNS, GAME_COLUMNS, PAYMENT_COLUMNS
+)
+
+EXPORT_KINDS = {
+    'users': (USER_COLUMNS, lambda date_from, date_to: iter_user_rows()),
+    'games': (GAME_COLUMNS, iter_game_rows),
+    'payments': (PAYMENT_COLUMNS, iter_payment_rows)
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def write_export(kind: str, fmt: str = 'csv', date_from: str = None, date_to: str = None,
+                 directory: str = None) -> tuple:
+    """
+    Выгрузить данные в .csv.gz / .jsonl.gz. Строки пишутся по одной из генератора,
+    в памяти держится только текущая строка и буфер gzip
+
+    Args:
+        kind: users, games или payments
+        fmt: csv или jsonl
+        date_from, date_to: Фильтр по дате YYYY-MM-DD включительно (игры и платежи)
+        directory: Папка для файла (по умолчанию временная)
+
+    Returns:
+        tuple: (путь к файлу, количество строк)
+    """
+    columns, rows = EXPORT_KINDS[kind]
+    name = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"
+    path = os.path.join(directory or tempfile.gettempdir(), name)
+
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for row in rows(date_from, date_to):
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows(date_from, date_to):
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write('\n')
+                count += 1
+    return path, count
+
+
+def parse_export_args(args: list) -> tuple:
+    """
+    Разбор аргументов /export: kind [from] [to] [csv|jsonl]
+
+    Returns:
+        tuple: (kind, fmt, date_from, date_to)
+
+    Raises:
+        ValueError: Неверный тип выгрузки или дата
+    """
+    if not args or args[0] not in EXPORT_KINDS:
+        raise ValueError("kind")
+    fmt = 'csv'
+    dates = []
+    for a in args[1:]:
+        if a in EXPORT_FORMATS:
+            fmt = a
+        else:
+            datetime.strptime(a, '%Y-%m-%d')
+            dates.append(a)
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    return args[0], fmt, date_from, date_to
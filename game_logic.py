@@ -1,6 +1,9 @@
 # Игровая логика
 
-from config import COEFFICIENTS
+from datetime import datetime
+
+from config import COEFFICIENTS, GAME_NAMES, DICE_FACES, BET_TYPE_NAMES
+from database import update_stats
 
 
 def determine_game_result(game: str, bet_type: str, dice_value: int) -> dict:
@@ -60,27 +63,74 @@ def determine_game_result(game: str, bet_type: str, dice_value: int) -> dict:
     }
 
 
+def settle_bet(user_data: dict, game: str, bet_type: str, amount: int, dice_value: int,
+               payment_id: str = 'balance') -> tuple:
+    """
+    Расчет ставки: обновляет баланс, историю и счетчики пользователя (без сохранения БД)
+    
+    Args:
+        user_data: Данные пользователя из users_db
+        game: Эмодзи игры
+        bet_type: Тип ставки
+        amount: Сумма ставки (уже списана с баланса или оплачена счетом)
+        dice_value: Значение выпавшего кубика
+        payment_id: ID платежа или источник ставки ('balance', 'table')
+    
+    Returns:
+        tuple: (результат determine_game_result, winnings)
+    """
+    res = determine_game_result(game, bet_type, dice_value)
+    
+    user_data['total_bets'] += amount
+    user_data['games_played'] += 1
+    
+    if res['win']:
+        w = int(amount * res['coefficient'])
+        user_data['balance'] += w
+        user_data['total_wins'] += w
+    else:
+        user_data['total_losses'] += amount
+        w = -amount
+    
+    game_data = {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'game': game,
+        'bet_type': bet_type,
+        'amount': amount,
+        'result': res['outcome'],
+        'dice_value': dice_value,
+        'win': res['win'],
+        'winnings': w,
+        'payment_id': payment_id
+    }
+    user_data['history'].append(game_data)
+    update_stats(user_data['stats'], game_data)
+    
+    return res, w
+
+
+def get_winning_values(game: str, bet_type: str) -> list:
+    """Значения кубика, при которых ставка выигрывает"""
+    return [
+        v for v in range(1, DICE_FACES[game] + 1)
+        if determine_game_result(game, bet_type, v)['win']
+    ]
+
+
+def format_values(values: list) -> str:
+    """Компактная запись значений кубика: 4-6, 6 или 2, 4, 6"""
+    if len(values) > 1 and values[-1] - values[0] == len(values) - 1:
+        return f"{values[0]}-{values[-1]}"
+    return ", ".join(str(v) for v in values)
+
+
 def get_rules_text() -> str:
-    """Получение текста с правилами игры"""
-    return (
-        "📋 Правила:\n\n"
-        "🏀 БАСКЕТБОЛ\n"
-        "• Гол (4-5): x1.8\n"
-        "• Застрял (3): x2.2\n"
-        "• Мимо (1-2): x1.3\n\n"
-        "🎲 КОСТИ\n"
-        "• Четное/Нечетное: x1.7\n"
-        "• Больше 3: x1.7\n"
-        "• Меньше 4: x1.7\n\n"
-        "⚽ ФУТБОЛ\n"
-        "• Гол (3-5): x1.6\n"
-        "• Мимо (1-2): x1.4\n\n"
-        "🎯 ДАРТС\n"
-        "• Центр (6): x4.0\n"
-        "• Красное (4-5): x2.2\n"
-        "• Белое (2-3): x1.6\n"
-        "• Мимо (1): x1.2\n\n"
-        "🎳 БОУЛИНГ\n"
-        "• Страйк (6): x2.8\n"
-        "• Мимо (1-5): x1.3"
-    )
+    """Получение текста с правилами игры (строится из COEFFICIENTS)"""
+    blocks = []
+    for game, bets in COEFFICIENTS.items():
+        lines = [f"{game} {GAME_NAMES[game].upper()}"]
+        for bet_type, coefficient in bets.items():
+            values = format_values(get_winning_values(game, bet_type))
+            lines.append(f"• {BET_TYPE_NAMES.get(bet_type, bet_type)} ({values}): x{coefficient}")
+        blocks.append("\n".join(lines))
+    return "📋 Правила:\n\n" + "\n\n".join(blocks)
@@ -4,7 +4,7 @@ from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
 )
-from config import COEFFICIENTS, BET_AMOUNTS
+from config import COEFFICIENTS, BET_AMOUNTS, BET_TYPE_NAMES, TABLE_BET_AMOUNTS
 
 
 def get_reply_keyboard() -> ReplyKeyboardMarkup:
@@ -38,6 +38,7 @@ def get_profile_reply_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="💰 Пополнить"), KeyboardButton(text="💸 Вывод")],
+            [KeyboardButton(text="📜 История")],
             [KeyboardButton(text="🎮 Играть"), KeyboardButton(text="◀️ Назад")]
         ],
         resize_keyboard=True,
@@ -249,4 +250,64 @@ def get_bet_amount_keyboard() -> ReplyKeyboardMarkup:
     )
 
 
+def get_table_bets_keyboard(game: str) -> InlineKeyboardMarkup:
+    """Ставки за общим столом: строка на тип ставки, кнопка на сумму"""
+    buttons = []
+    for bet_type, coefficient in COEFFICIENTS[game].items():
+        name = BET_TYPE_NAMES.get(bet_type, bet_type)
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"{name} x{coefficient}: {amt}⭐" if i == 0 else f"{amt}⭐",
+                callback_data=f"tbet_{bet_type}_{amt}"
+            )
+            for i, amt in enumerate(TABLE_BET_AMOUNTS)
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+
+def get_history_keyboard(start: int, end: int, total: int, page_size: int) -> InlineKeyboardMarkup:
+    """Навигация по истории игр: курсор - индекс конца страницы"""
+    row = []
+    if end < total:
+        row.append(InlineKeyboardButton(text="◀️ Новее", callback_data=f"hist_{min(total, end + page_size)}"))
+    if start > 0:
+        row.append(InlineKeyboardButton(text="Старее ▶️", callback_data=f"hist_{start}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row] if row else [])
+
+
+def get_users_browser_keyboard(key: str, offset: int, total: int, page_size: int) -> InlineKeyboardMarkup:
+    """Админский список пользователей: сортировка и навигация"""
+    sort_titles = {'balance': "💳 Баланс", 'games': "🎮 Игры", 'recent': "🕒 Активность"}
+    sort_row = [
+        InlineKeyboardButton(text=f"• {title}" if k == key else title, callback_data=f"users_{k}_0_r")
+        for k, title in sort_titles.items()
+    ]
+    nav_row = []
+    if offset > 0:
+        nav_row.append(InlineKeyboardButton(text="◀️", callback_data=f"users_{key}_{max(0, offset - page_size)}"))
+    if offset + page_size < total:
+        nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"users_{key}_{offset + page_size}"))
+    buttons = [sort_row]
+    if nav_row:
+        buttons.append(nav_row)
+    buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="admin_refresh")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_withdrawals_keyboard(items: list, selected: set) -> InlineKeyboardMarkup:
+    """Очередь выводов: выбор заявок и действия над ними"""
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"{'☑️' if item['id'] in selected else '⬜'} #{item['id']} {item['user_id']} - {item['amount']} ⭐",
+            callback_data=f"wd_toggle:{item['id']}"
+        )]
+        for item in items
+    ]
+    buttons.append([InlineKeyboardButton(text="✅ Одобрить все", callback_data="wd_all")])
+    if selected:
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ Одобрить ({len(selected)})", callback_data="wd_sel"),
+            InlineKeyboardButton(text=f"🚫 Отклонить ({len(selected)})", callback_data="wd_reject")
+        ])
+    buttons.append([InlineKeyboardButton(text="🔄 Обновить", callback_data="wd_list")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -1,27 +1,359 @@
 # Система логирования действий пользователей
 
+import atexit
+import glob
+import gzip
 import logging
+import queue
+import shutil
+import threading
+import time
+from collections import Counter
 from datetime import datetime
 import json
 import os
 
+from action_log import action_handler, archive_action_logs
+from tracing import span, current_trace_id
+
 # Настройка логгера для действий пользователей
 user_logger = logging.getLogger('user_actions')
 user_logger.setLevel(logging.INFO)
+# Записи обрабатывает фоновый поток (в том числе вывод в консоль), а не корневой логгер
+user_logger.propagate = False
 
 # Создаем папку для логов если её нет
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
-# Файловый обработчик - лог файл с датой
-log_file = f"logs/users_{datetime.now().strftime('%Y-%m-%d')}.log"
-file_handler = logging.FileHandler(log_file, encoding='utf-8')
+# Очередь записей: не больше LOG_QUEUE_SIZE, при переполнении записи отбрасываются
+LOG_QUEUE_SIZE = 10000
+# Фоновый поток сбрасывает файл после пачки до LOG_BATCH_SIZE записей или раз в LOG_FLUSH_INTERVAL сек
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 1.0
+# Архивы прошлых дней (.log.gz): хранить не дольше LOG_RETENTION_DAYS и не больше LOG_ARCHIVE_MAX_BYTES
+LOG_RETENTION_DAYS = 30
+LOG_ARCHIVE_MAX_BYTES = 200 * 1024 * 1024
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """Файловый обработчик без flush на каждую запись - сбрасывает фоновый поток пачкой"""
+    
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+def get_log_path(day: str) -> str:
+    """Путь к логу за день YYYY-MM-DD"""
+    return f"logs/users_{day}.log"
+
+
+# Файловый обработчик - лог файл с датой (переключается в полночь, см. rotate_log)
+log_day = datetime.now().strftime('%Y-%m-%d')
+log_file = get_log_path(log_day)
+file_handler = BufferedFileHandler(log_file, encoding='utf-8')
 file_handler.setLevel(logging.INFO)
 
 # Формат логов
 formatter = logging.Formatter('%(asctime)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 file_handler.setFormatter(formatter)
-user_logger.addHandler(file_handler)
+
+# Вывод в консоль (раньше шел через корневой логгер в потоке бота)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+
+class DailyStats:
+    """
+    Счетчики действий за день. Обновляются при каждой записи в лог,
+    сохраняются рядом с логом вместе со смещением в файле, до которого они посчитаны.
+    Если файла счетчиков нет - один проход по логу; если он отстал - дочитываем хвост
+    """
+    
+    SAVE_EVERY = 50  # Сохранять счетчики каждые N действий
+    
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self.stats_path = log_path[:-len('.log')] + '.stats.json'
+        self.counts = Counter()
+        self.total = 0
+        self._unsaved = 0
+        self._load()
+    
+    @staticmethod
+    def parse_action(line: str):
+        """Тип действия из строки лога: 'дата | ACTION | ...'"""
+        parts = line.split(' | ', 2)
+        return parts[1].strip() if len(parts) > 1 else None
+    
+    def _load(self):
+        offset = 0
+        try:
+            with open(self.stats_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.counts = Counter(saved['counts'])
+            self.total = saved['total']
+            offset = saved['offset']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.counts = Counter()
+            self.total = 0
+        
+        # Дочитываем записи, появившиеся после последнего сохранения счетчиков
+        try:
+            with open(self.log_path, 'rb') as f:
+                if offset > os.fstat(f.fileno()).st_size:
+                    # Лог пересоздан - считаем заново
+                    self.counts, self.total, offset = Counter(), 0, 0
+                f.seek(offset)
+                for raw in f:
+                    action = self.parse_action(raw.decode('utf-8', errors='replace'))
+                    if action:
+                        self.counts[action] += 1
+                        self.total += 1
+                        self._unsaved += 1
+        except FileNotFoundError:
+            pass
+    
+    def add(self, action: str):
+        """Учесть действие, записанное в лог"""
+        self.counts[action] += 1
+        self.total += 1
+        self._unsaved += 1
+    
+    def maybe_save(self):
+        """Сохранить, если накопилось SAVE_EVERY несохраненных действий"""
+        if self._unsaved >= self.SAVE_EVERY:
+            self.save()
+    
+    def save(self):
+        """Сохранить счетчики со смещением конца лога"""
+        if not self._unsaved:
+            return
+        try:
+            offset = os.path.getsize(self.log_path)
+        except OSError:
+            return
+        tmp_path = self.stats_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'counts': self.counts, 'total': self.total, 'offset': offset}, f)
+        os.replace(tmp_path, self.stats_path)
+        self._unsaved = 0
+
+
+daily_stats = DailyStats(log_file)
+
+
+def get_log_file() -> str:
+    """
+    Файл лога за сегодня - по текущей дате, а не по последней записи:
+    после полуночи это уже новый файл, даже если он еще не создан
+    """
+    return get_log_path(datetime.now().strftime('%Y-%m-%d'))
+
+
+def archive_logs():
+    """
+    Сжать закрытые дни в .log.gz и удалить архивы сверх срока хранения / бюджета по размеру.
+    Выполняется в отдельном потоке
+    """
+    active = os.path.abspath(log_file)
+    for path in glob.glob('logs/users_*.log'):
+        if os.path.abspath(path) == active:
+            continue
+        try:
+            with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + '.gz.tmp', path + '.gz')
+            os.remove(path)
+        except OSError as e:
+            logging.getLogger(__name__).error(f"Ошибка архивации лога {path}: {e}")
+    
+    # Имена содержат дату, сортировка по имени - от старых к новым
+    archives = sorted(glob.glob('logs/users_*.log.gz'))
+    cutoff = time.strftime('%Y-%m-%d', time.localtime(time.time() - LOG_RETENTION_DAYS * 86400))
+    total = sum(os.path.getsize(a) for a in archives)
+    for path in archives:
+        day = os.path.basename(path)[len('users_'):-len('.log.gz')]
+        if day >= cutoff and total <= LOG_ARCHIVE_MAX_BYTES:
+            break
+        total -= os.path.getsize(path)
+        for stale in (path, path[:-len('.log.gz')] + '.stats.json'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    
+    # Структурированный журнал действий архивируется поблочно
+    archive_action_logs(log_day)
+
+
+def start_archiving():
+    """Запустить архивацию в фоне"""
+    threading.Thread(target=archive_logs, name='log-archiver', daemon=True).start()
+
+
+def rotate_log(day: str):
+    """Переключить лог и дневные счетчики на новый день (вызывается из фонового потока)"""
+    global log_day, log_file, daily_stats
+    daily_stats.save()
+    
+    log_day = day
+    log_file = get_log_path(day)
+    file_handler.close()
+    file_handler.baseFilename = os.path.abspath(log_file)
+    file_handler.stream = None  # Откроется при первой записи
+    daily_stats = DailyStats(log_file)
+    action_handler.rotate(day)
+    
+    start_archiving()
+
+
+class LazyQueueHandler(logging.Handler):
+    """
+    Обработчик в потоке бота: только кладет запись в очередь (без форматирования и I/O).
+    Сообщение форматируется в фоновом потоке
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__()
+        self.queue = log_queue
+        self.dropped = 0
+    
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(threading.Thread):
+    """Фоновый поток: пишет записи пачками, сбрасывает файл и обновляет дневные счетчики"""
+    
+    _STOP = object()
+    
+    def __init__(self, log_queue: queue.Queue, handlers: list):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+    
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            
+            batch = [item]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = self._STOP in batch
+            actions = []
+            for record in batch:
+                if record is self._STOP:
+                    continue
+                # Запись уже следующего дня - закрываем текущий файл
+                day = time.strftime('%Y-%m-%d', time.localtime(record.created))
+                if day != log_day:
+                    self._commit(actions)
+                    actions = []
+                    rotate_log(day)
+                
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                action = getattr(record, 'action', None)
+                if action:
+                    actions.append(action)
+            self._commit(actions)
+            
+            if stop:
+                return
+    
+    def _commit(self, actions: list):
+        """Сбросить файлы и учесть записанные действия в счетчиках"""
+        for handler in self.handlers:
+            handler.flush()
+        # Счетчики учитывают только записи, уже сброшенные в файл
+        for action in actions:
+            daily_stats.add(action)
+        daily_stats.maybe_save()
+    
+    def stop(self, timeout: float = 5.0):
+        """Дописать очередь и остановиться"""
+        if self.is_alive():
+            self.queue.put(self._STOP)
+            self.join(timeout)
+        for handler in self.handlers:
+            handler.close()
+        daily_stats.save()
+
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = LazyQueueHandler(log_queue)
+user_logger.addHandler(queue_handler)
+
+log_writer = LogWriter(log_queue, [file_handler, console_handler, action_handler])
+log_writer.start()
+atexit.register(log_writer.stop)
+
+# Архивируем дни, закрытые пока бот не работал
+start_archiving()
+
+
+class _LazyUserInfo:
+    """Строка пользователя, формируется только при записи в фоновом потоке"""
+    
+    __slots__ = ('user_id', 'username', 'first_name')
+    
+    def __init__(self, user_id, username, first_name):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+    
+    def __str__(self):
+        user_info = f"ID:{self.user_id}"
+        if self.username:
+            user_info += f" @{self.username}"
+        if self.first_name:
+            user_info += f" ({self.first_name})"
+        return user_info
+
+
+# Суммы в ⭐: вызывающий передает числа, единица и знак добавляются только при записи
+STAR_FIELDS = frozenset({'amount', 'bet_amount', 'winnings', 'old', 'new'})
+SIGNED_STAR_FIELDS = frozenset({'profit', 'change'})
+
+
+def _format_field(key: str, value) -> str:
+    if isinstance(value, int):
+        if key in SIGNED_STAR_FIELDS:
+            return f"{key}:{value:+d}⭐"
+        if key in STAR_FIELDS:
+            return f"{key}:{value}⭐"
+    return f"{key}:{value}"
+
+
+class _LazyExtra:
+    """Дополнительные поля ' | k:v | ...', формируются только при записи"""
+    
+    __slots__ = ('kwargs',)
+    
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+    
+    def __str__(self):
+        if not self.kwargs:
+            return ""
+        return " | " + " | ".join(_format_field(k, v) for k, v in self.kwargs.items())
 
 
 def log_user_action(action: str, user_id: int, username: str = None, first_name: str = None, **kwargs):
@@ -35,19 +367,16 @@ def log_user_action(action: str, user_id: int, username: str = None, first_name:
         first_name: Имя пользователя
         **kwargs: Дополнительные данные для логирования
     """
-    user_info = f"ID:{user_id}"
-    if username:
-        user_info += f" @{username}"
-    if first_name:
-        user_info += f" ({first_name})"
-    
-    # Формируем дополнительные данные
-    extra_info = ""
-    if kwargs:
-        extra_info = " | " + " | ".join([f"{k}:{v}" for k, v in kwargs.items()])
-    
-    log_message = f"{action:15} | {user_info}{extra_info}"
-    user_logger.info(log_message)
+    # Корреляция строки лога со спанами обновления
+    trace_id = current_trace_id()
+    if trace_id:
+        kwargs['trace'] = trace_id
+    # Форматирование откладывается до фонового потока
+    with span('log', action=action):
+        user_logger.info(
+            "%-15s | %s%s", action, _LazyUserInfo(user_id, username, first_name), _LazyExtra(kwargs),
+            extra={'action': action, 'user_id': user_id, 'username': username, 'action_fields': kwargs}
+        )
 
 
 # Удобные функции для частых действий
@@ -65,40 +394,39 @@ def log_register(user_id: int, username: str = None, first_name: str = None):
 def log_game_start(user_id: int, game: str, bet_type: str, amount: int, username: str = None):
     """Начало игры"""
     log_user_action("GAME_START", user_id, username, 
-                   game=game, bet=bet_type, amount=f"{amount}⭐")
+                   game=game, bet=bet_type, amount=amount)
 
 
 def log_win(user_id: int, game: str, bet_type: str, amount: int, winnings: int, username: str = None):
     """Выигрыш"""
     log_user_action("WIN", user_id, username,
-                   game=game, bet=bet_type, bet_amount=f"{amount}⭐", 
-                   winnings=f"{winnings}⭐", profit=f"+{winnings-amount}⭐")
+                   game=game, bet=bet_type, bet_amount=amount, 
+                   winnings=winnings, profit=winnings - amount)
 
 
 def log_loss(user_id: int, game: str, bet_type: str, amount: int, username: str = None):
     """Проигрыш"""
     log_user_action("LOSS", user_id, username,
-                   game=game, bet=bet_type, amount=f"{amount}⭐")
+                   game=game, bet=bet_type, amount=amount)
 
 
 def log_payment(user_id: int, amount: int, payment_id: str, username: str = None):
     """Платеж через Stars"""
     log_user_action("PAYMENT", user_id, username,
-                   amount=f"{amount}⭐", payment_id=payment_id[:20])
+                   amount=amount, payment_id=payment_id[:20])
 
 
 def log_balance_change(user_id: int, old_balance: int, new_balance: int, reason: str, username: str = None):
     """Изменение баланса"""
-    change = new_balance - old_balance
     log_user_action("BALANCE_CHANGE", user_id, username,
-                   reason=reason, old=f"{old_balance}⭐", 
-                   new=f"{new_balance}⭐", change=f"{change:+d}⭐")
+                   reason=reason, old=old_balance, 
+                   new=new_balance, change=new_balance - old_balance)
 
 
 def log_refund(user_id: int, amount: int, payment_id: str, username: str = None):
     """Возврат платежа"""
     log_user_action("REFUND", user_id, username,
-                   amount=f"{amount}⭐", payment_id=payment_id[:20])
+                   amount=amount, payment_id=payment_id[:20])
 
 
 def log_admin_action(admin_id: int, action: str, target_user_id: int = None, **kwargs):
@@ -114,22 +442,64 @@ def log_error(user_id: int, error: str, username: str = None):
     log_user_action("ERROR", user_id, username, error=error)
 
 
+def tail_lines(path: str, n: int, block_size: int = 8192) -> tuple:
+    """
+    Последние n строк файла: читаем блоки с конца, пока не наберется n строк
+    
+    Returns:
+        tuple: (список строк, смещение после последней целой строки - для read_new_lines)
+    """
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b''
+        # n + 1 переводов строки гарантируют n целых строк
+        while pos > 0 and data.count(b'\n') <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    # Последняя строка может быть еще не дописана - отдаем только целые
+    cut = data.rfind(b'\n') + 1
+    lines = data[:cut].decode('utf-8', errors='replace').splitlines()
+    return lines[-n:] if n > 0 else [], pos + cut
+
+
+def read_new_lines(path: str, offset: int, max_bytes: int = 65536) -> tuple:
+    """
+    Строки, дописанные после offset (только целые строки)
+    
+    Returns:
+        tuple: (список строк, новое смещение)
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < offset:
+            offset = 0  # Файл пересоздан
+        # Слишком большой прирост - берем только хвост
+        start = max(offset, size - max_bytes)
+        f.seek(start)
+        data = f.read(size - start)
+    cut = data.rfind(b'\n') + 1
+    lines = data[:cut].decode('utf-8', errors='replace').splitlines()
+    if start > offset and lines:
+        lines = lines[1:]  # Первая строка может быть неполной
+    return lines, start + cut
+
+
 def get_today_stats():
-    """Получить статистику за сегодня из логов"""
-    try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        stats = {
-            'total_actions': len(lines),
-            'starts': sum(1 for line in lines if 'START' in line),
-            'registers': sum(1 for line in lines if 'REGISTER' in line),
-            'games': sum(1 for line in lines if 'GAME_START' in line),
-            'wins': sum(1 for line in lines if 'WIN' in line and 'GAME' not in line),
-            'losses': sum(1 for line in lines if 'LOSS' in line),
-            'payments': sum(1 for line in lines if 'PAYMENT' in line),
-            'refunds': sum(1 for line in lines if 'REFUND' in line),
-        }
-        return stats
-    except FileNotFoundError:
-        return None
+    """Получить статистику за сегодня (из счетчиков, без чтения лога)"""
+    # После полуночи счетчики переключатся с первой записью, до нее за новый день - нули
+    if log_day != datetime.now().strftime('%Y-%m-%d'):
+        counts, total = Counter(), 0
+    else:
+        counts, total = daily_stats.counts, daily_stats.total
+    return {
+        'total_actions': total,
+        'starts': counts['START'],
+        'registers': counts['REGISTER'],
+        'games': counts['GAME_START'],
+        'wins': counts['WIN'],
+        'losses': counts['LOSS'],
+        'payments': counts['PAYMENT'],
+        'refunds': counts['REFUND'],
+    }
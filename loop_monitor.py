@@ -0,0 +1,168 @@
+# Мониторинг задержки event loop и поиск блокирующего кода
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, List, Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Период замера задержки (сек)
+LOOP_SAMPLE_INTERVAL = 0.1
+# Задержка, после которой считаем loop заблокированным и снимаем стек (сек)
+LOOP_STALL_THRESHOLD = 0.25
+# Как часто писать перцентили в лог (сек)
+LOOP_REPORT_INTERVAL = 300
+
+loop_lag_seconds = registry.histogram(
+    'bot_loop_lag_seconds', 'Задержка планирования event loop',
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+loop_stalls_total = registry.counter('bot_loop_stalls_total', 'Блокировки event loop дольше порога')
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LoopMonitor:
+    """
+    Сэмплер в event loop измеряет, насколько позже запланированного просыпается sleep.
+    Сторожевой поток следит за последним «пульсом» сэмплера: если loop не отвечает
+    дольше порога, снимает стек потока loop через sys._current_frames и определяет хендлер
+    """
+
+    def __init__(self, interval: float = LOOP_SAMPLE_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=3000)
+        # Подробности последних блокировок; всего с запуска - stall_count
+        self.stalls = deque(maxlen=20)
+        self.stall_count = 0
+        self._handler_codes: Dict = {}
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def register_handlers(self, router):
+        """Запомнить code-объекты хендлеров роутера, чтобы находить их в снятом стеке"""
+        for observer in router.observers.values():
+            for handler in observer.handlers:
+                code = getattr(handler.callback, '__code__', None)
+                if code is not None:
+                    self._handler_codes[code] = handler.callback.__name__
+
+    def find_handler(self, frame) -> Optional[str]:
+        """Имя хендлера роутера, выполняющегося в стеке frame (ближайший к вершине)"""
+        while frame is not None:
+            name = self._handler_codes.get(frame.f_code)
+            if name:
+                return name
+            frame = frame.f_back
+        return None
+
+    @property
+    def loop_thread_id(self) -> Optional[int]:
+        return self._loop_thread_id
+
+    def start(self):
+        """Запустить сэмплер (из работающего loop) и сторожевой поток"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + LOOP_REPORT_INTERVAL
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._heartbeat = time.monotonic()
+            self.samples.append(lag)
+            loop_lag_seconds.observe(lag)
+            if loop.time() >= next_report:
+                next_report = loop.time() + LOOP_REPORT_INTERVAL
+                s = self.summary()
+                logger.info(
+                    f"⏱ Задержка loop: p50={s['p50'] * 1000:.1f}мс p95={s['p95'] * 1000:.1f}мс "
+                    f"p99={s['p99'] * 1000:.1f}мс max={s['max'] * 1000:.1f}мс, блокировок: {s['stalls']}"
+                )
+
+    def _watch(self):
+        # Для одной блокировки стек снимается один раз
+        captured_for = None
+        while not self._stop.wait(self.interval):
+            beat = self._heartbeat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or captured_for == beat:
+                continue
+            captured_for = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._record_stall(stalled, frame)
+
+    def _record_stall(self, stalled: float, frame):
+        stack = traceback.extract_stack(frame)
+        handler = self.find_handler(frame)
+        top = stack[-1] if stack else None
+        where = f"{top.filename}:{top.lineno} {top.name}" if top else "?"
+        self.stall_count += 1
+        self.stalls.append({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'blocked_ms': round(stalled * 1000),
+            'handler': handler,
+            'where': where,
+            'stack': traceback.format_list(stack[-15:])
+        })
+        loop_stalls_total.inc(handler=handler or 'unknown')
+        logger.warning(
+            f"🐢 Event loop заблокирован > {stalled * 1000:.0f}мс, хендлер: {handler or '?'}, "
+            f"место: {where}\n" + "".join(traceback.format_list(stack[-15:]))
+        )
+
+    def recent_lag(self, n: int = 5) -> float:
+        """Максимальная задержка за последние n замеров (текущая нагрузка loop)"""
+        return max(list(self.samples)[-n:], default=0.0)
+
+    def summary(self) -> Dict:
+        """Перцентили задержки по последним замерам и число блокировок с запуска"""
+        values = list(self.samples)
+        return {
+            'samples': len(values),
+            'p50': _percentile(values, 0.5),
+            'p95': _percentile(values, 0.95),
+            'p99': _percentile(values, 0.99),
+            'max': max(values) if values else 0.0,
+            'stalls': self.stall_count,
+            'last_stalls': [{k: v for k, v in s.items() if k != 'stack'} for s in list(self.stalls)[-5:]]
+        }
+
+
+loop_monitor = LoopMonitor()
+
+for _q in ('p50', 'p95', 'p99'):
+    registry.gauge(
+        f'bot_loop_lag_{_q}_seconds', f'Задержка event loop, {_q} по последним замерам',
+        lambda q=_q: loop_monitor.summary()[q]
+    )
@@ -0,0 +1,172 @@
+# Отчет о памяти: размеры структур бота, тяжелые пользователи, tracemalloc
+
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from database import get_all_users
+from metrics import rss_bytes
+from user_index import name_index, user_order_index
+
+# Структуры для отчета: имя -> функция, возвращающая объект
+tracked: Dict[str, Callable] = {
+    'users_db': get_all_users,
+    'history': lambda: [ud.get('history', []) for ud in list(get_all_users().values())],
+    'payments': lambda: [ud.get('payments', []) for ud in list(get_all_users().values())],
+    'name_index': lambda: name_index,
+    'user_order_index': lambda: user_order_index
+}
+
+# Снимок tracemalloc, с которым сравнивается /mem
+_baseline = None
+# Последняя сводка для /health/mem: (время, сводка) - обход всех структур не чаще SUMMARY_TTL
+SUMMARY_TTL = 30
+_summary = (0.0, None)
+
+
+def track(name: str, getter: Callable):
+    """Добавить структуру в отчет (например, состояние из bot.py)"""
+    tracked[name] = getter
+
+
+def deep_sizeof(obj) -> int:
+    """
+    Размер объекта со всем содержимым (без двойного учета общих объектов).
+    Контейнеры копируются перед обходом, поэтому функцию можно звать из потока
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            for k, v in list(o.items()):
+                stack.append(k)
+                stack.append(v)
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(list(o))
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+        elif hasattr(o, '__slots__'):
+            stack.extend(getattr(o, s) for s in o.__slots__ if hasattr(o, s))
+    return total
+
+
+def heavy_users(top: int = 10) -> List[Dict]:
+    """Пользователи с самой длинной историей игр и их размер в памяти"""
+    users = list(get_all_users().items())
+    users.sort(key=lambda item: len(item[1].get('history', [])), reverse=True)
+    return [
+        {
+            'user_id': uid,
+            'username': ud.get('username'),
+            'history': len(ud.get('history', [])),
+            'payments': len(ud.get('payments', [])),
+            'bytes': deep_sizeof(ud)
+        }
+        for uid, ud in users[:top]
+    ]
+
+
+def set_baseline() -> bool:
+    """
+    Запустить tracemalloc (если не запущен) и запомнить базовый снимок
+
+    Returns:
+        bool: True, если tracemalloc был запущен только что
+    """
+    global _baseline
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _baseline = tracemalloc.take_snapshot()
+    return started
+
+
+def allocation_diff(top: int = 10) -> List[Dict]:
+    """Места аллокаций с наибольшим приростом относительно базового снимка"""
+    if _baseline is None or not tracemalloc.is_tracing():
+        return []
+    stats = tracemalloc.take_snapshot().compare_to(_baseline, 'lineno')
+    return [
+        {
+            'where': f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+            'size_diff': s.size_diff,
+            'size': s.size,
+            'count_diff': s.count_diff
+        }
+        for s in stats[:top]
+    ]
+
+
+def memory_report(top: int = 10) -> Dict:
+    """Полный отчет: размеры структур, тяжелые пользователи, прирост аллокаций"""
+    sizes = {}
+    for name, getter in list(tracked.items()):
+        try:
+            sizes[name] = deep_sizeof(getter())
+        except Exception:
+            sizes[name] = None
+    return {
+        'sizes': sizes,
+        'users': len(get_all_users()),
+        'heavy_users': heavy_users(top),
+        'tracemalloc': tracemalloc.is_tracing(),
+        'allocations': allocation_diff(top)
+    }
+
+
+def memory_summary() -> Dict:
+    """
+    Сводка для /health/mem: только агрегаты - размеры структур, число пользователей,
+    RSS и объем tracemalloc. Без ID, username и путей файлов из tracemalloc
+    """
+    global _summary
+    if _summary[1] is not None and time.monotonic() - _summary[0] < SUMMARY_TTL:
+        return _summary[1]
+    sizes = {}
+    for name, getter in list(tracked.items()):
+        try:
+            sizes[name] = deep_sizeof(getter())
+        except Exception:
+            sizes[name] = None
+    summary = {
+        'rss_bytes': rss_bytes(),
+        'users': len(get_all_users()),
+        'sizes': sizes,
+        'tracemalloc': tracemalloc.is_tracing()
+    }
+    if summary['tracemalloc']:
+        summary['traced_bytes'], summary['traced_peak_bytes'] = tracemalloc.get_traced_memory()
+    _summary = (time.monotonic(), summary)
+    return summary
+
+
+def _mb(n) -> str:
+    return "?" if n is None else f"{n / 1024 / 1024:.2f} МБ"
+
+
+def format_memory_report(report: Dict) -> str:
+    """Текст отчета для /mem"""
+    lines = ["🧠 ПАМЯТЬ", "", f"👥 Пользователей: {report['users']}", ""]
+    for name, size in report['sizes'].items():
+        lines.append(f"{name}: {_mb(size)}")
+
+    lines += ["", "🏋️ Больше всего истории:"]
+    for u in report['heavy_users']:
+        name = f"@{u['username']}" if u['username'] else u['user_id']
+        lines.append(f"{name}: {u['history']} игр, {u['payments']} платежей, {u['bytes'] / 1024:.0f} КБ")
+
+    lines.append("")
+    if not report['tracemalloc']:
+        lines.append("tracemalloc выключен: /mem baseline - запустить и снять базовый снимок")
+    else:
+        lines.append("📈 Прирост с базового снимка:")
+        for a in report['allocations']:
+            lines.append(f"{a['where']}: {a['size_diff'] / 1024:+.0f} КБ ({a['count_diff']:+d})")
+    return "\n".join(lines)
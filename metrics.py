@@ -0,0 +1,168 @@
+# Метрики процесса в формате Prometheus (без внешних сервисов)
+
+import os
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+
+# Границы бакетов гистограмм длительности (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: Tuple) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in key) + '}'
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Gauge:
+    """Текущее значение: задается через set() или вычисляется функцией при выдаче"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, func: Callable[[], float] = None):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[_label_key(labels)] = value
+
+    def inc(self, value: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        if self.func is not None:
+            try:
+                yield f"{self.name} {self.func()}"
+            except Exception:
+                pass
+            return
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами (накопительные счетчики при выдаче)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по бакетам (+Inf последним), сумма, количество]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {round(total, 6)}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float] = None) -> Gauge:
+        return self._add(Gauge(name, help_text, func))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (/proc на Linux, иначе пиковый через resource)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Общие метрики бота
+updates_total = registry.counter('bot_updates_total', 'Входящие обновления по типу')
+handler_seconds = registry.histogram('bot_handler_seconds', 'Время обработки по хендлерам')
+handlers_in_flight = registry.gauge('bot_handlers_in_flight', 'Хендлеры, выполняющиеся сейчас (в т.ч. игры в ожидании броска)')
+handler_errors_total = registry.counter('bot_handler_errors_total', 'Исключения в хендлерах')
+db_save_seconds = registry.histogram('bot_db_save_seconds', 'Длительность save_database')
+db_save_bytes = registry.gauge('bot_db_save_bytes', 'Размер последнего сохранения БД')
+db_save_bytes_total = registry.counter('bot_db_save_bytes_total', 'Всего байт записано save_database')
+updates_throttled_total = registry.counter('bot_updates_throttled_total', 'Обновления, отброшенные антифлудом')
+api_seconds = registry.histogram('telegram_api_seconds', 'Длительность запросов к Bot API')
+api_retry_after_total = registry.counter('telegram_api_retry_after_total', 'Ответы 429 (RetryAfter) от Bot API')
+api_errors_total = registry.counter('telegram_api_errors_total', 'Ошибки запросов к Bot API')
+registry.gauge('process_resident_memory_bytes', 'RSS процесса', rss_bytes)
+
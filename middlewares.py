@@ -0,0 +1,146 @@
+# Middleware бота: антифлуд, метрики и трассировка обработки обновлений и запросов к Bot API
+
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import CallbackQuery
+
+from config import ADMIN_ID, FLOOD_RATE, FLOOD_BURST, FLOOD_DEBOUNCE, FLOOD_IDLE_SECONDS
+from metrics import (
+    updates_total, handler_seconds, handler_errors_total, handlers_in_flight,
+    api_seconds, api_retry_after_total, api_errors_total, updates_throttled_total
+)
+from tracing import span
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: счетчик обновлений по типу"""
+
+    async def __call__(self, handler, event, data):
+        updates_total.inc(type=getattr(event, 'event_type', 'unknown'))
+        return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: время работы конкретного хендлера"""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get('handler')
+        name = getattr(getattr(handler_obj, 'callback', None), '__name__', 'unknown')
+        start = time.perf_counter()
+        handlers_in_flight.inc(handler=name)
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors_total.inc(handler=name)
+            raise
+        finally:
+            handlers_in_flight.inc(-1, handler=name)
+            handler_seconds.observe(time.perf_counter() - start, handler=name)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время запросов к Bot API и ответы 429"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            api_retry_after_total.inc(method=name)
+            raise
+        except Exception:
+            api_errors_total.inc(method=name)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, method=name)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: корневой спан трассы на каждое обновление"""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get('handler')
+        name = getattr(getattr(handler_obj, 'callback', None), '__name__', 'unknown')
+        user = getattr(event, 'from_user', None)
+        with span(f"update.{type(event).__name__}", root=True, handler=name,
+                  user_id=user.id if user else 0):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: дочерний спан на каждый запрос к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware роутера (до фильтров и хендлеров): токен-бакет на пользователя
+    и отброс повторов одинакового текста/кнопки подряд. Один экземпляр ставится на
+    message и callback_query, чтобы лимит был общим. Платежи и админ не ограничиваются.
+
+    На пользователя хранится один кортеж (токены, время, хеш последнего текста, время текста);
+    записи без активности дольше idle_seconds удаляются периодическим проходом
+    """
+
+    def __init__(self, rate: float = FLOOD_RATE, burst: int = FLOOD_BURST,
+                 debounce: float = FLOOD_DEBOUNCE, idle_seconds: float = FLOOD_IDLE_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.debounce = debounce
+        self.idle_seconds = idle_seconds
+        self.buckets = {}
+        self._next_sweep = time.monotonic() + idle_seconds
+
+    def _sweep(self, now: float):
+        """Забыть неактивных: их бакет все равно уже полон"""
+        limit = now - self.idle_seconds
+        for uid in [uid for uid, b in self.buckets.items() if b[1] < limit]:
+            del self.buckets[uid]
+        self._next_sweep = now + self.idle_seconds
+
+    def check(self, user_id: int, text) -> str:
+        """
+        Учесть обновление пользователя
+
+        Returns:
+            str: Причина отброса ('duplicate', 'rate') или пустая строка, если пропускаем
+        """
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        key = hash(text) if text else 0
+        tokens, stamp, last_key, last_stamp = self.buckets.get(user_id, (self.burst, now, 0, 0.0))
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        if key and key == last_key and now - last_stamp < self.debounce:
+            # Повтор не тратит токены, окно отсчитывается от первого нажатия
+            self.buckets[user_id] = (tokens, now, last_key, last_stamp)
+            return 'duplicate'
+        if tokens < 1:
+            self.buckets[user_id] = (tokens, now, last_key, last_stamp)
+            return 'rate'
+        self.buckets[user_id] = (tokens - 1, now, key, now)
+        return ''
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if (not self.rate or user is None or user.id == ADMIN_ID
+                or getattr(event, 'successful_payment', None)):
+            return await handler(event, data)
+        is_callback = isinstance(event, CallbackQuery)
+        reason = self.check(user.id, event.data if is_callback else event.text)
+        if not reason:
+            return await handler(event, data)
+        updates_throttled_total.inc(reason=reason, type='callback_query' if is_callback else 'message')
+        if is_callback:
+            # Иначе у кнопки висят "часики"
+            try:
+                await event.answer("⏳ Не так быстро")
+            except Exception:
+                pass
@@ -0,0 +1,134 @@
+# Сэмплирующий профайлер потока event loop с разбивкой по хендлерам
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from loop_monitor import loop_monitor
+
+# Период снятия стека (сек) и ограничения сессии
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+PROFILE_MAX_DEPTH = 64
+
+
+def _frame_label(code) -> str:
+    # ';' - разделитель в collapsed-формате, в именах его быть не должно
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class SamplingProfiler:
+    """
+    Фоновый поток периодически снимает стек потока event loop (sys._current_frames),
+    стеки группируются по хендлеру роутера, который выполнялся в момент замера.
+    Ожидание событий в select учитывается отдельно как простой
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = Counter()
+        self._handlers = Counter()
+        self._samples = 0
+        self._idle = 0
+        self._started = 0.0
+        self._thread_id = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, thread_id: Optional[int] = None) -> bool:
+        """
+        Начать сессию (вызывать из потока event loop либо передать thread_id)
+
+        Returns:
+            bool: False, если сессия уже идет
+        """
+        if self.running:
+            return False
+        self._stacks = Counter()
+        self._handlers = Counter()
+        self._samples = self._idle = 0
+        self._thread_id = thread_id or loop_monitor.loop_thread_id or threading.get_ident()
+        self._started = time.monotonic()
+        self._stop.clear()
+        deadline = self._started + min(seconds, PROFILE_MAX_SECONDS)
+        self._thread = threading.Thread(target=self._run, args=(deadline,), name="profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> Dict:
+        """Остановить сессию и вернуть собранные данные"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return {
+            'seconds': round(time.monotonic() - self._started, 1),
+            'samples': self._samples,
+            'idle': self._idle,
+            'handlers': self._handlers,
+            'stacks': self._stacks
+        }
+
+    def _run(self, deadline: float):
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self._samples += 1
+            # Поток ждет событий в selector - loop простаивает
+            if frame.f_code.co_name == 'select' and frame.f_code.co_filename.endswith('selectors.py'):
+                self._idle += 1
+                continue
+
+            handler = loop_monitor.find_handler(frame) or '(вне хендлеров)'
+            labels = []
+            while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(handler)
+            self._handlers[handler] += 1
+            self._stacks[';'.join(reversed(labels))] += 1
+
+
+def write_collapsed(result: Dict, directory: str = None) -> str:
+    """
+    Записать стеки в collapsed-формат (flamegraph.pl, speedscope): первая
+    рамка каждой строки - имя хендлера, затем стек от корня к вершине
+
+    Returns:
+        str: Путь к файлу
+    """
+    name = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+    path = os.path.join(directory or tempfile.gettempdir(), name)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in result['stacks'].most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def format_profile_summary(result: Dict, top: int = 10) -> str:
+    """Сводка сессии: доля времени loop по хендлерам"""
+    samples = result['samples'] or 1
+    busy = result['samples'] - result['idle']
+    lines = [
+        f"🔬 Профиль за {result['seconds']} сек",
+        f"Замеров: {result['samples']}, loop занят: {busy * 100 / samples:.1f}%",
+        ""
+    ]
+    for handler, count in result['handlers'].most_common(top):
+        lines.append(f"{handler}: {count * 100 / samples:.1f}% ({count})")
+    if not result['handlers']:
+        lines.append("Хендлеры не выполнялись")
+    return "\n".join(lines)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,98 @@
+# Режим общего стола: много ставок рассчитываются одним броском
+
+import time
+from typing import Dict, List, Optional
+
+from config import COEFFICIENTS
+from database import get_user_data, debit_balance, save_database
+from game_logic import settle_bet
+
+
+class GameTable:
+    """Открытый стол в групповом чате"""
+
+    def __init__(self, chat_id: int, game: str, window: int):
+        self.chat_id = chat_id
+        self.game = game
+        self.closes_at = time.monotonic() + window
+        self.message_id: Optional[int] = None
+        self.task = None  # asyncio.Task таймера стола
+        # Ставки: {'user_id', 'name', 'username', 'bet_type', 'amount'}
+        self.bets: List[Dict] = []
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self.closes_at
+
+    @property
+    def pot(self) -> int:
+        return sum(b['amount'] for b in self.bets)
+
+
+# Открытые столы (chat_id: GameTable)
+open_tables: Dict[int, GameTable] = {}
+
+
+def open_table(chat_id: int, game: str, window: int) -> Optional[GameTable]:
+    """Открыть стол в чате; None, если стол уже открыт"""
+    if chat_id in open_tables:
+        return None
+    table = GameTable(chat_id, game, window)
+    open_tables[chat_id] = table
+    return table
+
+
+def place_table_bet(table: GameTable, user_id: int, name: str, username: Optional[str],
+                    bet_type: str, amount: int, db_file: str) -> str:
+    """
+    Принять ставку за столом со списанием с баланса
+
+    Returns:
+        str: '' при успехе, иначе текст ошибки
+    """
+    if not table.is_open:
+        return "⏳ Прием ставок закрыт"
+    if bet_type not in COEFFICIENTS[table.game]:
+        return "❌ Неизвестный тип ставки"
+    if not debit_balance(user_id, amount, db_file):
+        return "❌ Недостаточно средств. Пополни баланс в личке с ботом"
+
+    table.bets.append({
+        'user_id': user_id,
+        'name': name,
+        'username': username,
+        'bet_type': bet_type,
+        'amount': amount
+    })
+    return ""
+
+
+def close_table(chat_id: int) -> Optional[GameTable]:
+    """Закрыть стол и убрать его из открытых"""
+    return open_tables.pop(chat_id, None)
+
+
+def settle_table(table: GameTable, dice_value: int, db_file: str) -> List[Dict]:
+    """
+    Рассчитать все ставки стола по одному значению кубика, сохранить БД один раз
+
+    Returns:
+        list: Ставки, дополненные полями 'result' и 'winnings'
+    """
+    results = []
+    for bet in table.bets:
+        ud = get_user_data(bet['user_id'])
+        res, w = settle_bet(ud, table.game, bet['bet_type'], bet['amount'], dice_value, 'table')
+        results.append({**bet, 'result': res, 'winnings': w})
+
+    if results:
+        save_database(db_file)
+    return results
+
+
+def refund_table(table: GameTable, db_file: str):
+    """Вернуть все ставки стола на баланс (бросок не состоялся)"""
+    for bet in table.bets:
+        get_user_data(bet['user_id'])['balance'] += bet['amount']
+    if table.bets:
+        save_database(db_file)
@@ -0,0 +1,40 @@
+# Ограничение частоты запросов к Telegram API
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Асинхронный token bucket: не больше rate запросов в секунду, всплеск до burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Дождаться свободного токена"""
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+# Общий лимит бота на исходящие сообщения (~30 в секунду по правилам Telegram)
+global_limiter = RateLimiter(rate=30, burst=30)
@@ -0,0 +1,159 @@
+# Легковесная трассировка обновлений: спаны в JSONL в формате, близком к OpenTelemetry
+
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Файл спанов и его ротация по размеру
+TRACE_FILE = "logs/traces.jsonl"
+TRACE_FILE_MAX_BYTES = 20 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+# Экспортировать только трассы не короче этого порога (сек), 0 - все
+TRACE_MIN_SECONDS = float(os.getenv('TRACE_MIN_SECONDS', 0))
+# Максимум дочерних спанов в одной трассе
+TRACE_MAX_SPANS = 200
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """Один участок трассы; дочерние спаны собираются в корневом до его завершения"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns',
+                 'attributes', 'error', 'root', 'finished')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        # Корневой спан хранит список завершенных спанов трассы
+        self.root = parent.root if parent else self
+        self.finished = [] if parent is None else None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_otel(self) -> Dict:
+        """Спан в форме OTLP/JSON"""
+        attributes = []
+        for k, v in self.attributes.items():
+            if isinstance(v, bool):
+                value = {'boolValue': v}
+            elif isinstance(v, int):
+                value = {'intValue': str(v)}
+            elif isinstance(v, float):
+                value = {'doubleValue': v}
+            else:
+                value = {'stringValue': str(v)}
+            attributes.append({'key': k, 'value': value})
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': 'SPAN_KIND_SERVER' if self.parent_id is None else 'SPAN_KIND_INTERNAL',
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': attributes,
+            'status': {'code': 'STATUS_CODE_ERROR', 'message': self.error} if self.error
+            else {'code': 'STATUS_CODE_OK'}
+        }
+        return span
+
+
+class SpanExporter:
+    """Фоновая запись трасс в JSONL с ротацией по размеру (как RotatingFileHandler)"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        self._queue.put(spans)
+
+    def _rotate(self):
+        for i in range(TRACE_FILE_BACKUPS - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        while True:
+            batch = [self._queue.get()]
+            # Забираем все накопившееся за раз
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            data = ''.join(
+                json.dumps(s.to_otel(), ensure_ascii=False) + '\n' for spans in batch for s in spans
+            ).encode('utf-8')
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > TRACE_FILE_MAX_BYTES:
+                    self._rotate()
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+            except OSError:
+                pass
+
+
+exporter = SpanExporter()
+
+
+@contextmanager
+def span(name: str, root: bool = False, **attributes):
+    """
+    Участок трассы. Дочерний спан создается только внутри трассы (иначе это no-op),
+    корневой (root=True) начинает новую трассу и экспортирует ее при завершении
+
+    Yields:
+        Span или None, если трассы нет
+    """
+    parent = _current_span.get()
+    if parent is None and not root:
+        yield None
+        return
+    s = Span(name, None if root else parent, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end_ns = time.time_ns()
+        trace = s.root
+        if s is trace:
+            trace.finished.append(s)
+            if (s.end_ns - s.start_ns) / 1e9 >= TRACE_MIN_SECONDS:
+                exporter.export(trace.finished)
+        elif trace.end_ns is None and len(trace.finished) < TRACE_MAX_SPANS:
+            # Спаны, завершившиеся после корня (фоновые задачи), отбрасываются
+            trace.finished.append(s)
+
+
+def current_trace_id() -> Optional[str]:
+    """ID текущей трассы для корреляции с логами"""
+    s = _current_span.get()
+    return s.trace_id if s else None
@@ -0,0 +1,125 @@
+# Индексы пользователей для админских просмотров
+
+import time
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+
+def _recency(ud: Dict) -> str:
+    """Время последней активности ('%Y-%m-%d %H:%M'), для старых записей - дата последней игры"""
+    if ud.get('last_active'):
+        return ud['last_active']
+    history = ud.get('history')
+    return history[-1]['date'] if history else ''
+
+
+# Ключи сортировки браузера пользователей (по убыванию)
+SORT_KEYS = {
+    'balance': lambda ud: ud['balance'],
+    'games': lambda ud: ud['games_played'],
+    'recent': _recency
+}
+
+
+class UserOrderIndex:
+    """
+    Снимок порядка пользователей по ключу сортировки.
+    Страница читается срезом из готового списка; снимок перестраивается
+    при смене ключа/обновлении или если устарел (max_age секунд).
+    Бот вызывает page через asyncio.to_thread: сортировка идет по копии пар
+    (user_id, данные), пока обработчики меняют словарь
+    """
+
+    def __init__(self, max_age: float = 60):
+        self.max_age = max_age
+        self._orders: Dict[str, Tuple[float, List[int]]] = {}
+
+    def get_order(self, users: Dict, key: str, refresh: bool = False) -> List[int]:
+        """ID пользователей в порядке ключа"""
+        cached = self._orders.get(key)
+        if refresh or cached is None or time.monotonic() - cached[0] > self.max_age:
+            sort_key = SORT_KEYS[key]
+            items = list(users.items())
+            items.sort(key=lambda item: sort_key(item[1]), reverse=True)
+            order = [uid for uid, _ in items]
+            cached = (time.monotonic(), order)
+            self._orders[key] = cached
+        return cached[1]
+
+    def page(self, users: Dict, key: str, offset: int, size: int,
+             refresh: bool = False) -> Tuple[List[int], int]:
+        """
+        Страница пользователей
+
+        Returns:
+            tuple: (ID пользователей страницы, всего в снимке)
+        """
+        order = self.get_order(users, key, refresh)
+        # Пользователи могли быть удалены после построения снимка
+        return [uid for uid in order[offset:offset + size] if uid in users], len(order)
+
+
+user_order_index = UserOrderIndex()
+
+
+def _name_tokens(ud: Dict) -> Tuple[str, ...]:
+    """Ключи поиска пользователя: username, имя, фамилия (без учета регистра)"""
+    tokens = set()
+    for field in ('username', 'first_name', 'last_name'):
+        value = ud.get(field)
+        if value:
+            tokens.add(value.casefold())
+    return tuple(sorted(tokens))
+
+
+class NameIndex:
+    """
+    Поиск пользователей по префиксу username / имени / фамилии.
+    Отсортированный список (ключ, user_id) + bisect: поиск O(log n + k),
+    обновление одного пользователя - вставка/удаление по бинарному поиску
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[str, int]] = []
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+
+    def rebuild(self, users: Dict):
+        """Полная перестройка индекса (после загрузки БД)"""
+        self._tokens = {uid: _name_tokens(ud) for uid, ud in users.items()}
+        self._keys = sorted((t, uid) for uid, tokens in self._tokens.items() for t in tokens)
+
+    def update(self, user_id: int, ud: Dict):
+        """Обновить ключи одного пользователя, если изменились его имена"""
+        new = _name_tokens(ud)
+        old = self._tokens.get(user_id, ())
+        if new == old:
+            return
+        for t in old:
+            i = bisect_left(self._keys, (t, user_id))
+            if i < len(self._keys) and self._keys[i] == (t, user_id):
+                del self._keys[i]
+        for t in new:
+            insort(self._keys, (t, user_id))
+        self._tokens[user_id] = new
+
+    def search(self, query: str, limit: int = 20) -> List[int]:
+        """ID пользователей, у которых username/имя/фамилия начинается с query"""
+        q = query.lstrip('@').casefold()
+        if not q:
+            return []
+        found = []
+        i = bisect_left(self._keys, (q,))
+        while i < len(self._keys) and len(found) < limit:
+            token, uid = self._keys[i]
+            if not token.startswith(q):
+                break
+            if uid not in found:
+                found.append(uid)
+            i += 1
+        return found
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+name_index = NameIndex()
@@ -5,17 +5,41 @@ from aiohttp import web
 import asyncio
 import logging
 
+from loop_monitor import loop_monitor
+from mem_report import memory_summary
+from metrics import registry
+
 logger = logging.getLogger(__name__)
 
 async def health_check(request):
     """Endpoint для проверки состояния бота"""
     return web.Response(text="Bot is running! 🎰", status=200)
 
+async def metrics_handler(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+async def loop_health(request):
+    """Перцентили задержки event loop и последние блокировки"""
+    return web.json_response(loop_monitor.summary())
+
+async def mem_health(request):
+    """Сводка памяти без данных пользователей (подробный отчет - /mem у админа)"""
+    summary = await asyncio.to_thread(memory_summary)
+    return web.json_response(summary)
+
+def setup_routes(app):
+    """Служебные маршруты: health check, /metrics, состояние event loop и памяти"""
+    app.router.add_get('/', health_check)
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/health/loop', loop_health)
+    app.router.add_get('/health/mem', mem_health)
+    app.router.add_get('/metrics', metrics_handler)
+
 async def start_web_server(port=8080):
     """Запуск веб-сервера"""
     app = web.Application()
-    app.router.add_get('/', health_check)
-    app.router.add_get('/health', health_check)
+    setup_routes(app)
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -0,0 +1,280 @@
+# Очередь заявок на вывод: хранение в JSON и пакетное выполнение возвратов Stars
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError
+
+from config import WITHDRAW_QUEUE_FILE, WITHDRAW_CONCURRENCY, WITHDRAW_RATE
+from database import get_user_data, save_database
+from logger import log_balance_change, log_refund
+from throttling import RateLimiter, global_limiter
+
+logger = logging.getLogger(__name__)
+
+STATUS_ICONS = {'pending': '⏳', 'processing': '🔄', 'done': '✅', 'failed': '❌'}
+
+
+def find_refund_payment(ud: Dict, amount: int) -> Tuple[Optional[Dict], str]:
+    """
+    Платеж пользователя, через возврат которого можно вывести amount
+
+    Returns:
+        tuple: (платеж, '') или (None, причина отказа)
+    """
+    available = [p for p in ud.get('payments', []) if not p.get('refunded', False)]
+    if not available:
+        return None, "Нет доступных платежей для возврата. Пользователь должен сначала пополнить баланс."
+    payment = next((p for p in available if p['amount'] >= amount), None)
+    if payment is None:
+        largest = max(available, key=lambda x: x['amount'])
+        return None, f"Максимальная сумма возврата: {largest['amount']} ⭐\nЗапрошено: {amount} ⭐"
+    return payment, ""
+
+
+def reserve_withdrawal(ud: Dict, amount: int) -> Tuple[Optional[Dict], str]:
+    """
+    Проверить баланс, занять платеж и списать сумму - без await, поэтому атомарно
+    для параллельных выводов того же пользователя. При ошибке возврата - release_withdrawal
+    """
+    if ud['balance'] < amount:
+        return None, "У пользователя недостаточно средств на балансе"
+    payment, error = find_refund_payment(ud, amount)
+    if payment is None:
+        return None, error
+    payment['refunded'] = True
+    payment['refund_date'] = datetime.now().isoformat()
+    payment['refund_amount'] = amount
+    ud['balance'] -= amount
+    return payment, ""
+
+
+def release_withdrawal(ud: Dict, payment: Dict, amount: int):
+    """Отменить резерв после неудачного возврата"""
+    payment['refunded'] = False
+    payment.pop('refund_date', None)
+    payment.pop('refund_amount', None)
+    ud['balance'] += amount
+
+
+class WithdrawQueue:
+    """
+    Заявки на вывод в JSON-файле: {"next_id": N, "items": [...]}. Выполненные удаляются,
+    неудачные (failed) ждут повторного одобрения или отклонения вместе с новыми.
+    charge_id в заявке - платеж, уже зарезервированный (списан и сохранен в БД) под выплату
+    """
+
+    def __init__(self, path: str = WITHDRAW_QUEUE_FILE):
+        self.path = path
+        self.items: List[Dict] = []
+        self.next_id = 1
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Ошибка загрузки очереди выводов: {e}")
+            return
+        self.items = data.get('items', [])
+        self.next_id = data.get('next_id', 1)
+        for item in self.items:
+            # Пакет прервался: резерв сохранен в БД, повтор вернет тот же платеж
+            # (уже выплаченный Telegram отклонит - заявка будет засчитана)
+            if item['status'] == 'processing':
+                item['status'] = 'failed'
+                item['error'] = "прервано, повтор проверит платеж"
+        logger.info(f"💸 Очередь выводов загружена: {len(self.items)} заявок")
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'next_id': self.next_id, 'items': self.items}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"❌ Ошибка сохранения очереди выводов: {e}")
+
+    def add(self, user_id: int, amount: int, username: str = None, first_name: str = None) -> Tuple[Dict, bool]:
+        """
+        Добавить заявку
+
+        Returns:
+            tuple: (заявка, была ли очередь пуста до нее)
+        """
+        was_empty = not self.pending()
+        item = {
+            'id': self.next_id,
+            'user_id': user_id,
+            'amount': amount,
+            'username': username,
+            'first_name': first_name,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'status': 'pending'
+        }
+        self.next_id += 1
+        self.items.append(item)
+        self.save()
+        return item, was_empty
+
+    def pending(self, ids=None) -> List[Dict]:
+        """Заявки, ожидающие решения (все или из ids)"""
+        return [i for i in self.items if i['status'] in ('pending', 'failed') and (ids is None or i['id'] in ids)]
+
+    def pending_amount(self, user_id: int) -> int:
+        """Сумма заявок пользователя, еще не списанных с баланса (без резерва)"""
+        return sum(
+            i['amount'] for i in self.items
+            if i['user_id'] == user_id and i['status'] in ('pending', 'failed') and not i.get('charge_id')
+        )
+
+    def remove(self, ids):
+        self.items = [i for i in self.items if i['id'] not in ids]
+        self.save()
+
+    def link_user_request(self, user_id: int, amount: int, charge_id: str) -> Optional[Dict]:
+        """
+        Старая кнопка send_stars: привязать зарезервированный платеж к заявке до выплаты,
+        как это делает _execute - заявка больше не считается в pending_amount, а пакетное
+        одобрение повторит тот же платеж вместо резерва нового
+        """
+        item = next((i for i in self.pending()
+                     if i['user_id'] == user_id and i['amount'] == amount and not i.get('charge_id')), None)
+        if item:
+            item['charge_id'] = charge_id
+            self.save()
+        return item
+
+
+withdraw_queue = WithdrawQueue()
+
+
+def _reserved_payment(ud: Dict, item: Dict) -> Optional[Dict]:
+    """Платеж, зарезервированный прерванной попыткой этой заявки"""
+    return next((p for p in ud.get('payments', [])
+                 if p['telegram_payment_charge_id'] == item.get('charge_id') and p.get('refunded')), None)
+
+
+async def _execute(bot: Bot, item: Dict, limiter: RateLimiter, db_file: str):
+    """
+    Один вывод: резерв и списание сохраняются в БД до вызова refund_star_payment,
+    при явном отказе Telegram - откат. Если ответа нет, резерв остается: повтор заявки
+    вернет тот же платеж, а не найдет новый
+    """
+    uid, amount = item['user_id'], item['amount']
+    ud = get_user_data(uid)
+    payment = _reserved_payment(ud, item)
+    retry = payment is not None
+    if not retry:
+        payment, error = reserve_withdrawal(ud, amount)
+        if payment is None:
+            item.pop('charge_id', None)
+            item['status'], item['error'] = 'failed', error.split('\n')[0]
+            return
+        item['charge_id'] = payment['telegram_payment_charge_id']
+        save_database(db_file)
+        withdraw_queue.save()
+    try:
+        async with limiter:
+            await bot.refund_star_payment(user_id=uid, telegram_payment_charge_id=item['charge_id'])
+    except TelegramAPIError as e:
+        if 'CHARGE_ALREADY_REFUNDED' in str(e) and retry:
+            # Выплачено прерванной попыткой этой заявки
+            logger.info(f"💸 Платеж {item['charge_id'][:20]} уже возвращен, заявка #{item['id']} засчитана")
+        elif isinstance(e, TelegramNetworkError):
+            item['status'], item['error'] = 'failed', f"нет ответа Telegram: {str(e)[:80]}"
+            logger.error(f"Ошибка refund {uid} (резерв сохранен): {e}")
+            return
+        else:
+            # Явный отказ (в том числе платеж, возвращенный в обход бота) - откат резерва
+            release_withdrawal(ud, payment, amount)
+            item.pop('charge_id', None)
+            save_database(db_file)
+            item['status'], item['error'] = 'failed', str(e)[:100]
+            logger.error(f"Ошибка refund {uid}: {e}")
+            return
+    except Exception as e:
+        item['status'], item['error'] = 'failed', f"нет ответа Telegram: {str(e)[:80]}"
+        logger.error(f"Ошибка refund {uid} (резерв сохранен): {e}")
+        return
+    item['status'] = 'done'
+    item.pop('error', None)
+    log_balance_change(uid, ud['balance'] + amount, ud['balance'], "withdraw", ud.get('username'))
+    log_refund(uid, amount, item['charge_id'], ud.get('username'))
+    try:
+        async with global_limiter:
+            await bot.send_message(
+                uid,
+                f"✅ Вывод выполнен!\n\n"
+                f"💸 Сумма: {amount} ⭐\n"
+                f"💳 Новый баланс: {ud['balance']} ⭐\n\n"
+                f"Звезды возвращены на ваш Telegram аккаунт"
+            )
+    except Exception as e:
+        logger.error(f"Не удалось уведомить {uid} о выводе: {e}")
+
+
+async def process_withdrawals(bot: Bot, items: List[Dict], db_file: str,
+                              on_progress: Callable[[], Awaitable] = None) -> Dict:
+    """
+    Выполнить заявки параллельно (до WITHDRAW_CONCURRENCY, не чаще WITHDRAW_RATE в секунду).
+    Каждый резерв сохраняется в БД до выплаты, выполненные заявки удаляются из очереди,
+    неудачные остаются в ней со статусом failed и описанием ошибки
+
+    Returns:
+        dict: Итоги (done, failed, amount)
+    """
+    semaphore = asyncio.Semaphore(WITHDRAW_CONCURRENCY)
+    limiter = RateLimiter(rate=WITHDRAW_RATE, burst=WITHDRAW_CONCURRENCY)
+    for item in items:
+        item['status'] = 'processing'
+    withdraw_queue.save()
+
+    async def worker(item: Dict):
+        async with semaphore:
+            await _execute(bot, item, limiter, db_file)
+        if on_progress:
+            await on_progress()
+
+    try:
+        await asyncio.gather(*(worker(item) for item in items))
+    finally:
+        for item in items:
+            if item['status'] == 'processing':
+                item['status'], item['error'] = 'failed', "прервано"
+        withdraw_queue.remove({i['id'] for i in items if i['status'] == 'done'})
+
+    done = [i for i in items if i['status'] == 'done']
+    return {
+        'done': len(done),
+        'failed': len(items) - len(done),
+        'amount': sum(i['amount'] for i in done)
+    }
+
+
+def format_item(item: Dict) -> str:
+    name = f"@{item['username']}" if item.get('username') else item.get('first_name') or ''
+    line = f"#{item['id']} {item['user_id']} {name} - {item['amount']} ⭐"
+    if item.get('error'):
+        line += f" ({item['error']})"
+    return line
+
+
+def format_batch(items: List[Dict], limit: int = 40) -> str:
+    """Сводка пакета: счетчики и статус каждой заявки"""
+    counts = {s: sum(1 for i in items if i['status'] == s) for s in STATUS_ICONS}
+    lines = [
+        f"💸 ВЫПЛАТЫ: {len(items)} заявок\n",
+        f"✅ {counts['done']} | ❌ {counts['failed']} | 🔄 {counts['processing']} | ⏳ {counts['pending']}\n"
+    ]
+    lines += [f"{STATUS_ICONS[i['status']]} {format_item(i)}" for i in items[:limit]]
+    if len(items) > limit:
+        lines.append(f"... и еще {len(items) - limit}")
+    return "\n".join(lines)